@@ -0,0 +1,206 @@
+"""
+Offline stand-ins for the structured-output LLM calls, used by the benchmarks.
+
+A stand-in factory is installed with chat_clients.use_stand_in(...). FakeLLM answers from the
+expected verdict of the message being evaluated after a sampled latency; CassettePlayer replays
+responses recorded by CassetteRecorder from the live provider.
+"""
+import asyncio
+import contextvars
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Type
+
+import xxhash
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel
+
+# Corpus entry being evaluated; set by the benchmark around every associate_flag call.
+current_entry: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("current_entry", default={})
+
+STAGES = {
+    "FlagResponse": "initial_flag_content",
+    "JudgmentResponse": "judgement",
+    "ModerationResponse": "single_pass",
+}
+
+
+class LatencyDistribution:
+    """
+    Parses latency specs like "none", "fixed:0.3", "uniform:0.2,0.8" or "lognormal:-1.2,0.5"
+    (mu and sigma of the underlying normal, in seconds).
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",")] if params else []
+
+        if kind == "none":
+            self._sample = lambda: 0.0
+        elif kind == "fixed":
+            self._sample = lambda: values[0]
+        elif kind == "uniform":
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            self._sample = lambda: random.lognormvariate(values[0], values[1])
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        return self._sample()
+
+
+class StageTimer:
+    """
+    Collects the wall time of every stand-in call, per pipeline stage.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self._llm_time = contextvars.ContextVar("llm_time", default=None)
+
+    def start_message(self) -> List[float]:
+        llm_time = [0.0]
+        self._llm_time.set(llm_time)
+        return llm_time
+
+    def record(self, stage: str, duration: float, llm_seconds: float):
+        self.durations[stage].append(duration)
+        llm_time = self._llm_time.get()
+        if llm_time is not None:
+            llm_time[0] += llm_seconds
+
+
+def fake_response(schema: Type[BaseModel], expected: Dict[str, Any]) -> Dict[str, Any]:
+    classification = expected.get("classification", "CLEAN")
+    clean = classification == "CLEAN"
+    message_action = expected.get("user_message_action", "DISMISS" if clean else "DELETE")
+    account_action = expected.get("user_account_action", "DISMISS")
+
+    values = {
+        "classification": classification,
+        "confidence": expected.get("confidence", "High"),
+        "level": "Low" if clean else "High",
+        "primary_evidence": None if clean else "fake evidence",
+        "reasoning": None if clean else "fake reasoning",
+        "user_account_action": account_action,
+        "user_message_action": message_action,
+        "action_confidence": expected.get("action_confidence", "4"),
+        "message_to_user": None if clean else "پیام شما حذف شد.",
+    }
+    if schema.__name__ == "JudgmentResponse":
+        values["confidence"] = values["action_confidence"]
+        values["reasoning"] = values["reasoning"] or ""
+
+    return {name: values[name] for name in schema.model_fields if name in values}
+
+
+def prompt_key(schema: Type[BaseModel], prompt: List[BaseMessage]) -> str:
+    content = "\x1e".join(str(message.content) for message in prompt)
+    return f"{schema.__name__}:{xxhash.xxh3_64_hexdigest(content)}"
+
+
+class FakeLLM:
+    """
+    Answers with the entry's "expected" verdict (CLEAN by default) after a sampled latency.
+    The response goes through JSON parsing and pydantic validation like a real one.
+    """
+
+    def __init__(self, latency: LatencyDistribution, timer: StageTimer):
+        self.latency = latency
+        self.timer = timer
+
+    def __call__(self, model_name: str, schema: Type[BaseModel]) -> Runnable:
+        stage = STAGES.get(schema.__name__, schema.__name__)
+
+        async def invoke(prompt: List[BaseMessage]) -> BaseModel:
+            started = time.perf_counter()
+            delay = self.latency.sample()
+            if delay:
+                await asyncio.sleep(delay)
+
+            raw = json.dumps(fake_response(schema, current_entry.get().get("expected", {})), ensure_ascii=False)
+            result = schema.model_validate_json(raw)
+
+            self.timer.record(stage, time.perf_counter() - started, delay)
+            return result
+
+        return RunnableLambda(invoke)
+
+
+class CassettePlayer:
+    """
+    Replays recorded responses, keyed by schema and prompt content, with their recorded latency.
+    """
+
+    def __init__(self, path: str, timer: StageTimer, fallback: Optional[Callable] = None, speed: float = 1.0):
+        self.timer = timer
+        self.fallback = fallback
+        self.speed = speed
+        self.missing = 0
+
+        self.responses: Dict[str, Dict[str, Any]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record["key"]] = record
+
+    def __call__(self, model_name: str, schema: Type[BaseModel]) -> Runnable:
+        stage = STAGES.get(schema.__name__, schema.__name__)
+        fallback = self.fallback(model_name, schema) if self.fallback else None
+
+        async def invoke(prompt: List[BaseMessage]) -> BaseModel:
+            record = self.responses.get(prompt_key(schema, prompt))
+            if record is None:
+                self.missing += 1
+                if fallback is None:
+                    raise KeyError(f"No recorded {schema.__name__} response for this prompt")
+                return await fallback.ainvoke(prompt)
+
+            started = time.perf_counter()
+            delay = record["latency"] * self.speed
+            if delay:
+                await asyncio.sleep(delay)
+
+            result = schema.model_validate_json(record["response"])
+            self.timer.record(stage, time.perf_counter() - started, delay)
+            return result
+
+        return RunnableLambda(invoke)
+
+
+class CassetteRecorder:
+    """
+    Wraps the live structured runnables and appends every response to a cassette file.
+    """
+
+    def __init__(self, path: str, live: Callable[[str, Type[BaseModel]], Runnable], timer: StageTimer):
+        self.live = live
+        self.timer = timer
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, model_name: str, schema: Type[BaseModel]) -> Runnable:
+        stage = STAGES.get(schema.__name__, schema.__name__)
+        runnable = self.live(model_name, schema)
+
+        async def invoke(prompt: List[BaseMessage]) -> BaseModel:
+            started = time.perf_counter()
+            result = await runnable.ainvoke(prompt)
+            elapsed = time.perf_counter() - started
+
+            self._file.write(json.dumps({
+                "key": prompt_key(schema, prompt),
+                "latency": elapsed,
+                "response": result.model_dump_json(),
+            }, ensure_ascii=False) + "\n")
+            self.timer.record(stage, elapsed, elapsed)
+            return result
+
+        return RunnableLambda(invoke)
+
+    def close(self):
+        self._file.close()
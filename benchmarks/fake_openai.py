@@ -0,0 +1,149 @@
+"""
+Local OpenAI-compatible server for load tests.
+
+Answers /chat/completions requests for the structured-output schemas of evaluation.flag after a
+sampled latency. A message is classified as SPAM when it contains spam_marker, otherwise CLEAN.
+
+The answer takes token_latency per generated token (counted as 4 characters) on top of the
+sampled latency. Streamed requests get their tokens as they are generated and stop being
+generated when the client disconnects, like a provider cancelling a generation.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from benchmarks.fake_llm import LatencyDistribution, fake_response
+from evaluation.flag import FlagResponse, JudgmentResponse, ModerationResponse
+
+SCHEMAS = {schema.__name__: schema for schema in (FlagResponse, JudgmentResponse, ModerationResponse)}
+
+
+class FakeOpenAIServer:
+
+    def __init__(self, latency: LatencyDistribution, spam_marker: str = "t.me/", host: str = "127.0.0.1",
+                 port: int = 0, token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.spam_marker = spam_marker
+        self.host = host
+        self.port = port
+
+        self.requests: Counter = Counter()
+        self.tokens_generated = 0
+        self.streams_cancelled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/v1/models", self._models)
+        app.router.add_post("/v1/chat/completions", self._completions)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolves port 0 to the one picked by the OS.
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": dict(self.requests), "max_in_flight": self.max_in_flight,
+                "tokens_generated": self.tokens_generated, "streams_cancelled": self.streams_cancelled}
+
+    async def _models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": []})
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        schema_name = payload["response_format"]["json_schema"]["name"]
+        schema = SCHEMAS[schema_name]
+        self.requests[schema_name] += 1
+
+        tail = payload["messages"][-1]["content"]
+        expected = {"classification": "SPAM"} if self.spam_marker in tail else {}
+        content = json.dumps(fake_response(schema, expected), ensure_ascii=False)
+        tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        prompt_chars = sum(len(message["content"]) for message in payload["messages"])
+        usage = {
+            "prompt_tokens": prompt_chars // 3,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_chars // 3 + len(tokens),
+        }
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency.sample()
+            if delay:
+                await asyncio.sleep(delay)
+
+            if payload.get("stream"):
+                return await self._stream(request, payload, tokens, usage)
+
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency * len(tokens))
+            self.tokens_generated += len(tokens)
+        finally:
+            self.in_flight -= 1
+
+        return web.json_response({
+            "id": f"chatcmpl-{self.requests.total()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    async def _stream(self, request: web.Request, payload: Dict[str, Any], tokens: List[str],
+                      usage: Dict[str, int]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        chunk_id = f"chatcmpl-{self.requests.total()}"
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra: Any) -> bytes:
+            choices = [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}] \
+                if delta is not None else []
+            chunk = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": payload["model"], "choices": choices, **extra}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+        try:
+            await response.prepare(request)
+            for i, token in enumerate(tokens):
+                if self.token_latency:
+                    await asyncio.sleep(self.token_latency)
+                await response.write(event({"role": "assistant", "content": token} if i == 0 else {"content": token}))
+                self.tokens_generated += 1
+
+            await response.write(event({}, finish_reason="stop"))
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                await response.write(event(None, usage=usage))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionError:
+            self.streams_cancelled += 1
+            return response
+        except asyncio.CancelledError:
+            self.streams_cancelled += 1
+            raise
+
+        await response.write_eof()
+        return response
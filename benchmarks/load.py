@@ -0,0 +1,453 @@
+"""
+End-to-end load generator for the Telegram pipeline.
+
+Synthetic group messages are fed into the real dispatcher (UserMiddleware, handle_message, the
+database writers, evaluation, delete/send calls) through a fake Bot session, with the LLM served
+by a local OpenAI-compatible server. The bot is started through Warden like in production, on a
+throwaway SQLite database unless --db is given (DB_CONNECTION is ignored, so a load test never
+writes to the real database).
+
+Load is open-loop: every step offers a fixed rate of messages per second, and messages that
+arrive while max-in-flight handlers are running are rejected, like the webhook does with a 503.
+For each step the report shows sustained throughput (messages completed while the step was
+sending), how long the rest took to drain, end-to-end latency percentiles, database queries per
+message, Bot API calls per message and event loop lag. The first step that can't keep up is
+reported as the saturation point.
+
+    python -m benchmarks.load --rates 25,50,100,200 --duration 20 --groups 20 --users 50
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Optional, Tuple
+
+import structlog
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetChatAdministrators, SendMessage, TelegramMethod
+from aiogram.types import Message, Update
+from dotenv import load_dotenv
+
+# Module-level settings are read from the environment at import time.
+load_dotenv()
+
+from benchmarks.fake_llm import LatencyDistribution
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.single_pass import percentile
+from clients.openai import close_chat_clients
+from database.database import init_db, close_db
+from database.models import GroupInfo, User
+from database.writer import credit_writer, message_writer, user_writer, verdict_writer
+from evaluation.flag import init_llm_clients
+from evaluation.flood import flood_detector
+from evaluation.scheduler import evaluation_scheduler
+from evaluation.verdict_cache import verdict_cache
+from metrics.server import metrics_server
+from telegram.deletions import deletion_scheduler
+from telegram.middlewares import RequestMetricsMiddleware
+from telegram.telegram import dispatcher
+from warden.warden import Warden
+
+SPAM_MARKER = "t.me/"
+
+ENGLISH_MESSAGES = [
+    "hi everyone, how is it going?",
+    "does anyone know how to fix this error?",
+    "thanks, that worked for me",
+    "I think the docs cover this, check the second section",
+    "what time is the meetup tomorrow?",
+    "lol",
+    "can someone review my pull request?",
+    "the new release looks great",
+]
+
+PERSIAN_MESSAGES = [
+    "سلام به همه، خوبید؟",
+    "کسی می‌دونه این خطا رو چطور درست کنم؟",
+    "ممنون، مشکلم حل شد",
+    "به نظرم توی مستندات توضیح داده شده",
+    "جلسه فردا ساعت چنده؟",
+    "خیلی عالی بود",
+    "میشه یکی کد من رو بررسی کنه؟",
+    "نسخه جدید خیلی بهتر شده",
+]
+
+SPAM_MESSAGES = [
+    "Cheap followers and likes, join now t.me/{0}",
+    "Earn $500 a day from home!!! t.me/{0}",
+    "فروش ویژه فالوور با تخفیف، همین الان عضو شو t.me/{0}",
+    "کسب درآمد روزانه بدون سرمایه t.me/{0}",
+]
+
+
+class FakeSession(BaseSession):
+    """
+    Bot API session that answers every call locally after a sampled latency.
+    """
+
+    def __init__(self, latency: LatencyDistribution):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+
+        delay = self.latency.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+        if isinstance(method, SendMessage):
+            return Message.model_validate({
+                "message_id": next(self._message_ids),
+                "date": datetime.now(timezone.utc),
+                "chat": {"id": method.chat_id, "type": "supergroup" if int(method.chat_id) < 0 else "private"},
+                "text": method.text,
+            }, context={"bot": bot})
+
+        if isinstance(method, GetChatAdministrators):
+            # No admins, so every generated message is moderated.
+            return []
+
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        # The bot downloads no files under load, every download is empty.
+        return
+        yield
+
+
+class QueryCounter(logging.Handler):
+    """
+    Counts database queries from Tortoise's debug log.
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+    def install(self):
+        db_logger = logging.getLogger("tortoise.db_client")
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.propagate = False
+        db_logger.addHandler(self)
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a periodic timer fires, i.e. how long callbacks wait for the event loop.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+
+class MessageMix:
+    """
+    Generates group messages from a fixed population of groups and users. A spam burst is one user
+    sending the same spam message several times in a row.
+    """
+
+    def __init__(self, groups: int, users: int, persian_ratio: float, spam_ratio: float, burst_size: int,
+                 reply_ratio: float):
+        self.group_ids = [-1_000_000_000_000 - i for i in range(groups)]
+        self.user_ids = list(range(10_000, 10_000 + users))
+        self.persian_ratio = persian_ratio
+        self.spam_ratio = spam_ratio
+        self.burst_size = burst_size
+        self.reply_ratio = reply_ratio
+
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._burst: List[Tuple[int, int, str]] = []
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._burst:
+            group_id, user_id, text = self._burst.pop()
+            return self._update(group_id, user_id, text, spam=True)
+
+        group_id = random.choice(self.group_ids)
+        user_id = random.choice(self.user_ids)
+
+        if random.random() < self.spam_ratio / self.burst_size:
+            text = random.choice(SPAM_MESSAGES).format(f"promo{random.randrange(1000)}")
+            self._burst = [(group_id, user_id, text)] * (self.burst_size - 1)
+            return self._update(group_id, user_id, text, spam=True)
+
+        messages = PERSIAN_MESSAGES if random.random() < self.persian_ratio else ENGLISH_MESSAGES
+        return self._update(group_id, user_id, random.choice(messages), spam=False)
+
+    def _update(self, group_id: int, user_id: int, text: str, spam: bool) -> Dict[str, Any]:
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": datetime.now(timezone.utc),
+            "chat": {"id": group_id, "type": "supergroup", "title": f"Load test group {-group_id % 1000}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        }
+        if not spam and message_id > 1 and random.random() < self.reply_ratio:
+            message["reply_to_message"] = {
+                "message_id": message_id - 1,
+                "date": datetime.now(timezone.utc),
+                "chat": message["chat"],
+                "text": random.choice(ENGLISH_MESSAGES),
+            }
+
+        return {"update_id": next(self._update_ids), "message": message}
+
+
+async def seed_groups(mix: MessageMix, owner_id: int = 1):
+    """
+    Registers the groups, as the owner would by forwarding a message to the bot.
+    """
+    await User.get_or_create(id=owner_id, defaults={"first_name": "Owner"})
+    existing = set(await GroupInfo.filter(id__in=mix.group_ids).values_list("id", flat=True))
+    await GroupInfo.bulk_create([
+        GroupInfo(
+            id=group_id,
+            name=f"Load test group {-group_id % 1000}",
+            rules_context="A programming community. No advertisements, no spam, be respectful.",
+            owner_id=owner_id,
+        )
+        for group_id in mix.group_ids if group_id not in existing
+    ])
+
+
+class LoadGenerator:
+
+    def __init__(self, args, server: FakeOpenAIServer):
+        self.args = args
+        self.server = server
+        self.session = FakeSession(LatencyDistribution(args.bot_latency))
+        self.bot = Bot(token="42:load-test", session=self.session)
+        self.bot.session.middleware(RequestMetricsMiddleware())
+        self.mix = MessageMix(args.groups, args.users, args.persian_ratio, args.spam_ratio, args.burst_size,
+                              args.reply_ratio)
+        self.queries = QueryCounter()
+        self.results: List[Dict[str, Any]] = []
+
+    async def __call__(self, mode: str = "polling"):
+        """
+        Runs the load steps in place of init_telegram, once Warden has started everything else.
+        """
+        self.queries.install()
+        deletion_scheduler.bind(self.bot)
+        await seed_groups(self.mix)
+
+        for rate in self.args.rates:
+            result = await self.step(rate)
+            self.results.append(result)
+            self.report(result)
+
+            if self.args.stop_at_saturation and result["saturated"]:
+                break
+
+        saturated = next((r for r in self.results if r["saturated"]), None)
+        if saturated:
+            print(f"saturation point: {saturated['offered']} msg/s offered, "
+                  f"{saturated['throughput']:.1f} msg/s sustained")
+        else:
+            print("no saturation up to the highest rate")
+
+    async def step(self, rate: float) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        latencies: List[float] = []
+        finished: List[float] = []
+        errors = 0
+        rejected = 0
+        in_flight = 0
+        tasks = set()
+
+        async def handle(update: Update):
+            nonlocal in_flight, errors
+            started = time.perf_counter()
+            try:
+                await dispatcher.feed_update(self.bot, update)
+                latencies.append(time.perf_counter() - started)
+                finished.append(loop.time())
+            except Exception:
+                errors += 1
+            finally:
+                in_flight -= 1
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        queries_before = self.queries.count
+        calls_before = sum(self.session.calls.values())
+        llm_before = self.server.requests.total()
+        shed_before = evaluation_scheduler.shed
+
+        started = loop.time()
+        sent = 0
+        while True:
+            now = loop.time()
+            if now - started >= self.args.duration:
+                break
+
+            # Catch up on every message due by now, so a slow loop doesn't lower the offered rate.
+            due = int((now - started) * rate) + 1
+            while sent < due:
+                sent += 1
+                update = Update.model_validate(next(self.mix), context={"bot": self.bot})
+                if in_flight >= self.args.max_in_flight:
+                    rejected += 1
+                    continue
+
+                in_flight += 1
+                task = asyncio.create_task(handle(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.sleep(max(0.0, started + sent / rate - loop.time()))
+
+        sending_time = loop.time() - started
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.drain_timeout)
+        elapsed = loop.time() - started
+        await monitor.stop()
+
+        completed = len(latencies)
+        # Only what the bot got through while messages were offered; the drain is reported on its own.
+        window_end = started + sending_time
+        throughput = sum(1 for at in finished if at <= window_end) / sending_time if sending_time else 0.0
+        p95 = percentile(latencies, 0.95)
+
+        return {
+            "offered": rate,
+            "sent": sent,
+            "completed": completed,
+            "rejected": rejected,
+            "errors": errors,
+            "unfinished": len(tasks),
+            "throughput": throughput,
+            "drain": elapsed - sending_time,
+            "latencies": latencies,
+            "loop_lag": monitor.samples,
+            "queries_per_message": (self.queries.count - queries_before) / max(completed, 1),
+            "bot_calls_per_message": (sum(self.session.calls.values()) - calls_before) / max(completed, 1),
+            "llm_calls_per_message": (self.server.requests.total() - llm_before) / max(completed, 1),
+            "shed": evaluation_scheduler.shed - shed_before,
+            "saturated": bool(
+                rejected or errors or len(tasks)
+                or throughput < rate * 0.95
+                or (self.args.max_p95 and p95 > self.args.max_p95)
+            ),
+        }
+
+    def report(self, result: Dict[str, Any]):
+        latencies, lag = result["latencies"], result["loop_lag"]
+        print(f"{result['offered']:g} msg/s offered: {result['throughput']:.1f} msg/s sustained, "
+              f"{result['completed']}/{result['sent']} completed, {result['rejected']} rejected, "
+              f"{result['errors']} errors, {result['unfinished']} unfinished, drained in {result['drain']:.2f}s"
+              f"{'  [saturated]' if result['saturated'] else ''}")
+        print(f"  latency    p50={percentile(latencies, 0.5) * 1000:.1f}ms "
+              f"p95={percentile(latencies, 0.95) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms")
+        print(f"  loop lag   p50={percentile(lag, 0.5) * 1000:.1f}ms p99={percentile(lag, 0.99) * 1000:.1f}ms "
+              f"max={max(lag, default=0) * 1000:.1f}ms")
+        print(f"  per msg    db queries={result['queries_per_message']:.2f} "
+              f"bot calls={result['bot_calls_per_message']:.2f} llm calls={result['llm_calls_per_message']:.2f} "
+              f"shed={result['shed']}")
+
+
+async def run(args):
+    server = FakeOpenAIServer(LatencyDistribution(args.llm_latency), spam_marker=SPAM_MARKER,
+                              token_latency=args.llm_token_latency)
+    await server.start()
+
+    os.environ["OPENROUTER_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENROUTER_KEY", "load-test")
+
+    if not args.flood:
+        # The mix reuses a few clean sentences across a small population, which the flood checks
+        # would take for repeats and raids and delete without the LLM.
+        flood_detector.limits = replace(flood_detector.limits, max_messages=0, max_repeats=0, raid_users=0)
+
+    generator = LoadGenerator(args, server)
+    warden = Warden(
+        init_telegram=generator,
+        init_db=init_db,
+        close_db=close_db,
+        init_clients=init_llm_clients,
+        close_clients=close_chat_clients,
+        services=[metrics_server, user_writer, message_writer, credit_writer, verdict_writer, deletion_scheduler],
+    )
+    try:
+        await warden.start()
+    finally:
+        await server.stop()
+
+    print(f"llm server: {server.stats()}")
+    print(f"bot api calls: {dict(generator.session.calls)}")
+    print(f"verdict cache: {verdict_cache.stats()}")
+    print(f"writers: users={user_writer.stats()} messages={message_writer.stats()} verdicts={verdict_writer.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", default="25,50,100,200", help="offered msg/s per step, comma separated")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per step")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--stop-at-saturation", action="store_true")
+    parser.add_argument("--max-p95", type=float, default=0, help="also count a step as saturated above this p95 (s)")
+    parser.add_argument("--max-in-flight", type=int, default=int(os.getenv("TELEGRAM_MAX_IN_FLIGHT", "100")))
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--persian-ratio", type=float, default=0.6)
+    parser.add_argument("--spam-ratio", type=float, default=0.1, help="share of messages that are spam")
+    parser.add_argument("--burst-size", type=int, default=5, help="messages per spam burst")
+    parser.add_argument("--reply-ratio", type=float, default=0.2)
+    parser.add_argument("--flood", action="store_true", help="keep the FLOOD_* checks on")
+    parser.add_argument("--llm-latency", default="lognormal:-1.0,0.4",
+                        help="none, fixed:S, uniform:A,B or lognormal:MU,SIGMA")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0,
+                        help="seconds per generated token on top of --llm-latency")
+    parser.add_argument("--bot-latency", default="uniform:0.02,0.08")
+    parser.add_argument("--db", help="database url, defaults to a new SQLite file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",")]
+
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(getattr(logging, args.log_level)))
+
+    os.environ["DB_CONNECTION"] = args.db or f"sqlite://{tempfile.mkdtemp(prefix='warden-load-')}/db.sqlite"
+
+    asyncio.run(run(args))
@@ -0,0 +1,162 @@
+"""
+Replays a JSONL corpus through the evaluation pipeline without a provider.
+
+The LLM calls are served by a stand-in: a fake with a configurable latency distribution, or a
+cassette of responses recorded earlier with --record. The report shows throughput, latency
+percentiles per stage, the pipeline's own overhead (total time minus time spent in the LLM) and,
+with --trace-allocations, the memory allocated per message.
+
+    python -m benchmarks.replay corpus.jsonl [--latency lognormal:-1.2,0.5] [--concurrency 8]
+    python -m benchmarks.replay corpus.jsonl --cassette cassette.jsonl
+    python -m benchmarks.replay corpus.jsonl --record cassette.jsonl      # needs OPENROUTER_KEY
+
+Corpus lines use the format of benchmarks.single_pass, plus an optional "expected" object
+({"classification", "user_message_action", ...}) that the fake answers with.
+
+--max-p95-overhead-ms exits with status 1 when the overhead p95 is above the threshold, for CI.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+from benchmarks.fake_llm import (
+    CassettePlayer, CassetteRecorder, FakeLLM, LatencyDistribution, StageTimer, current_entry,
+)
+from benchmarks.single_pass import percentile
+from clients.openai import ChatClientRegistry, MAIN_MODEL, chat_clients, close_chat_clients
+from evaluation.flag import associate_flag, MODE_TWO_STAGE, MODE_SINGLE_PASS
+from evaluation.resilience import llm_guard
+
+# Fixed so prompts, and therefore cassette keys, are the same on every run.
+REPLAY_TIME = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+async def evaluate(entry: Dict[str, Any], mode: str, model_name: str, timer: StageTimer,
+                   trace_allocations: bool) -> Dict[str, float]:
+    current_entry.set(entry)
+    llm_time = timer.start_message()
+
+    if trace_allocations:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+
+    started = time.perf_counter()
+    await associate_flag(
+        first_name=entry.get("first_name", "User"),
+        message=entry["message"],
+        group_title=entry.get("group_title", "Test Group"),
+        group_context=entry.get("group_context", ""),
+        user_message_history=entry.get("user_message_history", []),
+        current_time=REPLAY_TIME,
+        model_name=model_name,
+        mode=mode,
+    )
+    total = time.perf_counter() - started
+
+    result = {"total": total, "overhead": total - llm_time[0]}
+    if trace_allocations:
+        _, peak = tracemalloc.get_traced_memory()
+        result["allocated"] = peak - before
+
+    return result
+
+
+def print_percentiles(name: str, values: List[float], scale: float = 1000.0, unit: str = "ms"):
+    print(f"  {name:<22} p50={percentile(values, 0.5) * scale:8.2f}{unit} "
+          f"p95={percentile(values, 0.95) * scale:8.2f}{unit} "
+          f"p99={percentile(values, 0.99) * scale:8.2f}{unit} n={len(values)}")
+
+
+async def run(args) -> int:
+    with open(args.corpus, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()][:args.limit or None]
+
+    if not entries:
+        print("Empty corpus")
+        return 0
+
+    # Overhead is measured against one LLM call per stage, which hedged requests would break.
+    llm_guard.hedge = args.hedge
+
+    timer = StageTimer()
+    recorder, live = None, ChatClientRegistry()
+    if args.record:
+        recorder = CassetteRecorder(args.record, live.structured, timer)
+        chat_clients.use_stand_in(recorder)
+    elif args.cassette:
+        fallback = FakeLLM(LatencyDistribution(args.latency), timer) if args.allow_missing else None
+        chat_clients.use_stand_in(CassettePlayer(args.cassette, timer, fallback=fallback, speed=args.speed))
+    else:
+        chat_clients.use_stand_in(FakeLLM(LatencyDistribution(args.latency), timer))
+
+    # Warm-up so one-off costs (graph compilation, prompt prefixes, tokenizer) don't skew the run.
+    for entry in entries[:args.warmup]:
+        await evaluate(entry, args.mode, args.model, StageTimer(), False)
+    timer.durations.clear()
+
+    if args.trace_allocations:
+        tracemalloc.start()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(entry):
+        async with semaphore:
+            return await evaluate(entry, args.mode, args.model, timer, args.trace_allocations)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bounded(entry) for entry in entries))
+    elapsed = time.perf_counter() - started
+
+    if args.trace_allocations:
+        tracemalloc.stop()
+    if recorder is not None:
+        recorder.close()
+    chat_clients.use_stand_in(None)
+    await live.aclose()
+    await close_chat_clients()
+
+    print(f"{len(results)} messages, mode {args.mode}, concurrency {args.concurrency}")
+    print(f"  throughput             {len(results) / elapsed:.1f} msg/s")
+    for stage, durations in sorted(timer.durations.items()):
+        print_percentiles(stage, durations)
+    print_percentiles("total", [r["total"] for r in results])
+    print_percentiles("overhead", [r["overhead"] for r in results])
+    if args.trace_allocations:
+        print_percentiles("allocated", [r["allocated"] for r in results], scale=1 / 1024, unit="KiB")
+
+    overhead_p95 = percentile([r["overhead"] for r in results], 0.95) * 1000
+    if args.max_p95_overhead_ms and overhead_p95 > args.max_p95_overhead_ms:
+        print(f"overhead p95 {overhead_p95:.2f}ms is above {args.max_p95_overhead_ms:.2f}ms")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--model", default=MAIN_MODEL)
+    parser.add_argument("--mode", default=MODE_TWO_STAGE, choices=[MODE_TWO_STAGE, MODE_SINGLE_PASS])
+    parser.add_argument("--latency", default="none", help="none, fixed:S, uniform:A,B or lognormal:MU,SIGMA")
+    parser.add_argument("--cassette", help="replay responses recorded with --record")
+    parser.add_argument("--allow-missing", action="store_true", help="use the fake for prompts not in the cassette")
+    parser.add_argument("--speed", type=float, default=1.0, help="scale recorded latencies, 0 to skip them")
+    parser.add_argument("--record", help="call the provider and append its responses to this cassette")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--hedge", action="store_true", help="hedge slow LLM calls like the bot does")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--trace-allocations", action="store_true")
+    parser.add_argument("--max-p95-overhead-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(run(args)))
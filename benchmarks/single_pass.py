@@ -0,0 +1,104 @@
+"""
+Compares the single-pass moderation mode against the two-stage pipeline.
+
+Every message of a JSONL corpus is evaluated in both modes against the live provider. The report
+shows latency percentiles and token usage per mode and how often the two modes agree.
+
+    python -m benchmarks.single_pass corpus.jsonl [--limit N] [--model MODEL]
+
+Each corpus line holds "message" and optionally "first_name", "group_title", "group_context"
+and "user_message_history" (a list of {"text", "created_at", "replied_to_text"}).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+from clients.openai import MAIN_MODEL, close_chat_clients
+from evaluation.flag import associate_flag, MODE_TWO_STAGE, MODE_SINGLE_PASS
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def evaluate(entry: Dict[str, Any], mode: str, model_name: str) -> Dict[str, Any]:
+    usage = UsageMetadataCallbackHandler()
+    started = time.perf_counter()
+
+    flag_response, judgment = await associate_flag(
+        first_name=entry.get("first_name", "User"),
+        message=entry["message"],
+        group_title=entry.get("group_title", "Test Group"),
+        group_context=entry.get("group_context", ""),
+        user_message_history=entry.get("user_message_history", []),
+        current_time=datetime.now(timezone.utc),
+        model_name=model_name,
+        mode=mode,
+        config={"callbacks": [usage]},
+    )
+
+    return {
+        "latency": time.perf_counter() - started,
+        "input_tokens": sum(u.get("input_tokens", 0) for u in usage.usage_metadata.values()),
+        "output_tokens": sum(u.get("output_tokens", 0) for u in usage.usage_metadata.values()),
+        "classification": flag_response.classification,
+        "message_action": judgment.user_message_action if judgment else "DISMISS",
+    }
+
+
+def summarize(mode: str, results: List[Dict[str, Any]]):
+    latencies = [r["latency"] for r in results]
+    print(f"{mode}:")
+    print(f"  latency p50={percentile(latencies, 0.5):.3f}s p95={percentile(latencies, 0.95):.3f}s "
+          f"mean={statistics.fmean(latencies):.3f}s")
+    print(f"  tokens  input={statistics.fmean(r['input_tokens'] for r in results):.0f} "
+          f"output={statistics.fmean(r['output_tokens'] for r in results):.0f} (mean per message)")
+
+
+async def run(corpus: str, limit: int, model_name: str):
+    with open(corpus, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()][:limit or None]
+
+    two_stage, single = [], []
+    for entry in entries:
+        two_stage.append(await evaluate(entry, MODE_TWO_STAGE, model_name))
+        single.append(await evaluate(entry, MODE_SINGLE_PASS, model_name))
+
+    await close_chat_clients()
+
+    if not entries:
+        print("Empty corpus")
+        return
+
+    print(f"{len(entries)} messages, model {model_name}")
+    summarize(MODE_TWO_STAGE, two_stage)
+    summarize(MODE_SINGLE_PASS, single)
+
+    pairs = list(zip(two_stage, single))
+    print("agreement:")
+    print(f"  classification  {sum(a['classification'] == b['classification'] for a, b in pairs) / len(pairs):.1%}")
+    print(f"  clean/flagged   "
+          f"{sum((a['classification'] == 'CLEAN') == (b['classification'] == 'CLEAN') for a, b in pairs) / len(pairs):.1%}")
+    print(f"  message action  {sum(a['message_action'] == b['message_action'] for a, b in pairs) / len(pairs):.1%}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--model", default=MAIN_MODEL)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.corpus, args.limit, args.model))
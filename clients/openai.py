@@ -1,18 +1,251 @@
+import json
 import os
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type
 
+import httpx
+import openai
 from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManager
+from langchain_core.messages import AIMessage, BaseMessage, convert_to_openai_messages
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.runnables import Runnable, ensure_config
+from langchain_core.utils.function_calling import convert_to_openai_function
 from langchain_openai import ChatOpenAI
+from structlog import get_logger
 
-MAIN_MODEL = "google/gemini-2.0-flash-lite-001"
-WEAK_MODEL = "google/gemini-2.0-flash-lite-001"
+logger = get_logger()
 
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
-def create_chat_client(model_name: str, max_tokens=None) -> ChatOpenAI:
+MAIN_MODEL = os.getenv("MAIN_MODEL", "google/gemini-2.0-flash-lite-001")
+WEAK_MODEL = os.getenv("WEAK_MODEL", "google/gemini-2.0-flash-lite-001")
+
+# USD per million (prompt, completion) tokens, used for cost estimates
+MODEL_PRICES = {
+    "google/gemini-2.0-flash-lite-001": (0.075, 0.30),
+    "google/gemini-2.0-flash-001": (0.10, 0.40),
+    "google/gemini-2.5-flash": (0.30, 2.50),
+}
+
+
+def estimate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def get_base_url() -> str:
+    # Overridable to point the bot at another OpenAI-compatible endpoint, e.g. in load tests.
+    return os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL)
+
+
+def create_chat_client(model_name: str, max_tokens=None, http_async_client=None) -> ChatOpenAI:
     load_dotenv()
 
     return ChatOpenAI(
-        base_url="https://openrouter.ai/api/v1",
+        base_url=get_base_url(),
         api_key=os.getenv("OPENROUTER_KEY"),
         model_name=model_name,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        http_async_client=http_async_client,
+        # Retries, hedging and deadlines are handled by evaluation/resilience.py.
+        max_retries=int(os.getenv("OPENROUTER_MAX_RETRIES", "0")),
     )
+
+
+ClientKey = Tuple[str, Optional[int]]
+
+
+class ChatClientRegistry:
+    """
+    Process-wide pool of long-lived chat clients.
+
+    Clients are keyed by (model name, max tokens) and all of them share one keep-alive
+    httpx connection pool, so requests to OpenRouter reuse warm TLS connections instead
+    of building a new client (and handshake) for every message. Structured-output
+    runnables are cached per client and schema.
+    """
+
+    def __init__(self):
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._clients: Dict[ClientKey, ChatOpenAI] = {}
+        self._structured: Dict[Tuple[ClientKey, Type], Runnable] = {}
+        self._response_formats: Dict[Type, Dict[str, Any]] = {}
+        self._stand_in: Optional[Callable[[str, Type], Runnable]] = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            load_dotenv()
+
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100")),
+                    max_keepalive_connections=int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20")),
+                    keepalive_expiry=float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "120")),
+                ),
+                timeout=httpx.Timeout(float(os.getenv("OPENROUTER_TIMEOUT", "60")), connect=10.0),
+            )
+            # Clients built on a closed pool are unusable, drop them.
+            self._clients.clear()
+            self._structured.clear()
+
+        return self._http_client
+
+    def chat(self, model_name: str, max_tokens: Optional[int] = None) -> ChatOpenAI:
+        http_client = self.http_client
+        key = (model_name, max_tokens)
+
+        client = self._clients.get(key)
+        if client is None:
+            client = create_chat_client(model_name, max_tokens=max_tokens, http_async_client=http_client)
+            self._clients[key] = client
+
+        return client
+
+    def structured(self, model_name: str, schema: Type, max_tokens: Optional[int] = None) -> Runnable:
+        if self._stand_in is None:
+            # Reopens the pool if it was closed, dropping the runnables built on it.
+            _ = self.http_client
+
+        key = ((model_name, max_tokens), schema)
+
+        runnable = self._structured.get(key)
+        if runnable is None:
+            if self._stand_in is not None:
+                runnable = self._stand_in(model_name, schema)
+            else:
+                llm = self.chat(model_name, max_tokens=max_tokens)
+                runnable = llm.with_structured_output(schema=schema, strict=True)
+            self._structured[key] = runnable
+
+        return runnable
+
+    def response_format(self, schema: Type) -> Dict[str, Any]:
+        response_format = self._response_formats.get(schema)
+        if response_format is None:
+            function = convert_to_openai_function(schema, strict=True)
+            response_format = self._response_formats[schema] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": function["name"],
+                    "description": function.get("description", ""),
+                    "schema": function["parameters"],
+                    "strict": True,
+                },
+            }
+
+        return response_format
+
+    async def stream_json(self, model_name: str, schema: Type, prompt: List[BaseMessage]) -> AsyncIterator[str]:
+        """
+        Streams the JSON answer for schema as it's generated, for callers that act on its first
+        fields. Closing the iterator early closes the connection, which cancels the generation.
+
+        Deltas are read straight from the server-sent events: langchain's and the SDK's models
+        per chunk cost several times the CPU of the rest of the call. The run's callbacks still
+        see the call, with the usage of a complete answer or the text of a cancelled one. A
+        stand-in's answer arrives in one chunk.
+        """
+        if self._stand_in is not None:
+            yield (await self.structured(model_name, schema).ainvoke(prompt)).model_dump_json()
+            return
+
+        client = self.chat(model_name).root_async_client
+        config = ensure_config()
+        callbacks = AsyncCallbackManager.configure(
+            config.get("callbacks"), inheritable_tags=config.get("tags"), inheritable_metadata=config.get("metadata"),
+        )
+        (run,) = await callbacks.on_chat_model_start(
+            {"name": "ChatOpenAI"}, [prompt], invocation_params={"model_name": model_name, "stream": True},
+        )
+
+        text: List[str] = []
+        usage: Dict[str, Any] = {}
+        try:
+            async with client.chat.completions.with_streaming_response.create(
+                model=model_name,
+                messages=convert_to_openai_messages(prompt),
+                response_format=self.response_format(schema),
+                stream=True,
+                stream_options={"include_usage": True},
+            ) as response:
+                async for line in response.iter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+
+                    chunk = json.loads(line[6:])
+                    if "error" in chunk:
+                        raise openai.APIError(f"error in stream: {chunk['error']}", response.http_request,
+                                              body=chunk["error"])
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices") or ():
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            text.append(content)
+                            yield content
+        except BaseException as e:
+            await run.on_llm_error(e, response=LLMResult(generations=[[ChatGeneration(
+                message=AIMessage(content="".join(text)),
+            )]]))
+            raise
+
+        await run.on_llm_end(LLMResult(
+            generations=[[ChatGeneration(message=AIMessage(content="".join(text)))]],
+            llm_output={"token_usage": usage, "model_name": model_name},
+        ))
+
+    def use_stand_in(self, factory: Optional[Callable[[str, Type], Runnable]]):
+        """
+        Serves structured runnables built by factory instead of the provider, e.g. for offline
+        benchmarks. Passing None goes back to the provider.
+        """
+        self._stand_in = factory
+        self._structured.clear()
+
+    async def warmup(self, model_names, schemas=()):
+        """
+        Builds the clients and structured runnables up front and opens a connection to the
+        provider, so the first messages after startup don't pay for it.
+        """
+        for model_name in model_names:
+            for schema in schemas:
+                self.structured(model_name, schema)
+                self.response_format(schema)
+            self.chat(model_name)
+
+        try:
+            await self.http_client.get(
+                f"{get_base_url()}/models",
+                headers={"Authorization": f"Bearer {os.getenv('OPENROUTER_KEY')}"},
+            )
+        except httpx.HTTPError as e:
+            logger.warning("llm connection warmup failed", error=str(e))
+
+        logger.info("llm clients warmed up", clients=len(self._clients), runnables=len(self._structured))
+
+    async def aclose(self):
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+
+        self._http_client = None
+        self._clients.clear()
+        self._structured.clear()
+
+
+chat_clients = ChatClientRegistry()
+
+
+def get_chat_client(model_name: str, max_tokens=None) -> ChatOpenAI:
+    return chat_clients.chat(model_name, max_tokens=max_tokens)
+
+
+def get_structured_client(model_name: str, schema: Type, max_tokens=None) -> Runnable:
+    return chat_clients.structured(model_name, schema, max_tokens=max_tokens)
+
+
+def stream_structured(model_name: str, schema: Type, prompt: List[BaseMessage]) -> AsyncIterator[str]:
+    return chat_clients.stream_json(model_name, schema, prompt)
+
+
+async def close_chat_clients():
+    await chat_clients.aclose()
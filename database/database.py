@@ -1,6 +1,15 @@
 import os
+from typing import Any, Set
 
+from structlog import get_logger
 from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+logger = get_logger()
+
+
+def is_sqlite() -> bool:
+    return Tortoise.get_connection("default").capabilities.dialect == "sqlite"
 
 
 async def init_db():
@@ -10,4 +19,71 @@ async def init_db():
         db_url=db_url,
         modules={"models": ["database.models"]},
     )
+
+    if is_sqlite():
+        connection = Tortoise.get_connection("default")
+        _, tables = await connection.execute_query("SELECT count(*) FROM sqlite_master")
+        if tables[0][0] == 0:
+            # New database: enable incremental vacuum for the retention job. Switching an
+            # existing database needs a full VACUUM, which is left to the operator.
+            await connection.execute_script("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+
     await Tortoise.generate_schemas()
+    await add_missing_columns()
+
+
+async def close_db():
+    await Tortoise.close_connections()
+
+
+async def _table_columns(connection: BaseDBAsyncClient, dialect: str, table: str) -> Set[str]:
+    if dialect == "sqlite":
+        _, rows = await connection.execute_query(f'PRAGMA table_info("{table}")')
+        return {row["name"] for row in rows}
+
+    _, rows = await connection.execute_query(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = $1", [table]
+    )
+    return {row["column_name"] for row in rows}
+
+
+def _sql_literal(value: Any) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+async def add_missing_columns():
+    """
+    generate_schemas only creates missing tables. Columns added to existing models are
+    added here, as long as they are nullable or have a constant default.
+    """
+    connection = Tortoise.get_connection("default")
+    dialect = connection.capabilities.dialect
+    if dialect not in ("sqlite", "postgres"):
+        return
+
+    for model in Tortoise.apps["models"].values():
+        table = model._meta.db_table
+        existing = await _table_columns(connection, dialect, table)
+        if not existing:
+            continue
+
+        for field_name, column in model._meta.fields_db_projection.items():
+            if column in existing:
+                continue
+
+            field = model._meta.fields_map[field_name]
+            statement = f'ALTER TABLE "{table}" ADD COLUMN "{column}" {field.get_for_dialect(dialect, "SQL_TYPE")}'
+            if field.null:
+                statement += " NULL"
+            elif field.default is not None and not callable(field.default):
+                statement += f" NOT NULL DEFAULT {_sql_literal(field.default)}"
+            else:
+                logger.warning("column can't be added automatically", table=table, column=column)
+                continue
+
+            await connection.execute_script(statement)
+            logger.info("column added", table=table, column=column)
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database.models import GroupInfo
+
+
+class GroupCache:
+    """
+    In-memory GroupInfo snapshots keyed by group id.
+
+    Concurrent misses for the same group share a single database load. Entries are dropped
+    by invalidate() whenever a group is edited, and expire after ttl seconds as a safety net.
+    The returned instances are shared and must not be modified.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 50_000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._groups: "OrderedDict[int, Tuple[GroupInfo, float]]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_loads = 0
+        self.invalidations = 0
+
+    async def get_or_create(self, group_id: int, defaults: Optional[Dict[str, Any]] = None) -> GroupInfo:
+        cached = self._groups.get(group_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self.hits += 1
+            return cached[0]
+
+        loading = self._loading.get(group_id)
+        if loading is not None:
+            self.shared_loads += 1
+            return await asyncio.shield(loading)
+
+        self.misses += 1
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[group_id] = loading
+        try:
+            group, _ = await GroupInfo.get_or_create(id=group_id, defaults=defaults)
+        except Exception as e:
+            loading.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting.
+            loading.exception()
+            raise
+        else:
+            loading.set_result(group)
+            # A concurrent invalidate() means this snapshot may already be stale.
+            if self._loading.get(group_id) is loading:
+                self._store(group_id, group)
+        finally:
+            if self._loading.get(group_id) is loading:
+                del self._loading[group_id]
+
+        return group
+
+    def invalidate(self, group_id: int):
+        self.invalidations += 1
+        self._groups.pop(group_id, None)
+        self._loading.pop(group_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.shared_loads
+        return {
+            "size": len(self._groups),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_loads": self.shared_loads,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.hits + self.shared_loads) / lookups if lookups else 0.0,
+        }
+
+    def _store(self, group_id: int, group: GroupInfo):
+        # Every entry lives for the same ttl, so insertion order is expiry order.
+        self._groups.pop(group_id, None)
+        self._groups[group_id] = (group, time.monotonic() + self.ttl)
+
+        while len(self._groups) > self.max_size:
+            self._groups.popitem(last=False)
+
+group_cache = GroupCache(
+    ttl=float(os.getenv("GROUP_CACHE_TTL", "600")),
+    max_size=int(os.getenv("GROUP_CACHE_MAX_SIZE", "50000")),
+)
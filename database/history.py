@@ -0,0 +1,140 @@
+import os
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from structlog import get_logger
+
+from database.models import UserGroupMessage
+
+logger = get_logger()
+
+HistoryKey = Tuple[int, int]
+
+
+class HistoryRecord:
+    """
+    Compact in-memory copy of the UserGroupMessage fields the evaluation needs.
+    """
+    __slots__ = ("message_id", "text", "message_created_at", "replied_to_message_text")
+
+    def __init__(self, message_id: int, text: str, message_created_at: datetime,
+                 replied_to_message_text: Optional[str] = None):
+        self.message_id = message_id
+        self.text = text
+        self.message_created_at = message_created_at
+        self.replied_to_message_text = replied_to_message_text
+
+    @classmethod
+    def from_model(cls, msg: UserGroupMessage) -> "HistoryRecord":
+        return cls(
+            message_id=msg.message_id,
+            text=msg.text,
+            message_created_at=msg.message_created_at,
+            replied_to_message_text=msg.replied_to_message_text,
+        )
+
+
+class _Buffer:
+    __slots__ = ("records", "warm")
+
+    def __init__(self, max_messages: int):
+        self.records: Deque[HistoryRecord] = deque(maxlen=max_messages)
+        self.warm = False
+
+
+class HistoryBuffer:
+    """
+    Bounded ring buffer of the last messages of every (user, group) pair.
+
+    Buffers are filled as messages are logged and loaded from the database the first time a
+    pair is looked up, so the history query only runs once per pair instead of per message.
+    Pairs that haven't been touched for a while are evicted first once max_keys is reached.
+    """
+
+    def __init__(self, max_messages: int = 10, window: timedelta = timedelta(minutes=5), max_keys: int = 100_000):
+        self.max_messages = max_messages
+        self.window = window
+        self.max_keys = max_keys
+
+        self._buffers: "OrderedDict[HistoryKey, _Buffer]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def recent(self, user_id: int, group_id: int, now: Optional[datetime] = None) -> List[HistoryRecord]:
+        """
+        Returns the user's messages in the group within the time window, newest first.
+        """
+        now = now or datetime.now(timezone.utc)
+        key = (user_id, group_id)
+
+        buffer = self._buffers.get(key)
+        if buffer is not None and buffer.warm:
+            self._buffers.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            buffer = await self._warm(key, now)
+
+        cutoff = now - self.window
+        return [record for record in reversed(buffer.records) if record.message_created_at >= cutoff]
+
+    def append(self, user_id: int, group_id: int, record: HistoryRecord):
+        key = (user_id, group_id)
+
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            # Not loaded yet; the next lookup merges the database rows in.
+            buffer = _Buffer(self.max_messages)
+            self._buffers[key] = buffer
+        else:
+            self._buffers.move_to_end(key)
+
+        buffer.records.append(record)
+        self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._buffers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    async def _warm(self, key: HistoryKey, now: datetime) -> _Buffer:
+        user_id, group_id = key
+        rows = await UserGroupMessage.filter(
+            user_id=user_id,
+            group_id=group_id,
+            message_created_at__gte=now - self.window,
+        ).order_by("-db_created_at").limit(self.max_messages)
+
+        # Messages may have been appended while the query was running.
+        buffer = self._buffers.get(key) or _Buffer(self.max_messages)
+        known = {record.message_id for record in buffer.records}
+        loaded = [HistoryRecord.from_model(row) for row in reversed(rows) if row.message_id not in known]
+
+        merged = _Buffer(self.max_messages)
+        merged.records.extend(loaded)
+        merged.records.extend(buffer.records)
+        merged.warm = True
+
+        self._buffers[key] = merged
+        self._buffers.move_to_end(key)
+        self._evict()
+
+        return merged
+
+    def _evict(self):
+        while len(self._buffers) > self.max_keys:
+            self._buffers.popitem(last=False)
+            self.evictions += 1
+
+
+history_buffer = HistoryBuffer(
+    max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", "10")),
+    window=timedelta(seconds=int(os.getenv("HISTORY_WINDOW_SECONDS", "300"))),
+    max_keys=int(os.getenv("HISTORY_MAX_KEYS", "100000")),
+)
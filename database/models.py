@@ -10,12 +10,38 @@ class User(Model):
 
 
 class SuspiciousMessage(Model):
-    id = fields.BigIntField(primary_key=True)
+    """
+    A verdict of the LLM on a group message, the training data of evaluation/classifier.py.
+    """
+    id = fields.BigIntField(primary_key=True) # Hash of the chat and message ids, see verdict_id
     user = fields.ForeignKeyField("models.User", related_name="suspicious_messages")
+    group_id = fields.BigIntField(null=True)
 
     message = fields.TextField()
+    classification = fields.CharField(max_length=32, default="")
+    confidence = fields.CharField(max_length=8, default="") # The classification's confidence
+    user_message_action = fields.CharField(max_length=16, default="") # Empty when the message was CLEAN
+    action_confidence = fields.CharField(max_length=1, default="")
+    deleted = fields.BooleanField(default=False)
+    model = fields.CharField(max_length=128, default="")
     timestamp = fields.DatetimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = (("timestamp",),)
+
+
+class UserGroupCredit(Model):
+    """
+    A user's reputation in one group, see evaluation/reputation.py.
+    """
+    id = fields.BigIntField(primary_key=True, generated=True)
+    user = fields.ForeignKeyField("models.User", related_name="group_credits")
+    group_id = fields.BigIntField()
+    credit = fields.FloatField(default=0)
+
+    class Meta:
+        unique_together = (("user", "group_id"),)
+
 
 class GroupInfo(Model):
     id = fields.BigIntField(primary_key=True)
@@ -23,6 +49,16 @@ class GroupInfo(Model):
     name = fields.CharField(max_length=255, default="")
     description = fields.TextField(default="")
     rules_context = fields.TextField(default="")
+    moderation_mode = fields.CharField(max_length=32, default="") # Empty uses the global MODERATION_MODE
+    screen_rules = fields.TextField(default="") # Keywords and patterns deleted without the LLM, see evaluation/screen.py
+    trusted_users = fields.TextField(default="") # User ids that, like admins, are never moderated
+    local_classifier = fields.BooleanField(default=False) # Confident local model verdicts skip the LLM
+
+    # Flood limits, None uses the global FLOOD_* default and 0 turns the check off, see evaluation/flood.py
+    flood_max_messages = fields.IntField(null=True)
+    flood_max_repeats = fields.IntField(null=True)
+    flood_raid_users = fields.IntField(null=True)
+    flood_restrict_seconds = fields.IntField(null=True)
 
     owner = fields.ForeignKeyField("models.User", related_name="owned_groups")
 
@@ -40,3 +76,16 @@ class UserGroupMessage(Model):
 
     class Meta:
         ordering = ["-db_created_at"] # Default ordering for queries
+        indexes = (
+            ("user_id", "group_id", "message_created_at"), # History lookup
+            ("group_id", "db_created_at"), # Per-group retention cap
+            ("db_created_at",), # Age-based retention
+        )
+
+
+class PendingDeletion(Model):
+    id = fields.BigIntField(primary_key=True, generated=True)
+    chat_id = fields.BigIntField()
+    message_id = fields.BigIntField()
+    due_at = fields.DatetimeField()
+    shard = fields.IntField(null=True) # Worker that scheduled and restores it, None for older rows
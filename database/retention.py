@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from structlog import get_logger
+from tortoise import Tortoise
+from tortoise.functions import Count
+
+from database.database import is_sqlite
+from database.models import UserGroupMessage
+
+logger = get_logger()
+
+
+class RetentionJob:
+    """
+    Background job pruning UserGroupMessage rows by age and by a per-group row cap.
+
+    Rows are deleted in chunks of chunk_size, each in its own short transaction with a pause
+    in between, so the message writer never waits long for the write lock. On SQLite, freed
+    pages are returned with an incremental vacuum afterwards.
+    """
+
+    def __init__(self, max_age: timedelta = timedelta(days=7), max_rows_per_group: int = 10_000,
+                 interval: float = 3600, chunk_size: int = 1000, pause: float = 0.05, vacuum_pages: int = 1000):
+        self.max_age = max_age
+        self.max_rows_per_group = max_rows_per_group
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.rows_pruned = 0
+        self.last_rows_pruned = 0
+        self.last_run_seconds = 0.0
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="retention-job")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+
+        by_age = await self._prune_by_age()
+        by_cap = await self._prune_by_group_cap()
+        if by_age or by_cap:
+            await self._vacuum()
+
+        elapsed = time.perf_counter() - started
+        pruned = by_age + by_cap
+
+        self.runs += 1
+        self.rows_pruned += pruned
+        self.last_rows_pruned = pruned
+        self.last_run_seconds = elapsed
+
+        logger.info("retention finished", pruned_by_age=by_age, pruned_by_group_cap=by_cap,
+                    elapsed_seconds=round(elapsed, 3))
+
+        return pruned
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "rows_pruned": self.rows_pruned,
+            "last_rows_pruned": self.last_rows_pruned,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("retention failed", error=str(e))
+
+            await asyncio.sleep(self.interval)
+
+    async def _prune_by_age(self) -> int:
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        return await self._delete_chunked(db_created_at__lt=cutoff)
+
+    async def _prune_by_group_cap(self) -> int:
+        if self.max_rows_per_group <= 0:
+            return 0
+
+        over_cap = await UserGroupMessage.annotate(
+            count=Count("id"),
+        ).group_by("group_id").filter(count__gt=self.max_rows_per_group).values_list("group_id", flat=True)
+
+        pruned = 0
+        for group_id in over_cap:
+            # The newest row beyond the cap; it and everything older goes.
+            oldest_kept = await UserGroupMessage.filter(group_id=group_id).order_by(
+                "-db_created_at"
+            ).offset(self.max_rows_per_group).limit(1).values_list("db_created_at", flat=True)
+            if not oldest_kept:
+                continue
+
+            pruned += await self._delete_chunked(group_id=group_id, db_created_at__lte=oldest_kept[0])
+
+        return pruned
+
+    async def _delete_chunked(self, **filters) -> int:
+        deleted = 0
+        while True:
+            ids = await UserGroupMessage.filter(**filters).order_by("id").limit(
+                self.chunk_size
+            ).values_list("id", flat=True)
+            if not ids:
+                break
+
+            deleted += await UserGroupMessage.filter(id__in=ids).delete()
+            if len(ids) < self.chunk_size:
+                break
+
+            await asyncio.sleep(self.pause)
+
+        return deleted
+
+    async def _vacuum(self):
+        if not is_sqlite():
+            return
+
+        connection = Tortoise.get_connection("default")
+        _, rows = await connection.execute_query("PRAGMA auto_vacuum")
+        # 2 = INCREMENTAL, only databases created with it can be vacuumed incrementally.
+        if not rows or rows[0][0] != 2:
+            return
+
+        await connection.execute_script(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+
+
+retention_job = RetentionJob(
+    max_age=timedelta(days=float(os.getenv("RETENTION_MAX_AGE_DAYS", "7"))),
+    max_rows_per_group=int(os.getenv("RETENTION_MAX_ROWS_PER_GROUP", "10000")),
+    interval=float(os.getenv("RETENTION_INTERVAL", "3600")),
+    chunk_size=int(os.getenv("RETENTION_CHUNK_SIZE", "1000")),
+    vacuum_pages=int(os.getenv("RETENTION_VACUUM_PAGES", "1000")),
+)
@@ -0,0 +1,74 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from database.models import User
+from database.writer import BatchWriter, user_writer
+
+
+class KnownUserCache:
+    """
+    LRU of user ids that are known to be stored, mapped to their stored first name.
+
+    Only users missing from the cache are looked up, and only new users and real name changes
+    are written, through the batched user writer.
+    """
+
+    def __init__(self, writer: BatchWriter, max_size: int = 200_000):
+        self.writer = writer
+        self.max_size = max_size
+
+        self._names: "OrderedDict[int, str]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    async def ensure(self, user_id: int, first_name: str) -> Tuple[User, bool]:
+        """
+        Makes sure the user is stored with the given first name.
+        Returns a lightweight User instance and whether the user is new.
+        """
+        created = False
+        stored_name = self._names.get(user_id)
+
+        if stored_name is not None:
+            self.hits += 1
+            self._names.move_to_end(user_id)
+        else:
+            self.misses += 1
+            stored_name = await self._load(user_id)
+            created = stored_name is None
+
+        if stored_name != first_name:
+            self.writes += 1
+            await self.writer.put(User(id=user_id, first_name=first_name))
+
+        self._remember(user_id, first_name)
+
+        return User(id=user_id, first_name=first_name), created
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._names),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+    async def _load(self, user_id: int) -> Optional[str]:
+        names = await User.filter(id=user_id).values_list("first_name", flat=True)
+        return names[0] if names else None
+
+    def _remember(self, user_id: int, first_name: str):
+        self._names[user_id] = first_name
+        self._names.move_to_end(user_id)
+
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+
+known_users = KnownUserCache(
+    user_writer,
+    max_size=int(os.getenv("KNOWN_USERS_MAX_SIZE", "200000")),
+)
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Type
+
+import xxhash
+from structlog import get_logger
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from database.models import SuspiciousMessage, User, UserGroupCredit, UserGroupMessage
+from metrics.metrics import db_write_errors, db_write_seconds
+
+logger = get_logger()
+
+
+class BatchWriter:
+    """
+    Write-behind queue that persists model instances with bulk_create.
+
+    Instances are flushed in one transaction once max_batch of them are pending or every
+    flush_interval seconds, whichever comes first. At most max_pending instances are held in
+    memory; put() waits for the next flush when the queue is full.
+
+    Writers listed in depends_on are flushed before every batch, so rows referenced by foreign
+    keys are written first. With dedupe_key, only the last instance per key is kept in a batch.
+    """
+
+    def __init__(self, model: Type[Model], max_batch: int = 500, flush_interval: float = 1.0,
+                 max_pending: int = 10_000, on_conflict: Optional[Iterable[str]] = None,
+                 update_fields: Optional[Iterable[str]] = None, depends_on: Sequence["BatchWriter"] = (),
+                 dedupe_key: Optional[Callable[[Model], Hashable]] = None):
+        self.model = model
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, max_batch)
+        self.on_conflict = list(on_conflict) if on_conflict else None
+        self.update_fields = list(update_fields) if update_fields else None
+        self.depends_on = list(depends_on)
+        self.dedupe_key = dedupe_key
+
+        self._pending: List[Model] = []
+        self._wakeup = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.backpressure_waits = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.model.__name__
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    async def put(self, instance: Model):
+        while len(self._pending) >= self.max_pending:
+            self.backpressure_waits += 1
+            self._wakeup.set()
+            self._has_room.clear()
+            await self._has_room.wait()
+
+        self._pending.append(instance)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-writer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+        logger.info("batch writer stopped", model=self.name, **self.stats())
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                self._has_room.set()
+
+                await self._write(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            await self.flush()
+
+    async def _write(self, batch: List[Model]):
+        for dependency in self.depends_on:
+            await dependency.flush()
+
+        if self.dedupe_key is not None:
+            batch = list({self.dedupe_key(instance): instance for instance in batch}.values())
+
+        started = time.perf_counter()
+        try:
+            async with in_transaction() as connection:
+                await self.model.bulk_create(
+                    batch,
+                    on_conflict=self.on_conflict,
+                    update_fields=self.update_fields,
+                    using_db=connection,
+                )
+        except Exception as e:
+            self.dropped += len(batch)
+            db_write_errors.inc(model=self.name)
+            logger.error("batch write failed", model=self.name, rows=len(batch), error=str(e))
+            return
+
+        elapsed = time.perf_counter() - started
+        db_write_seconds.observe(elapsed, model=self.name)
+        self.written += len(batch)
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+
+user_writer = BatchWriter(
+    User,
+    max_batch=int(os.getenv("USER_WRITER_BATCH", "200")),
+    flush_interval=float(os.getenv("USER_WRITER_INTERVAL", "1.0")),
+    max_pending=int(os.getenv("USER_WRITER_MAX_PENDING", "5000")),
+    on_conflict=["id"],
+    update_fields=["first_name"],
+    dedupe_key=lambda user: user.id,
+)
+
+message_writer = BatchWriter(
+    UserGroupMessage,
+    max_batch=int(os.getenv("MESSAGE_WRITER_BATCH", "500")),
+    flush_interval=float(os.getenv("MESSAGE_WRITER_INTERVAL", "1.0")),
+    max_pending=int(os.getenv("MESSAGE_WRITER_MAX_PENDING", "10000")),
+    depends_on=[user_writer],
+)
+
+credit_writer = BatchWriter(
+    UserGroupCredit,
+    max_batch=int(os.getenv("CREDIT_WRITER_BATCH", "500")),
+    flush_interval=float(os.getenv("CREDIT_WRITER_INTERVAL", "10")),
+    max_pending=int(os.getenv("CREDIT_WRITER_MAX_PENDING", "10000")),
+    on_conflict=["user_id", "group_id"],
+    update_fields=["credit"],
+    depends_on=[user_writer],
+    dedupe_key=lambda credit: (credit.user_id, credit.group_id),
+)
+
+# A message evaluated again, e.g. by the weaker model after a timeout, updates its verdict.
+verdict_writer = BatchWriter(
+    SuspiciousMessage,
+    max_batch=int(os.getenv("VERDICT_WRITER_BATCH", "500")),
+    flush_interval=float(os.getenv("VERDICT_WRITER_INTERVAL", "5")),
+    max_pending=int(os.getenv("VERDICT_WRITER_MAX_PENDING", "10000")),
+    on_conflict=["id"],
+    update_fields=["classification", "confidence", "user_message_action", "action_confidence", "deleted", "model"],
+    depends_on=[user_writer],
+    dedupe_key=lambda verdict: verdict.id,
+)
+
+
+def verdict_id(chat_id: int, message_id: int) -> int:
+    """
+    SuspiciousMessage's primary key: a signed 64-bit hash of the chat and message ids.
+    """
+    return xxhash.xxh64_intdigest(f"{chat_id}:{message_id}") - (1 << 63)
@@ -0,0 +1,114 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import xxhash
+
+from evaluation.tokens import count_tokens, truncate_tokens
+
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_SPACES_RE = re.compile(r"[ \t]+")
+
+TRUNCATED_RULES_MARKER = "\n[... rules truncated]"
+
+
+class TokenBudget:
+    """
+    Fits the variable parts of a prompt into fixed token budgets.
+
+    History entries are truncated to entry_tokens, consecutive identical messages are collapsed
+    into one entry with a count, and entries are kept newest first until history_tokens is used
+    up. Rules longer than rules_tokens are condensed once per content hash.
+    """
+
+    def __init__(self, history_tokens: int = 600, entry_tokens: int = 120, rules_tokens: int = 1500,
+                 message_tokens: int = 1000, max_condensed_rules: int = 10_000):
+        self.history_tokens = history_tokens
+        self.entry_tokens = entry_tokens
+        self.rules_tokens = rules_tokens
+        self.message_tokens = message_tokens
+        self.max_condensed_rules = max_condensed_rules
+
+        self._condensed_rules: "OrderedDict[int, str]" = OrderedDict()
+
+    def message(self, text: str) -> str:
+        return truncate_tokens(text or "", self.message_tokens)
+
+    def history(self, user_message_history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Takes the history newest first and returns it in the same order, within budget.
+        """
+        collapsed: List[Dict[str, Any]] = []
+        for msg in user_message_history:
+            previous = collapsed[-1] if collapsed else None
+            if (previous is not None and previous["text"] == msg["text"]
+                    and previous.get("replied_to_text") == msg.get("replied_to_text")):
+                previous["count"] += 1
+                # Keep the time of the oldest repetition, the run is read oldest first.
+                previous["created_at"] = msg["created_at"]
+                continue
+
+            collapsed.append({**msg, "count": 1})
+
+        fitted: List[Dict[str, Any]] = []
+        remaining = self.history_tokens
+        for msg in collapsed:
+            text = truncate_tokens(msg["text"] or "", self.entry_tokens)
+            replied_to_text = msg.get("replied_to_text")
+            if replied_to_text:
+                replied_to_text = truncate_tokens(replied_to_text, self.entry_tokens)
+
+            cost = count_tokens(text) + count_tokens(replied_to_text or "") + 12  # timestamp and framing
+            if cost > remaining:
+                break
+
+            remaining -= cost
+            fitted.append({**msg, "text": text, "replied_to_text": replied_to_text})
+
+        return fitted
+
+    def rules(self, rules_context: str) -> str:
+        # At least one UTF-8 byte per token, see truncate_tokens.
+        if not rules_context or len(rules_context.encode("utf-8")) <= self.rules_tokens:
+            return rules_context
+
+        key = xxhash.xxh3_64_intdigest(rules_context)
+        condensed = self._condensed_rules.get(key)
+        if condensed is not None:
+            self._condensed_rules.move_to_end(key)
+            return condensed
+
+        condensed = self._condense(rules_context)
+        self._condensed_rules[key] = condensed
+        while len(self._condensed_rules) > self.max_condensed_rules:
+            self._condensed_rules.popitem(last=False)
+
+        return condensed
+
+    def _condense(self, rules_context: str) -> str:
+        if count_tokens(rules_context) <= self.rules_tokens:
+            return rules_context
+
+        # Drop formatting noise and repeated lines before cutting anything.
+        seen = set()
+        lines = []
+        for line in _BLANK_LINES_RE.sub("\n", rules_context).splitlines():
+            line = _SPACES_RE.sub(" ", line).strip()
+            if line and line.casefold() not in seen:
+                seen.add(line.casefold())
+                lines.append(line)
+
+        condensed = "\n".join(lines)
+        if count_tokens(condensed) <= self.rules_tokens:
+            return condensed
+
+        return truncate_tokens(condensed, self.rules_tokens, marker=TRUNCATED_RULES_MARKER)
+
+
+token_budget = TokenBudget(
+    history_tokens=int(os.getenv("BUDGET_HISTORY_TOKENS", "600")),
+    entry_tokens=int(os.getenv("BUDGET_HISTORY_ENTRY_TOKENS", "120")),
+    rules_tokens=int(os.getenv("BUDGET_RULES_TOKENS", "1500")),
+    message_tokens=int(os.getenv("BUDGET_MESSAGE_TOKENS", "1000")),
+)
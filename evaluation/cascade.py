@@ -0,0 +1,132 @@
+import os
+import time
+from dataclasses import replace
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, TypeVar
+
+from structlog import get_logger
+
+from clients.openai import MAIN_MODEL, WEAK_MODEL, estimate_cost
+from evaluation.context import LLMContext
+from evaluation.prompt_cache import prompt_builder
+from evaluation.resilience import llm_guard
+from evaluation.tokens import count_tokens
+from metrics.metrics import cascade_decisions, cascade_saved_seconds, cascade_saved_usd, cascade_wasted_seconds, \
+    cascade_wasted_usd
+
+logger = get_logger()
+
+C = TypeVar("C", bound=LLMContext)
+R = TypeVar("R")
+
+REASON_CONFIDENCE = "confidence"
+REASON_CATEGORY = "category"
+
+
+class ModelCascade:
+    """
+    Runs a classification on the weak model first and repeats it on the strong model only when
+    the weak answer isn't trusted: its confidence is in escalate_confidence or its category is in
+    high_stakes.
+
+    Accepted weak answers count as saved latency and cost against the strong model. The latency
+    of the strong model is a moving average of the escalated calls; the cost is estimated from
+    the average prompt size of the stage. Weak calls that had to be escalated count as wasted.
+    """
+
+    def __init__(self, weak_model: str, strong_model: str, escalate_confidence: Iterable[str] = ("Low", "Medium"),
+                 high_stakes: Iterable[str] = (), enabled: bool = True):
+        self.weak_model = weak_model
+        self.strong_model = strong_model
+        self.escalate_confidence = set(escalate_confidence)
+        self.high_stakes = set(high_stakes)
+        self.enabled = enabled and weak_model != strong_model
+
+        self._strong_seconds: Dict[str, float] = {}
+
+        self.accepted = 0
+        self.escalated = 0
+
+    def applies(self, model_name: str) -> bool:
+        return self.enabled and model_name == self.strong_model
+
+    def escalation_reason(self, response: Any) -> Optional[str]:
+        if response.confidence in self.escalate_confidence:
+            return REASON_CONFIDENCE
+        if response.classification in self.high_stakes:
+            return REASON_CATEGORY
+        return None
+
+    async def run(self, stage: str, kind: str, ctx: C, call: Callable[[C], Awaitable[R]]) -> R:
+        """
+        Runs call on the weak model and, if needed, again with ctx on the strong model.
+        kind is the prompt kind of the stage, used for the cost estimate. Both calls share the
+        stage's LLM deadline.
+        """
+        with llm_guard.shared_deadline(stage):
+            return await self._run(stage, kind, ctx, call)
+
+    async def _run(self, stage: str, kind: str, ctx: C, call: Callable[[C], Awaitable[R]]) -> R:
+        started = time.perf_counter()
+        response = await call(replace(ctx, model_name=self.weak_model))
+        weak_seconds = time.perf_counter() - started
+
+        prompt_tokens = self._average_prompt_tokens(kind)
+        completion_tokens = count_tokens(response.model_dump_json())
+        weak_cost = estimate_cost(self.weak_model, prompt_tokens, completion_tokens)
+
+        reason = self.escalation_reason(response)
+        if reason is None:
+            self.accepted += 1
+            cascade_decisions.inc(stage=stage, outcome="accepted", reason="none")
+            cascade_saved_usd.inc(
+                max(0.0, estimate_cost(self.strong_model, prompt_tokens, completion_tokens) - weak_cost), stage=stage,
+            )
+            strong_seconds = self._strong_seconds.get(stage)
+            if strong_seconds is not None:
+                cascade_saved_seconds.inc(max(0.0, strong_seconds - weak_seconds), stage=stage)
+            return response
+
+        self.escalated += 1
+        cascade_decisions.inc(stage=stage, outcome="escalated", reason=reason)
+        cascade_wasted_seconds.inc(weak_seconds, stage=stage)
+        cascade_wasted_usd.inc(weak_cost, stage=stage)
+        logger.debug("cascade escalated", stage=stage, reason=reason, classification=response.classification,
+                     confidence=response.confidence)
+
+        started = time.perf_counter()
+        response = await call(ctx)
+        elapsed = time.perf_counter() - started
+
+        previous = self._strong_seconds.get(stage)
+        self._strong_seconds[stage] = elapsed if previous is None else previous * 0.9 + elapsed * 0.1
+
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        decisions = self.accepted + self.escalated
+        return {
+            "enabled": self.enabled,
+            "accepted": self.accepted,
+            "escalated": self.escalated,
+            "escalation_rate": self.escalated / decisions if decisions else 0.0,
+        }
+
+    @staticmethod
+    def _average_prompt_tokens(kind: str) -> int:
+        stats = prompt_builder.stats()["kinds"].get(kind)
+        if not stats or not stats["calls"]:
+            return 0
+        return (stats["cacheable_tokens"] + stats["uncached_tokens"]) // stats["calls"]
+
+
+def _env_list(name: str, default: str):
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+cascade = ModelCascade(
+    weak_model=WEAK_MODEL,
+    strong_model=MAIN_MODEL,
+    escalate_confidence=_env_list("CASCADE_ESCALATE_CONFIDENCE", "Low,Medium"),
+    high_stakes=_env_list("CASCADE_HIGH_STAKES", "SEXUAL,INSULT,POLITICS"),
+    enabled=os.getenv("CASCADE_ENABLED", "true").lower() in ("1", "true", "yes"),
+)
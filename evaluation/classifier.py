@@ -0,0 +1,267 @@
+import asyncio
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from structlog import get_logger
+
+from evaluation.flag import FlagResponse, JudgmentResponse
+from evaluation.screen import normalize_screen_text
+
+logger = get_logger()
+
+CLEAN = "CLEAN"
+
+# Decided against each group's own rules, so a model shared by all groups can't learn them.
+GROUP_DEPENDENT_CLASSES = {"IRRELEVANT_TO_GROUP"}
+
+# Longer messages are featurized on their first MAX_CHARS characters, which bounds inference time.
+MAX_CHARS = 1000
+
+VIOLATION_MESSAGE = "پیام شما به دلیل نقض قوانین گروه حذف شد."
+
+
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+_MIX_MULTIPLIER = np.uint64(0xFF51AFD7ED558CCD)
+
+
+def featurize(text: str, n_features: int, ngram_sizes: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed char n-grams of the normalized text, as (indices, values) of a sparse vector.
+
+    The n-grams of all sizes and positions are hashed at once with FNV-1a over their code points,
+    each size extending the hashes of the one below. The low bits of a hash pick the n-gram's
+    column and the top bit its sign, so colliding n-grams tend to cancel out instead of adding
+    up. Indices repeat for repeated n-grams; values are scaled by 1/sqrt(n-grams), so long
+    messages don't get larger scores.
+    """
+    text = f" {normalize_screen_text(text or '')[:MAX_CHARS]} "
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+    hashes = []
+    digest = (codes ^ _FNV_OFFSET) * _FNV_PRIME
+    for size in range(1, max(ngram_sizes) + 1):
+        if size > 1:
+            digest = (digest[:-1] ^ codes[size - 1:]) * _FNV_PRIME
+        if size in ngram_sizes and len(digest):
+            hashes.append(digest)
+
+    if not hashes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    digest = np.concatenate(hashes)
+    digest ^= digest >> np.uint64(33)
+    digest *= _MIX_MULTIPLIER
+    digest ^= digest >> np.uint64(33)
+
+    indices = (digest % np.uint64(n_features)).astype(np.int64)
+    values = np.where(digest >> np.uint64(63), np.float32(1.0), np.float32(-1.0)) / np.float32(np.sqrt(len(digest)))
+    return indices, values
+
+
+class HashedNgramModel:
+    """
+    Multinomial logistic regression over hashed char n-grams.
+
+    weights has one row per hashed feature and one column per class. Probabilities are
+    temperature scaled, with the temperature fitted on held-out verdicts after training.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: Sequence[str],
+                 ngram_sizes: Sequence[int] = (2, 3, 4), temperature: float = 1.0,
+                 clean_threshold: float = math.inf, violation_threshold: float = math.inf):
+        self.weights = weights
+        self.bias = bias
+        self.classes = list(classes)
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.temperature = temperature
+        self.clean_threshold = clean_threshold
+        self.violation_threshold = violation_threshold
+
+        self.n_features = weights.shape[0]
+        self.clean_index = self.classes.index(CLEAN)
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        indices, values = featurize(text, self.n_features, self.ngram_sizes)
+        logits = values @ np.take(self.weights, indices, axis=0) + self.bias
+        return _softmax(logits / self.temperature)
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            classes=np.array(self.classes),
+            ngram_sizes=np.array(self.ngram_sizes),
+            temperature=self.temperature,
+            clean_threshold=self.clean_threshold,
+            violation_threshold=self.violation_threshold,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramModel":
+        with np.load(path) as data:
+            return cls(
+                weights=data["weights"],
+                bias=data["bias"],
+                classes=[str(label) for label in data["classes"]],
+                ngram_sizes=[int(size) for size in data["ngram_sizes"]],
+                temperature=float(data["temperature"]),
+                clean_threshold=float(data["clean_threshold"]),
+                violation_threshold=float(data["violation_threshold"]),
+            )
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def train_model(texts: List[str], labels: List[str], n_features: int = 1 << 18,
+                ngram_sizes: Sequence[int] = (2, 3, 4), epochs: int = 8, learning_rate: float = 0.5,
+                batch_size: int = 64, seed: int = 0) -> HashedNgramModel:
+    """
+    Fits a HashedNgramModel with mini-batch SGD. CLEAN is always one of the classes.
+    """
+    classes = [CLEAN] + sorted(set(labels) - {CLEAN})
+    targets = np.array([classes.index(label) for label in labels])
+
+    features = [featurize(text, n_features, ngram_sizes) for text in texts]
+    weights = np.zeros((n_features, len(classes)), dtype=np.float32)
+    bias = np.log(np.bincount(targets, minlength=len(classes)) + 1.0).astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        order = rng.permutation(len(features))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            rows = np.concatenate([np.full(len(features[i][0]), row) for row, i in enumerate(batch)])
+            indices = np.concatenate([features[i][0] for i in batch])
+            values = np.concatenate([features[i][1] for i in batch])
+
+            contributions = np.take(weights, indices, axis=0) * values[:, None]
+            logits = np.stack([
+                np.bincount(rows, weights=contributions[:, c], minlength=len(batch)) for c in range(len(classes))
+            ], axis=1) + bias
+            gradient = _softmax(logits)
+            gradient[np.arange(len(batch)), targets[batch]] -= 1.0
+            gradient /= len(batch)
+
+            np.add.at(weights, indices, (-learning_rate * values[:, None] * gradient[rows]).astype(np.float32))
+            bias -= (learning_rate * gradient.sum(axis=0)).astype(np.float32)
+
+    return HashedNgramModel(weights, bias, classes, ngram_sizes)
+
+
+class LocalClassifier:
+    """
+    Serves a HashedNgramModel trained on the LLM's past verdicts, see evaluation/train_classifier.py.
+
+    Messages the model is confident about are decided without the LLM: CLEAN when P(CLEAN) is at
+    least clean_threshold, deleted as the likeliest violation class when the violation classes
+    are at least violation_threshold together. Group-dependent classes never delete. The
+    thresholds come from the model's calibration unless set here. Without a model file every
+    message goes to the LLM.
+    """
+
+    def __init__(self, path: str, clean_threshold: Optional[float] = None,
+                 violation_threshold: Optional[float] = None):
+        self.path = path
+        self.clean_threshold = clean_threshold
+        self.violation_threshold = violation_threshold
+
+        self.model: Optional[HashedNgramModel] = None
+        self._not_violations: List[int] = []
+
+        self.predictions = 0
+        self.clean = 0
+        self.violations = 0
+        self.unsure = 0
+        self.total_seconds = 0.0
+
+    async def start(self):
+        if not os.path.exists(self.path):
+            logger.info("local classifier disabled, no model file", path=self.path)
+            return
+
+        try:
+            self.model = await asyncio.to_thread(HashedNgramModel.load, self.path)
+        except (OSError, KeyError, ValueError) as e:
+            logger.error("local classifier failed to load", path=self.path, error=str(e))
+            return
+
+        # Models trained before group-dependent classes were left out may still predict them.
+        self._not_violations = [index for index, label in enumerate(self.model.classes)
+                                if label == CLEAN or label in GROUP_DEPENDENT_CLASSES]
+        logger.info("local classifier loaded", path=self.path, classes=self.model.classes,
+                    clean_threshold=self._clean_threshold(), violation_threshold=self._violation_threshold())
+
+    async def stop(self):
+        pass
+
+    def predict(self, text: Optional[str]) -> Optional[Tuple[FlagResponse, Optional[JudgmentResponse]]]:
+        """
+        A verdict when the model is confident about the message, None when the LLM has to decide.
+        """
+        if self.model is None or not text:
+            return None
+
+        started = time.perf_counter()
+        probabilities = self.model.predict_proba(text)
+        self.total_seconds += time.perf_counter() - started
+        self.predictions += 1
+
+        clean_probability = float(probabilities[self.model.clean_index])
+        if clean_probability >= self._clean_threshold():
+            self.clean += 1
+            return FlagResponse(classification=CLEAN, confidence="High", level="Low"), None
+
+        violations = probabilities.copy()
+        violations[self._not_violations] = 0.0
+        if violations.sum() >= self._violation_threshold():
+            self.violations += 1
+            return (
+                FlagResponse(classification=self.model.classes[int(violations.argmax())], confidence="High",
+                             level="Medium", reasoning="local classifier"),
+                JudgmentResponse(
+                    user_account_action="DISMISS",
+                    user_message_action="DELETE",
+                    confidence="4",
+                    reasoning="local classifier",
+                    message_to_user=VIOLATION_MESSAGE,
+                ),
+            )
+
+        self.unsure += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.model is not None,
+            "predictions": self.predictions,
+            "clean": self.clean,
+            "violations": self.violations,
+            "unsure": self.unsure,
+            "decided_ratio": (self.clean + self.violations) / self.predictions if self.predictions else 0.0,
+            "avg_predict_seconds": self.total_seconds / self.predictions if self.predictions else 0.0,
+        }
+
+    def _clean_threshold(self) -> float:
+        return self.model.clean_threshold if self.clean_threshold is None else self.clean_threshold
+
+    def _violation_threshold(self) -> float:
+        return self.model.violation_threshold if self.violation_threshold is None else self.violation_threshold
+
+
+def _threshold(value: str) -> Optional[float]:
+    return float(value) if value else None
+
+
+local_classifier = LocalClassifier(
+    os.getenv("CLASSIFIER_PATH", "classifier.npz"),
+    clean_threshold=_threshold(os.getenv("CLASSIFIER_CLEAN_THRESHOLD", "")),
+    violation_threshold=_threshold(os.getenv("CLASSIFIER_VIOLATION_THRESHOLD", "")),
+)
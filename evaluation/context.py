@@ -1,6 +1,5 @@
 from dataclasses import dataclass
 
-from langchain_openai import ChatOpenAI
 from typing_extensions import TypeVar
 
 T = TypeVar('T')
@@ -8,4 +7,4 @@ T = TypeVar('T')
 
 @dataclass
 class LLMContext:
-    llm: ChatOpenAI
+    model_name: str
@@ -0,0 +1,35 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from evaluation.flag import FlagResponse, JudgmentResponse
+
+FALLBACK_ALLOW = "allow"
+FALLBACK_HEURISTIC = "heuristic"
+
+FALLBACK_POLICY = os.getenv("LLM_FALLBACK", FALLBACK_HEURISTIC)
+
+LINK_PATTERN = re.compile(r"(https?://|www\.|t\.me/|telegram\.me/)", re.IGNORECASE)
+
+
+def local_verdict(message: str, user_message_history: List[Dict[str, Any]],
+                  policy: str = FALLBACK_POLICY) -> Tuple[FlagResponse, Optional[JudgmentResponse]]:
+    """
+    Decides without the LLM while the provider is unavailable. Messages are let through,
+    except that with the heuristic policy links from users without recent history in the
+    group are deleted, the usual shape of spam raids.
+    """
+    if policy != FALLBACK_HEURISTIC or user_message_history or not LINK_PATTERN.search(message or ""):
+        return FlagResponse(classification="CLEAN", confidence="Low", level="Low"), None
+
+    return (
+        FlagResponse(classification="SPAM", confidence="Low", level="Medium", primary_evidence="link",
+                     reasoning="local fallback"),
+        JudgmentResponse(
+            user_account_action="DISMISS",
+            user_message_action="DELETE",
+            confidence="3",
+            reasoning="local fallback",
+            message_to_user="پیام شما به دلیل داشتن لینک موقتاً حذف شد.",
+        ),
+    )
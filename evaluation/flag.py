@@ -1,15 +1,34 @@
+import asyncio
 import json
+import os
 from dataclasses import dataclass
 from datetime import datetime, timezone  # Added timezone
-from typing import List, Dict, Any  # Added Any
+from typing import List, Dict, Any, Awaitable, Callable, Type  # Added Any
 
 from langgraph.func import entrypoint, task
 from pydantic import BaseModel, Field
 from typing_extensions import Literal, Optional, Tuple
 
-from clients.openai import create_chat_client, MAIN_MODEL
+from clients.openai import get_structured_client, stream_structured, chat_clients, MAIN_MODEL, WEAK_MODEL
+from evaluation.budget import token_budget
+from evaluation.cascade import cascade
 from evaluation.context import LLMContext
-from evaluation.prompt import FLAG_PROMPT, ACTION_PROMPT
+from evaluation.prompt import FLAG_SYSTEM_PROMPT, FLAG_INPUT_PROMPT, ACTION_SYSTEM_PROMPT, ACTION_INPUT_PROMPT, \
+    SINGLE_PASS_SYSTEM_PROMPT, SINGLE_PASS_INPUT_PROMPT
+from evaluation.prompt_cache import prompt_builder
+from evaluation.resilience import llm_guard
+from evaluation.streaming import stream_fields
+from evaluation.tokens import get_encoding
+from metrics.metrics import evaluations_in_flight, llm_early_exits, track_stage
+
+MODE_TWO_STAGE = "two_stage"
+MODE_SINGLE_PASS = "single_pass"
+
+# Used for groups that haven't picked a moderation mode
+DEFAULT_MODE = os.getenv("MODERATION_MODE", MODE_TWO_STAGE)
+
+# Classifications are streamed and decided from their first fields, see structured_call.
+STREAMING = os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
 
 
 @dataclass
@@ -23,6 +42,8 @@ class FlagContext(LLMContext):
 
 
 class FlagResponse(BaseModel):
+    # Fields are generated in this order. A streamed answer is decided once classification and
+    # confidence are in, and for violations level and primary_evidence, so keep them first.
     classification: Literal[
         "CLEAN", "SPAM", "SEXUAL", "ADVERTISEMENT", "FLIRT", "INSULT", "POLITICS", "IRRELEVANT_TO_GROUP"] = Field(
         description="The category this content falls into"
@@ -72,17 +93,149 @@ class JudgmentResponse(BaseModel):
     )
 
 
+class ModerationResponse(BaseModel):
+    """
+    Classification and action returned together by the single-pass mode.
+    """
+    classification: Literal[
+        "CLEAN", "SPAM", "SEXUAL", "ADVERTISEMENT", "FLIRT", "INSULT", "POLITICS", "IRRELEVANT_TO_GROUP"] = Field(
+        description="The category this content falls into"
+    )
+
+    confidence: Literal["Low", "Medium", "High"] = Field(
+        description="How confident the system is in this classification"
+    )
+
+    level: Literal["Low", "Medium", "High"] = Field(
+        description="How serious the system thinks this classification is"
+    )
+
+    primary_evidence: Optional[str] = Field(
+        default=None,
+        description="Key evidence supporting this classification, only if not CLEAN. max length 20 characters",
+    )
+
+    user_account_action: Literal["DISMISS", "RESTRICT", "REMOVE", "BAN"] = Field(
+        description="The determined action to take on the user's account, DISMISS if CLEAN"
+    )
+
+    user_message_action: Literal["DISMISS", "DELETE"] = Field(
+        description="The determined action to take on the user's message, DISMISS if CLEAN"
+    )
+
+    action_confidence: Literal["1", "2", "3", "4", "5"] = Field(
+        description="How confident the system is in message and account action, out of 5."
+    )
+
+    reasoning: Optional[str] = Field(
+        default=None,
+        description="Explanation for the classification and the action, only if not CLEAN. max length 20 characters",
+    )
+
+    message_to_user: Optional[str] = Field(
+        default=None,
+        description=(
+            """
+            Only if not CLEAN. A short, concise message to send to the user, explaining the action taken. must be in Persian, one sentence, very short.
+            """),
+    )
+
+    def split(self) -> Tuple[FlagResponse, Optional[JudgmentResponse]]:
+        flag_response = FlagResponse(
+            classification=self.classification,
+            confidence=self.confidence,
+            level=self.level,
+            primary_evidence=self.primary_evidence,
+            reasoning=self.reasoning,
+        )
+        if self.classification == "CLEAN":
+            return flag_response, None
+
+        return flag_response, JudgmentResponse(
+            user_account_action=self.user_account_action,
+            user_message_action=self.user_message_action,
+            confidence=self.action_confidence,
+            reasoning=self.reasoning or "",
+            message_to_user=self.message_to_user,
+        )
+
+
+async def init_llm_clients():
+    # Loading the encoding may download it, keep that off the event loop.
+    await asyncio.to_thread(get_encoding)
+    await chat_clients.warmup({MAIN_MODEL, WEAK_MODEL}, schemas=[FlagResponse, JudgmentResponse, ModerationResponse])
+
+
 async def associate_flag(first_name: str, message: str, group_title: str, group_context: str,
-                         user_message_history: List[Dict[str, Any]], current_time: datetime) -> Tuple[
-    FlagResponse, Optional[JudgmentResponse]]:
-    return await flag.ainvoke({
-        "first_name": first_name,
-        "message": message,
-        "group_title": group_title,
-        "group_context": group_context,
-        "user_message_history": user_message_history,
-        "current_time": current_time.isoformat(),  # Pass as ISO string
-    })
+                         user_message_history: List[Dict[str, Any]], current_time: datetime,
+                         model_name: str = MAIN_MODEL, mode: Optional[str] = None,
+                         config: Optional[Dict[str, Any]] = None) -> Tuple[FlagResponse, Optional[JudgmentResponse]]:
+    evaluations_in_flight.inc()
+    try:
+        return await flag.ainvoke({
+            "model_name": model_name,
+            "mode": mode or DEFAULT_MODE,
+            "first_name": first_name,
+            "message": message,
+            "group_title": group_title,
+            "group_context": group_context,
+            "user_message_history": user_message_history,
+            "current_time": current_time.isoformat(),  # Pass as ISO string
+        }, config=config)
+    finally:
+        evaluations_in_flight.dec()
+
+
+def format_user_message_history(user_message_history: List[Dict[str, Any]]) -> str:
+    history_str_parts = []
+    for msg_data in user_message_history:
+        part = f"- At {msg_data['created_at']}: \"{msg_data['text']}\""
+        if msg_data.get('replied_to_text') and msg_data['replied_to_text'] is not None:  # Check for None
+            part += f" (in reply to: \"{msg_data['replied_to_text']}\")"
+        if msg_data.get('count', 1) > 1:
+            part += f" x{msg_data['count']} in a row"
+        history_str_parts.append(part)
+
+    return "\n".join(
+        history_str_parts) if history_str_parts else "No recent message history available for this user in this group."
+
+
+def classification_decided(fields: Dict[str, Any]) -> bool:
+    # The cascade escalates on confidence, and the judgement is given a violation's level and evidence.
+    if "classification" not in fields or "confidence" not in fields:
+        return False
+    return fields["classification"] == "CLEAN" or ("level" in fields and "primary_evidence" in fields)
+
+
+def clean_decided(fields: Dict[str, Any]) -> bool:
+    # A single-pass violation needs its actions, only CLEAN answers are decided early.
+    return fields.get("classification") == "CLEAN" and "confidence" in fields
+
+
+# Values of the required fields an early CLEAN decision doesn't wait for. They aren't used for CLEAN.
+FLAG_EARLY_DEFAULTS = {"level": "Low"}
+MODERATION_EARLY_DEFAULTS = {
+    "level": "Low", "user_account_action": "DISMISS", "user_message_action": "DISMISS", "action_confidence": "5",
+}
+
+
+def structured_call(stage: str, schema: Type[BaseModel], prompt: Any, decided: Callable[[Dict[str, Any]], bool],
+                    defaults: Dict[str, Any]) -> Callable[[str], Awaitable[BaseModel]]:
+    """
+    The call of a stage for llm_guard. With streaming on, the answer is parsed as it's generated and
+    the generation is cancelled as soon as decided(fields) holds; the required fields that weren't
+    generated by then take their defaults. Otherwise the whole answer is awaited.
+    """
+    if not STREAMING:
+        return lambda model_name: get_structured_client(model_name, schema).ainvoke(prompt)
+
+    async def invoke(model_name: str) -> BaseModel:
+        fields = await stream_fields(stream_structured(model_name, schema, prompt), decided)
+        if len(fields) < len(schema.model_fields):
+            llm_early_exits.inc(stage=stage)
+        return schema.model_validate({**defaults, **fields})
+
+    return invoke
 
 
 @entrypoint()
@@ -102,16 +255,27 @@ async def flag(
         parsed_time = datetime.now(timezone.utc)
 
     ctx = FlagContext(
-        llm=create_chat_client(MAIN_MODEL),
-        message=args.get("message"),
+        model_name=args.get("model_name", MAIN_MODEL),
+        message=token_budget.message(args.get("message")),
         first_name=args.get("first_name"),
         group_title=args.get("group_title"),
-        group_context=args.get("group_context"),
-        user_message_history=args.get("user_message_history", []),
+        group_context=token_budget.rules(args.get("group_context")),
+        user_message_history=token_budget.history(args.get("user_message_history", [])),
         current_time=parsed_time
     )
 
-    flag_response: FlagResponse = await initial_flag_content(ctx)
+    # Classification starts on the weak model when the cascade is on, see evaluation/cascade.py.
+    if args.get("mode") == MODE_SINGLE_PASS:
+        if cascade.applies(ctx.model_name):
+            moderation_response: ModerationResponse = await cascade.run("single_pass", "single_pass", ctx, single_pass)
+        else:
+            moderation_response = await single_pass(ctx)
+        return moderation_response.split()
+
+    if cascade.applies(ctx.model_name):
+        flag_response: FlagResponse = await cascade.run("initial_flag_content", "flag", ctx, initial_flag_content)
+    else:
+        flag_response = await initial_flag_content(ctx)
     if flag_response.classification == "CLEAN":
         return flag_response, None
 
@@ -125,30 +289,52 @@ async def initial_flag_content(ctx: FlagContext) -> FlagResponse:
     """
     This function is used to flag sensitive contents
     """
-    history_str_parts = []
-    for msg_data in ctx.user_message_history:
-        part = f"- At {msg_data['created_at']}: \"{msg_data['text']}\""
-        if msg_data.get('replied_to_text') and msg_data['replied_to_text'] is not None:  # Check for None
-            part += f" (in reply to: \"{msg_data['replied_to_text']}\")"
-        history_str_parts.append(part)
-
-    user_message_history_str = "\n".join(
-        history_str_parts) if history_str_parts else "No recent message history available for this user in this group."
-
-    result = await ctx.llm.with_structured_output(
-        schema=FlagResponse,
-        strict=True
-    ).ainvoke(
-        FLAG_PROMPT.format(
+    prompt = prompt_builder.build(
+        "flag",
+        FLAG_SYSTEM_PROMPT,
+        group_title=ctx.group_title,
+        group_context=ctx.group_context,
+        tail=FLAG_INPUT_PROMPT.format(
             FIRST_NAME=ctx.first_name,
             INPUT=ctx.message,
-            GROUP_TITLE=ctx.group_title,
-            GROUP_CONTEXT=ctx.group_context,
-            USER_MESSAGE_HISTORY=user_message_history_str,
+            USER_MESSAGE_HISTORY=format_user_message_history(ctx.user_message_history),
             CURRENT_TIME=ctx.current_time.isoformat()  # Ensure current_time is also passed
+        ),
+    )
+
+    with track_stage("initial_flag_content"):
+        result = await llm_guard.call(
+            "initial_flag_content", ctx.model_name,
+            structured_call("initial_flag_content", FlagResponse, prompt, classification_decided, FLAG_EARLY_DEFAULTS),
         )
+
+    return result
+
+
+@task
+async def single_pass(ctx: FlagContext) -> ModerationResponse:
+    """
+    Classifies the content and decides the action in a single call
+    """
+    prompt = prompt_builder.build(
+        "single_pass",
+        SINGLE_PASS_SYSTEM_PROMPT,
+        group_title=ctx.group_title,
+        group_context=ctx.group_context,
+        tail=SINGLE_PASS_INPUT_PROMPT.format(
+            FIRST_NAME=ctx.first_name,
+            INPUT=ctx.message,
+            USER_MESSAGE_HISTORY=format_user_message_history(ctx.user_message_history),
+            CURRENT_TIME=ctx.current_time.isoformat()
+        ),
     )
 
+    with track_stage("single_pass"):
+        result = await llm_guard.call(
+            "single_pass", ctx.model_name,
+            structured_call("single_pass", ModerationResponse, prompt, clean_decided, MODERATION_EARLY_DEFAULTS),
+        )
+
     return result
 
 
@@ -159,18 +345,24 @@ async def judgement(ctx: FlagContext, flag_response: FlagResponse) -> JudgmentRe
     """
     # The judgement prompt does not currently use user_message_history or current_time directly,
     # but they are available in ctx if needed in the future.
-    # WardenAI's analysis (which might be influenced by history) is passed.
-    result = await ctx.llm.with_structured_output(
-        schema=JudgmentResponse,
-        strict=True
-    ).ainvoke(
-        ACTION_PROMPT.format(
+    # WardenAI's analysis (which might be influenced by history) is passed. Fields a streamed
+    # analysis was decided without are left out rather than shown as null.
+    prompt = prompt_builder.build(
+        "judgement",
+        ACTION_SYSTEM_PROMPT,
+        group_title=ctx.group_title,
+        group_context=ctx.group_context,
+        tail=ACTION_INPUT_PROMPT.format(
             FIRST_NAME=ctx.first_name,
             INPUT=ctx.message,
-            WARDEN_ANALYSIS=json.dumps(flag_response.model_dump(), indent=2, ensure_ascii=False),
-            GROUP_TITLE=ctx.group_title,
-            GROUP_CONTEXT=ctx.group_context,
-        )
+            WARDEN_ANALYSIS=json.dumps(flag_response.model_dump(exclude_unset=True), indent=2, ensure_ascii=False),
+        ),
     )
 
+    with track_stage("judgement"):
+        result = await llm_guard.call(
+            "judgement", ctx.model_name,
+            lambda model_name: get_structured_client(model_name, JudgmentResponse).ainvoke(prompt),
+        )
+
     return result
@@ -0,0 +1,264 @@
+import os
+import re
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from evaluation.verdict_cache import normalize_text, text_hash
+
+REASON_RATE = "rate"
+REASON_REPEAT = "repeat"
+REASON_RAID = "raid"
+REASON_PENALTY = "penalty"
+
+# Links and mentions, what a raid advertises. Identical texts without them are ordinary replies
+# like greetings or thanks, and don't count toward a raid.
+SPAM_SIGNAL_PATTERN = re.compile(r"https?://|www\.|t\.me/|telegram\.me/|@\w", re.IGNORECASE)
+
+# Telegram makes restrictions shorter than 30 seconds or longer than 366 days permanent.
+MIN_RESTRICT_SECONDS = 30
+MAX_RESTRICT_SECONDS = 366 * 24 * 3600
+
+# Settings admins can change, by their name in the group keyboard: (GroupInfo column, FloodLimits attribute)
+GROUP_LIMIT_FIELDS = {
+    "messages": ("flood_max_messages", "max_messages"),
+    "repeats": ("flood_max_repeats", "max_repeats"),
+    "raid": ("flood_raid_users", "raid_users"),
+    "restrict": ("flood_restrict_seconds", "restrict_seconds"),
+}
+
+
+@dataclass
+class FloodLimits:
+    """
+    Flood thresholds of a group. A limit of 0 turns its check off.
+    """
+    window: float = 10.0
+    max_messages: int = 8
+    repeat_window: float = 60.0
+    max_repeats: int = 2
+    raid_window: float = 60.0
+    raid_users: int = 5
+    raid_min_length: int = 16
+    restrict_seconds: int = 0
+
+    def __post_init__(self):
+        self.restrict_seconds = clamp_restrict_seconds(self.restrict_seconds)
+
+    def for_group(self, group: Any) -> "FloodLimits":
+        """
+        These limits with the group's own settings applied; unset settings keep the defaults.
+        """
+        overrides = {}
+        for column, attribute in GROUP_LIMIT_FIELDS.values():
+            value = getattr(group, column, None)
+            if value is not None:
+                overrides[attribute] = value
+
+        return replace(self, **overrides) if overrides else self
+
+
+def clamp_restrict_seconds(seconds: int) -> int:
+    """
+    The nearest duration Telegram applies as given; 0 turns restricting off.
+    """
+    if seconds <= 0:
+        return 0
+    return min(max(seconds, MIN_RESTRICT_SECONDS), MAX_RESTRICT_SECONDS)
+
+
+def parse_limits(text: str) -> Tuple[Dict[str, Optional[int]], List[str]]:
+    """
+    Parses "messages=8 repeats=2 raid=5 restrict=300" into GroupInfo column values. "default"
+    resets a setting to the global default.
+    """
+    values, errors = {}, []
+
+    for item in (text or "").replace(",", " ").split():
+        name, _, value = item.partition("=")
+        setting = GROUP_LIMIT_FIELDS.get(name.strip().lower())
+        if setting is None:
+            errors.append(f"{item}: unknown setting, use one of {', '.join(GROUP_LIMIT_FIELDS)}")
+            continue
+
+        column = setting[0]
+        value = value.strip().lower()
+        if value == "default":
+            values[column] = None
+        elif value.isdigit():
+            if column == "flood_restrict_seconds" and int(value) != clamp_restrict_seconds(int(value)):
+                errors.append(f"{item}: use 0, or {MIN_RESTRICT_SECONDS} to {MAX_RESTRICT_SECONDS} seconds")
+                continue
+            values[column] = int(value)
+        else:
+            errors.append(f"{item}: expected a number or 'default'")
+
+    return values, errors
+
+
+@dataclass
+class FloodVerdict:
+    reason: str
+    message_ids: List[int]
+    restrict_user_ids: List[int] = field(default_factory=list)
+
+
+class _UserWindow:
+    __slots__ = ("messages", "penalty_until")
+
+    def __init__(self):
+        # (timestamp, message id, text hash or None)
+        self.messages: Deque[Tuple[float, int, Optional[int]]] = deque()
+        self.penalty_until = 0.0
+
+
+class FloodDetector:
+    """
+    Detects floods without the LLM, from in-memory sliding windows.
+
+    Per (group, user) it counts messages within limits.window and identical messages within
+    limits.repeat_window. Per group it counts how many different users sent the same text with
+    a link or mention within limits.raid_window, which is how raids look. A hit returns every
+    message of the flood so they can be deleted in one call, and the sender's following messages
+    are removed as well until the window has passed (or, for a raid, any further copy of the text).
+
+    Timestamps are the messages' own dates, so the windows don't depend on processing delays.
+    """
+
+    def __init__(self, limits: FloodLimits, max_users: int = 200_000, max_groups: int = 50_000,
+                 max_texts_per_group: int = 2000):
+        self.limits = limits
+        self.max_users = max_users
+        self.max_groups = max_groups
+        self.max_texts_per_group = max_texts_per_group
+
+        self._users: "OrderedDict[Tuple[int, int], _UserWindow]" = OrderedDict()
+        # group id -> text hash -> (blocked until, [(timestamp, user id, message id)])
+        self._texts: "OrderedDict[int, OrderedDict[int, Tuple[float, Deque[Tuple[float, int, int]]]]]" = \
+            OrderedDict()
+
+        self.checks = 0
+        self.detections: Dict[str, int] = {REASON_RATE: 0, REASON_REPEAT: 0, REASON_RAID: 0, REASON_PENALTY: 0}
+        self.flagged_messages = 0
+
+    def check(self, group_id: int, user_id: int, message_id: int, text: str, timestamp: float,
+              limits: Optional[FloodLimits] = None) -> Optional[FloodVerdict]:
+        limits = limits or self.limits
+        self.checks += 1
+
+        normalized = normalize_text(text) if text else ""
+        digest = text_hash(normalized) if normalized else None
+
+        verdict = None
+        if digest is not None and limits.raid_users and len(normalized) >= limits.raid_min_length \
+                and SPAM_SIGNAL_PATTERN.search(text):
+            verdict = self._check_raid(group_id, user_id, message_id, digest, timestamp, limits)
+        if verdict is None:
+            verdict = self._check_user(group_id, user_id, message_id, digest, timestamp, limits)
+
+        if verdict is not None:
+            self.detections[verdict.reason] += 1
+            self.flagged_messages += len(verdict.message_ids)
+        return verdict
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._users),
+            "groups": len(self._texts),
+            "checks": self.checks,
+            "flagged_messages": self.flagged_messages,
+            **{f"detections_{reason}": count for reason, count in self.detections.items()},
+        }
+
+    def _check_user(self, group_id: int, user_id: int, message_id: int, digest: Optional[int], now: float,
+                    limits: FloodLimits) -> Optional[FloodVerdict]:
+        key = (group_id, user_id)
+        window = self._users.get(key)
+        if window is None:
+            window = self._users[key] = _UserWindow()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+
+        if window.penalty_until > now:
+            return FloodVerdict(REASON_PENALTY, [message_id])
+
+        messages = window.messages
+        messages.append((now, message_id, digest))
+        horizon = now - max(limits.window, limits.repeat_window)
+        while messages and messages[0][0] < horizon:
+            messages.popleft()
+
+        if limits.max_messages:
+            recent = [entry for entry in messages if entry[0] >= now - limits.window]
+            if len(recent) > limits.max_messages:
+                return self._penalize(window, REASON_RATE, recent, user_id, now, limits)
+
+        if limits.max_repeats and digest is not None:
+            repeats = [entry for entry in messages if entry[2] == digest and entry[0] >= now - limits.repeat_window]
+            if len(repeats) > limits.max_repeats:
+                return self._penalize(window, REASON_REPEAT, repeats, user_id, now, limits)
+
+        return None
+
+    def _penalize(self, window: _UserWindow, reason: str, entries: List[Tuple[float, int, Optional[int]]],
+                  user_id: int, now: float, limits: FloodLimits) -> FloodVerdict:
+        flagged = {entry[1] for entry in entries}
+        window.messages = deque(entry for entry in window.messages if entry[1] not in flagged)
+        window.penalty_until = now + limits.window
+
+        return FloodVerdict(
+            reason,
+            [entry[1] for entry in entries],
+            [user_id] if limits.restrict_seconds else [],
+        )
+
+    def _check_raid(self, group_id: int, user_id: int, message_id: int, digest: int, now: float,
+                    limits: FloodLimits) -> Optional[FloodVerdict]:
+        texts = self._texts.get(group_id)
+        if texts is None:
+            texts = self._texts[group_id] = OrderedDict()
+            while len(self._texts) > self.max_groups:
+                self._texts.popitem(last=False)
+        else:
+            self._texts.move_to_end(group_id)
+
+        blocked_until, senders = texts.pop(digest, (0.0, None))
+        if senders is None:
+            senders = deque()
+        texts[digest] = (blocked_until, senders)
+        while len(texts) > self.max_texts_per_group:
+            texts.popitem(last=False)
+
+        if blocked_until > now:
+            return FloodVerdict(REASON_RAID, [message_id], [user_id] if limits.restrict_seconds else [])
+
+        senders.append((now, user_id, message_id))
+        while senders and senders[0][0] < now - limits.raid_window:
+            senders.popleft()
+
+        users = {entry[1] for entry in senders}
+        if len(users) < limits.raid_users:
+            return None
+
+        texts[digest] = (now + limits.raid_window, deque())
+        return FloodVerdict(
+            REASON_RAID,
+            [entry[2] for entry in senders],
+            sorted(users) if limits.restrict_seconds else [],
+        )
+
+
+flood_detector = FloodDetector(
+    limits=FloodLimits(
+        window=float(os.getenv("FLOOD_WINDOW", "10")),
+        max_messages=int(os.getenv("FLOOD_MAX_MESSAGES", "8")),
+        repeat_window=float(os.getenv("FLOOD_REPEAT_WINDOW", "60")),
+        max_repeats=int(os.getenv("FLOOD_MAX_REPEATS", "2")),
+        raid_window=float(os.getenv("FLOOD_RAID_WINDOW", "60")),
+        raid_users=int(os.getenv("FLOOD_RAID_USERS", "5")),
+        raid_min_length=int(os.getenv("FLOOD_RAID_MIN_LENGTH", "16")),
+        restrict_seconds=int(os.getenv("FLOOD_RESTRICT_SECONDS", "0")),
+    ),
+)
@@ -0,0 +1,87 @@
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import xxhash
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from evaluation.prompt import GROUP_PROMPT
+from evaluation.tokens import count_tokens
+from metrics.metrics import prompt_tokens, prompts_built
+
+
+class _Prefix:
+    __slots__ = ("messages", "tokens")
+
+    def __init__(self, messages: List[BaseMessage], tokens: int):
+        self.messages = messages
+        self.tokens = tokens
+
+
+class PromptBuilder:
+    """
+    Builds prompts as [system, group, tail] messages.
+
+    The system and group messages form a prefix that only changes when a group's title or rules
+    change, so it is rendered (and its tokens counted) once per version and kept in an LRU. Only
+    the tail is formatted per call. Token counts of the cacheable prefix and the uncached tail
+    are accumulated per prompt kind and exported as prompt_tokens_total.
+    """
+
+    def __init__(self, max_prefixes: int = 10_000):
+        self.max_prefixes = max_prefixes
+
+        self._prefixes: "OrderedDict[Tuple[str, str, int], _Prefix]" = OrderedDict()
+        self._system_messages: Dict[str, _Prefix] = {}
+        self._token_stats: Dict[str, Dict[str, int]] = {}
+
+    def build(self, kind: str, system_prompt: str, group_title: str, group_context: str,
+              tail: str) -> List[BaseMessage]:
+        prefix = self._prefix(kind, system_prompt, group_title, group_context)
+        tail_tokens = count_tokens(tail)
+
+        stats = self._token_stats.setdefault(kind, {"calls": 0, "cacheable_tokens": 0, "uncached_tokens": 0})
+        stats["calls"] += 1
+        stats["cacheable_tokens"] += prefix.tokens
+        stats["uncached_tokens"] += tail_tokens
+        prompts_built.inc(kind=kind)
+        prompt_tokens.inc(prefix.tokens, kind=kind, cached="true")
+        prompt_tokens.inc(tail_tokens, kind=kind, cached="false")
+
+        return prefix.messages + [HumanMessage(content=tail)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "prefixes": len(self._prefixes),
+            "kinds": {kind: dict(stats) for kind, stats in self._token_stats.items()},
+        }
+
+    def _prefix(self, kind: str, system_prompt: str, group_title: str, group_context: str) -> _Prefix:
+        key = (kind, group_title, xxhash.xxh3_64_intdigest(group_context or ""))
+
+        prefix = self._prefixes.get(key)
+        if prefix is not None:
+            self._prefixes.move_to_end(key)
+            return prefix
+
+        system = self._system_messages.get(kind)
+        if system is None:
+            system = _Prefix([SystemMessage(content=system_prompt)], count_tokens(system_prompt))
+            self._system_messages[kind] = system
+
+        group_message = GROUP_PROMPT.format(GROUP_TITLE=group_title, GROUP_CONTEXT=group_context)
+        prefix = _Prefix(
+            system.messages + [HumanMessage(content=group_message)],
+            system.tokens + count_tokens(group_message),
+        )
+
+        self._prefixes[key] = prefix
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
+
+        return prefix
+
+
+prompt_builder = PromptBuilder(
+    max_prefixes=int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "10000")),
+)
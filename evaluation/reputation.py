@@ -0,0 +1,126 @@
+import os
+import random
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database.models import UserGroupCredit
+from database.writer import BatchWriter, credit_writer
+from evaluation.flood import SPAM_SIGNAL_PATTERN
+from metrics.metrics import moderation_skipped
+
+# Messages with links or mentions are always evaluated, whatever the sender's credit.
+ALWAYS_EVALUATE_PATTERN = SPAM_SIGNAL_PATTERN
+
+
+class ReputationEngine:
+    """
+    Keeps a reputation per user and group in UserGroupCredit and samples evaluations by it.
+
+    Every clean verdict of the LLM raises a user's credit by clean_gain, up to max_credit;
+    cached and locally decided verdicts don't, so reposting a known clean message earns nothing.
+    A violation, however it was decided, drops the credit below zero by violation_penalty, down
+    to min_credit, so a single violation undoes a long clean record. Credit earned in one group
+    isn't trusted in another. Credits are held in an LRU and written behind in batches.
+
+    Users below trusted_credit are always evaluated. Users at or above it are evaluated on a
+    sample_rate fraction of their messages, and on every message with a link or mention; the
+    flood detector and the group rules still see all of their messages.
+    """
+
+    def __init__(self, writer: BatchWriter, clean_gain: float = 1.0, violation_penalty: float = 20.0,
+                 max_credit: float = 100.0, min_credit: float = -100.0, trusted_credit: float = 30.0,
+                 sample_rate: float = 0.2, enabled: bool = True, max_size: int = 200_000):
+        self.writer = writer
+        self.clean_gain = clean_gain
+        self.violation_penalty = violation_penalty
+        self.max_credit = max_credit
+        self.min_credit = min_credit
+        self.trusted_credit = trusted_credit
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.max_size = max_size
+
+        self._credits: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+
+        self.loads = 0
+        self.evaluated = 0
+        self.sampled_out = 0
+        self.clean = 0
+        self.violations = 0
+
+    async def credit(self, user_id: int, group_id: int) -> float:
+        key = (user_id, group_id)
+        credit = self._credits.get(key)
+        if credit is not None:
+            self._credits.move_to_end(key)
+            return credit
+
+        self.loads += 1
+        credits = await UserGroupCredit.filter(user_id=user_id, group_id=group_id).values_list("credit", flat=True)
+        credit = credits[0] if credits else 0.0
+        # A concurrent record() may have stored a newer credit meanwhile.
+        newer = self._credits.get(key)
+        return newer if newer is not None else self._remember(key, credit)
+
+    async def should_evaluate(self, user_id: int, group_id: int, text: Optional[str]) -> bool:
+        if not self.enabled:
+            return True
+
+        if await self.credit(user_id, group_id) < self.trusted_credit or ALWAYS_EVALUATE_PATTERN.search(text or "") \
+                or random.random() < self.sample_rate:
+            self.evaluated += 1
+            return True
+
+        self.sampled_out += 1
+        moderation_skipped.inc(reason="reputation")
+        return False
+
+    async def record(self, user_id: int, group_id: int, violation: bool):
+        """
+        Records a verdict on a user's message. Clean verdicts should only be recorded when the LLM gave them.
+        """
+        credit = await self.credit(user_id, group_id)
+        if violation:
+            self.violations += 1
+            credit = max(self.min_credit, min(credit, 0.0) - self.violation_penalty)
+        else:
+            self.clean += 1
+            credit = min(self.max_credit, credit + self.clean_gain)
+
+        self._remember((user_id, group_id), credit)
+        await self.writer.put(UserGroupCredit(user_id=user_id, group_id=group_id, credit=credit))
+
+    def stats(self) -> Dict[str, Any]:
+        decisions = self.evaluated + self.sampled_out
+        return {
+            "enabled": self.enabled,
+            "credits": len(self._credits),
+            "loads": self.loads,
+            "evaluated": self.evaluated,
+            "sampled_out": self.sampled_out,
+            "sampled_out_ratio": self.sampled_out / decisions if decisions else 0.0,
+            "clean": self.clean,
+            "violations": self.violations,
+        }
+
+    def _remember(self, key: Tuple[int, int], credit: float) -> float:
+        self._credits[key] = credit
+        self._credits.move_to_end(key)
+
+        while len(self._credits) > self.max_size:
+            self._credits.popitem(last=False)
+
+        return credit
+
+
+reputation = ReputationEngine(
+    credit_writer,
+    clean_gain=float(os.getenv("REPUTATION_CLEAN_GAIN", "1")),
+    violation_penalty=float(os.getenv("REPUTATION_VIOLATION_PENALTY", "20")),
+    max_credit=float(os.getenv("REPUTATION_MAX_CREDIT", "100")),
+    min_credit=float(os.getenv("REPUTATION_MIN_CREDIT", "-100")),
+    trusted_credit=float(os.getenv("REPUTATION_TRUSTED_CREDIT", "30")),
+    sample_rate=float(os.getenv("REPUTATION_SAMPLE_RATE", "0.2")),
+    enabled=os.getenv("REPUTATION_ENABLED", "true").lower() in ("1", "true", "yes"),
+    max_size=int(os.getenv("REPUTATION_MAX_SIZE", "200000")),
+)
@@ -0,0 +1,368 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar
+
+import httpx
+import openai
+from structlog import get_logger
+
+from metrics.metrics import llm_attempts, llm_hedge_wins, llm_unavailable
+
+logger = get_logger()
+
+R = TypeVar("R")
+
+STATE_CLOSED = "closed"
+STATE_HALF_OPEN = "half_open"
+STATE_OPEN = "open"
+
+REASON_CIRCUIT_OPEN = "circuit_open"
+REASON_DEADLINE = "deadline"
+REASON_ERRORS = "errors"
+
+# Errors that say the provider is unhealthy rather than that the request was wrong
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+)
+
+
+# (stage, loop time) set by LLMGuard.shared_deadline for the calls of one stage in this context
+_shared_deadline: ContextVar[Optional[Tuple[str, float]]] = ContextVar("shared_deadline", default=None)
+# Filled with the model that answered each stage, see LLMGuard.answering_models
+_answering_models: ContextVar[Optional[Dict[str, str]]] = ContextVar("answering_models", default=None)
+
+
+class _DeadlineExceeded(Exception):
+    pass
+
+
+class ProviderUnavailable(Exception):
+    """
+    The LLM provider could not answer in time; callers fall back to a local decision.
+    """
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold provider failures in a row and rejects calls for
+    reset_timeout seconds. Then a single probe call is let through: its success closes the
+    circuit again, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.trips = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == STATE_OPEN
+
+    def allow(self) -> bool:
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = STATE_HALF_OPEN
+            self._probing = False
+
+        if self.state == STATE_HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+
+        return True
+
+    def release(self):
+        """
+        Lets another probe through after one that ended without an outcome, e.g. cancelled.
+        """
+        if self.state == STATE_HALF_OPEN:
+            self._probing = False
+
+    def success(self):
+        if self.state != STATE_CLOSED:
+            logger.info("llm circuit closed")
+        self.state = STATE_CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def failure(self):
+        self._failures += 1
+        if self.state == STATE_HALF_OPEN or (self.state == STATE_CLOSED and self._failures >= self.failure_threshold):
+            self.state = STATE_OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+            self.trips += 1
+            logger.warning("llm circuit opened", failures=self._failures, reset_timeout=self.reset_timeout)
+
+
+class LLMGuard:
+    """
+    Bounds the latency of LLM calls.
+
+    Every call gets the deadline of its stage, covering all of its attempts. An attempt that
+    hasn't answered after the stage's recent p95 latency is hedged with a duplicate request,
+    optionally to hedge_model, and the first answer wins; hedges are limited to hedge_ratio of
+    the calls so an incident doesn't double the load on the provider. Failed attempts are
+    retried with full-jitter exponential backoff while the deadline allows.
+
+    Provider failures feed a circuit breaker. While it is open, and whenever a deadline runs
+    out, calls raise ProviderUnavailable right away so the caller can decide locally.
+
+    Calls inside shared_deadline(stage) share the stage's deadline instead of getting one each.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, deadline: float = 10.0,
+                 stage_deadlines: Optional[Dict[str, float]] = None, hedge: bool = True,
+                 hedge_model: Optional[str] = None, hedge_delay: float = 2.0, min_hedge_delay: float = 0.3,
+                 hedge_ratio: float = 0.1, max_retries: int = 2, retry_backoff: float = 0.2,
+                 max_retry_backoff: float = 2.0, min_samples: int = 20):
+        self.breaker = breaker
+        self.deadline = deadline
+        self.stage_deadlines = stage_deadlines or {}
+        self.hedge = hedge
+        self.hedge_model = hedge_model
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.hedge_ratio = hedge_ratio
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.min_samples = min_samples
+
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._hedge_tokens = 1.0
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.unavailable = 0
+
+    def deadline_for(self, stage: str) -> float:
+        return self.stage_deadlines.get(stage, self.deadline)
+
+    def hedge_delay_for(self, stage: str) -> float:
+        latencies = self._latencies.get(stage)
+        if not latencies or len(latencies) < self.min_samples:
+            return self.hedge_delay
+
+        ordered = sorted(latencies)
+        p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        return max(self.min_hedge_delay, p95)
+
+    @contextmanager
+    def shared_deadline(self, stage: str):
+        """
+        Makes the calls of stage in this block share one deadline, e.g. a cascade's weak call and
+        its escalation, so the stage as a whole stays within it.
+        """
+        token = _shared_deadline.set((stage, asyncio.get_running_loop().time() + self.deadline_for(stage)))
+        try:
+            yield
+        finally:
+            _shared_deadline.reset(token)
+
+    @contextmanager
+    def answering_models(self) -> Iterator[Dict[str, str]]:
+        """
+        Collects the model that answered each stage called in this block, which can differ from
+        the one asked for after a cascade or a hedge to hedge_model.
+        """
+        models: Dict[str, str] = {}
+        token = _answering_models.set(models)
+        try:
+            yield models
+        finally:
+            _answering_models.reset(token)
+
+    async def call(self, stage: str, model_name: str, invoke: Callable[[str], Awaitable[R]]) -> R:
+        """
+        Runs invoke(model_name) under the stage's deadline, with hedging and retries.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_for(stage)
+        shared = _shared_deadline.get()
+        if shared is not None and shared[0] == stage:
+            deadline = min(deadline, shared[1])
+            if loop.time() >= deadline:
+                # Spent by earlier calls of the stage, the provider isn't at fault.
+                raise self._unavailable(stage, REASON_DEADLINE)
+
+        if not self.breaker.allow():
+            raise self._unavailable(stage, REASON_CIRCUIT_OPEN)
+        probe = self.breaker.state == STATE_HALF_OPEN
+
+        self.calls += 1
+        self._hedge_tokens = min(self._hedge_tokens + self.hedge_ratio, 10.0)
+
+        try:
+            return await self._call(stage, model_name, invoke, deadline)
+        except BaseException:
+            # Outcomes are recorded in _call; a cancelled probe has none and would block the circuit.
+            if probe:
+                self.breaker.release()
+            raise
+
+    async def _call(self, stage: str, model_name: str, invoke: Callable[[str], Awaitable[R]], deadline: float) -> R:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+
+        while True:
+            try:
+                result = await self._attempt(stage, model_name, invoke, deadline, "retry" if attempt else "primary")
+            except _DeadlineExceeded:
+                self.breaker.failure()
+                raise self._unavailable(stage, REASON_DEADLINE)
+            except RETRYABLE_ERRORS as e:
+                self.breaker.failure()
+                attempt += 1
+
+                delay = random.uniform(0, min(self.max_retry_backoff, self.retry_backoff * 2 ** attempt))
+                if attempt > self.max_retries or self.breaker.is_open or loop.time() + delay >= deadline:
+                    raise self._unavailable(stage, REASON_ERRORS) from e
+
+                self.retries += 1
+                logger.debug("retrying llm call", stage=stage, attempt=attempt, delay=delay, error=repr(e))
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # The provider answered, the request or the answer was at fault.
+                self.breaker.success()
+                raise
+
+            self.breaker.success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit_state": (STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN).index(self.breaker.state),
+            "circuit_trips": self.breaker.trips,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "unavailable": self.unavailable,
+            "hedge_delays": {stage: round(self.hedge_delay_for(stage), 3) for stage in self._latencies},
+        }
+
+    async def _attempt(self, stage: str, model_name: str, invoke: Callable[[str], Awaitable[R]],
+                       deadline: float, kind: str) -> R:
+        loop = asyncio.get_running_loop()
+        pending: Dict[asyncio.Task, Tuple[str, str, float]] = {}
+
+        def launch(name: str, task_kind: str):
+            task = asyncio.create_task(invoke(name))
+            # Losers are cancelled and never awaited, don't let their errors be reported as unretrieved.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            pending[task] = (task_kind, name, loop.time())
+            llm_attempts.inc(stage=stage, kind=task_kind)
+
+        launch(model_name, kind)
+        hedge_at = loop.time() + self.hedge_delay_for(stage) if self._can_hedge() else None
+        error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    raise _DeadlineExceeded()
+
+                timeout = deadline - now
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_kind, name, launched_at = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self._observe(stage, loop.time() - launched_at)
+                        models = _answering_models.get()
+                        if models is not None:
+                            models[stage] = name
+                        if task_kind == "hedge":
+                            self.hedge_wins += 1
+                            llm_hedge_wins.inc(stage=stage)
+                        return task.result()
+                    if not isinstance(error, RETRYABLE_ERRORS):
+                        raise error
+
+                if hedge_at is not None and pending and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if self._take_hedge_token():
+                        self.hedges += 1
+                        launch(self.hedge_model or model_name, "hedge")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    def _can_hedge(self) -> bool:
+        return self.hedge and self.breaker.state == STATE_CLOSED
+
+    def _take_hedge_token(self) -> bool:
+        if self._hedge_tokens < 1.0:
+            return False
+        self._hedge_tokens -= 1.0
+        return True
+
+    def _observe(self, stage: str, seconds: float):
+        latencies = self._latencies.get(stage)
+        if latencies is None:
+            latencies = self._latencies[stage] = deque(maxlen=500)
+        latencies.append(seconds)
+
+    def _unavailable(self, stage: str, reason: str) -> ProviderUnavailable:
+        self.unavailable += 1
+        llm_unavailable.inc(stage=stage, reason=reason)
+        logger.warning("llm provider unavailable", stage=stage, reason=reason)
+        return ProviderUnavailable(stage, reason)
+
+
+def _stage_deadlines(value: str) -> Dict[str, float]:
+    deadlines = {}
+    for item in value.split(","):
+        if "=" in item:
+            stage, seconds = item.split("=", 1)
+            deadlines[stage.strip()] = float(seconds)
+    return deadlines
+
+
+llm_guard = LLMGuard(
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+    ),
+    deadline=float(os.getenv("LLM_DEADLINE", "10")),
+    stage_deadlines=_stage_deadlines(os.getenv("LLM_STAGE_DEADLINES", "")),
+    hedge=os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes"),
+    hedge_model=os.getenv("LLM_HEDGE_MODEL") or None,
+    hedge_delay=float(os.getenv("LLM_HEDGE_DELAY", "2")),
+    min_hedge_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.3")),
+    hedge_ratio=float(os.getenv("LLM_HEDGE_RATIO", "0.1")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+    retry_backoff=float(os.getenv("LLM_RETRY_BACKOFF", "0.2")),
+    max_retry_backoff=float(os.getenv("LLM_RETRY_MAX_BACKOFF", "2")),
+)
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from structlog import get_logger
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+Job = Callable[[], Awaitable[T]]
+
+POLICY_DROP = "drop"
+POLICY_DEGRADE = "degrade"
+
+
+class _Pending:
+    __slots__ = ("group_id", "job", "degraded", "future", "enqueued_at", "timer")
+
+    def __init__(self, group_id: int, job: Job, degraded: Optional[Job], future: asyncio.Future):
+        self.group_id = group_id
+        self.job = job
+        self.degraded = degraded
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EvaluationScheduler:
+    """
+    Runs LLM evaluations under a global concurrency cap, round-robin across groups.
+
+    Every group has its own bounded FIFO queue and free slots are handed to the groups in turn,
+    so a raided group can only ever take its fair share of the provider. A job that can't be
+    queued, or that is still queued after max_wait, is shed: its degraded job runs instead when
+    the policy is "degrade" and one was given, otherwise submit() returns None.
+    """
+
+    def __init__(self, max_concurrency: int = 32, max_queue_per_group: int = 50, max_queued: int = 2000,
+                 max_wait: float = 15.0, policy: str = POLICY_DEGRADE, max_degraded_concurrency: int = 8):
+        if policy not in (POLICY_DROP, POLICY_DEGRADE):
+            raise ValueError(f"Unknown overflow policy: {policy}")
+
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_group = max_queue_per_group
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.policy = policy
+        self.max_degraded_concurrency = max_degraded_concurrency
+
+        self._queues: "OrderedDict[int, Deque[_Pending]]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._degraded_running = 0
+
+        self.started = 0
+        self.shed = 0
+        self.degraded = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._recent_waits: Deque[float] = deque(maxlen=1000)
+
+    async def submit(self, group_id: int, job: Job, degraded: Optional[Job] = None) -> Optional[T]:
+        queue = self._queues.get(group_id)
+        if self._queued >= self.max_queued or (queue is not None and len(queue) >= self.max_queue_per_group):
+            return await self._shed(group_id, degraded, reason="queue_full")
+
+        loop = asyncio.get_running_loop()
+        pending = _Pending(group_id, job, degraded, loop.create_future())
+        if queue is None:
+            queue = self._queues[group_id] = deque()
+        queue.append(pending)
+        self._queued += 1
+        pending.timer = loop.call_later(self.max_wait, self._expire, pending)
+
+        self._dispatch()
+
+        return await pending.future
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._recent_waits)
+        return {
+            "queued": self._queued,
+            "running": self._running,
+            "degraded_running": self._degraded_running,
+            "groups_waiting": len(self._queues),
+            "started": self.started,
+            "shed": self.shed,
+            "degraded": self.degraded,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "wait_seconds_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_seconds_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+        }
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency and self._queues:
+            # Take the head of the group that has waited longest for a turn, then send the
+            # group to the back of the rotation.
+            group_id, queue = next(iter(self._queues.items()))
+            pending = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(group_id)
+            else:
+                del self._queues[group_id]
+
+            pending.timer.cancel()
+            if pending.future.cancelled():
+                continue
+
+            self._record_wait(pending)
+            self._running += 1
+            self.started += 1
+            asyncio.create_task(self._run(pending))
+
+    def _expire(self, pending: _Pending):
+        """
+        Sheds a job still queued after max_wait, so submit() never waits longer than that for a slot.
+        """
+        queue = self._queues.get(pending.group_id)
+        if queue is None or pending not in queue:
+            return
+
+        queue.remove(pending)
+        self._queued -= 1
+        if not queue:
+            del self._queues[pending.group_id]
+
+        if pending.future.cancelled():
+            return
+
+        self._record_wait(pending)
+        asyncio.create_task(self._resolve_shed(pending))
+
+    def _record_wait(self, pending: _Pending):
+        waited = time.monotonic() - pending.enqueued_at
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self._recent_waits.append(waited)
+
+    async def _run(self, pending: _Pending):
+        try:
+            result = await pending.job()
+        except Exception as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+        else:
+            if not pending.future.done():
+                pending.future.set_result(result)
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    async def _resolve_shed(self, pending: _Pending):
+        try:
+            result = await self._shed(pending.group_id, pending.degraded, reason="wait_exceeded")
+        except Exception as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+        else:
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    async def _shed(self, group_id: int, degraded: Optional[Job], reason: str) -> Optional[T]:
+        if (self.policy == POLICY_DEGRADE and degraded is not None
+                and self._degraded_running < self.max_degraded_concurrency):
+            self.degraded += 1
+            self._degraded_running += 1
+            logger.warning("evaluation degraded", group_id=group_id, reason=reason)
+            try:
+                return await degraded()
+            finally:
+                self._degraded_running -= 1
+
+        self.shed += 1
+        logger.warning("evaluation shed", group_id=group_id, reason=reason)
+        return None
+
+
+evaluation_scheduler = EvaluationScheduler(
+    max_concurrency=int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "32")),
+    max_queue_per_group=int(os.getenv("SCHEDULER_MAX_QUEUE_PER_GROUP", "50")),
+    max_queued=int(os.getenv("SCHEDULER_MAX_QUEUED", "2000")),
+    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "15")),
+    policy=os.getenv("SCHEDULER_OVERFLOW_POLICY", POLICY_DEGRADE),
+    max_degraded_concurrency=int(os.getenv("SCHEDULER_MAX_DEGRADED_CONCURRENCY", "8")),
+)
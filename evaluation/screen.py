@@ -0,0 +1,308 @@
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from structlog import get_logger
+
+from evaluation.flag import FlagResponse, JudgmentResponse
+
+# The regex parser is private; it moved from sre_parse to re._parser in Python 3.11.
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+logger = get_logger()
+
+REGEX_PREFIX = "re:"
+PRESET_PREFIX = ":"
+
+# Owner patterns run on the event loop, so they're kept short and free of nested quantifiers,
+# the usual cause of catastrophic backtracking.
+MAX_PATTERN_LENGTH = int(os.getenv("SCREEN_MAX_PATTERN_LENGTH", "200"))
+
+# Possessive quantifiers only exist from Python 3.11 on.
+_REPEATS = tuple(
+    getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(sre_parse, name)
+)
+
+# Built-in patterns, enabled with a ":name" line. They run on casefolded text and start with a
+# character class or literal, which lets the regex engine skip most positions quickly.
+PRESETS = {
+    "links": r"(?:https?://|www\.|(?:t|telegram)\.me/)\S+",
+    "mentions": r"@(?<![\w@]@)[a-z][a-z0-9_]{4,31}\b",
+    "phones": r"[+\d](?<![+\d][+\d])[\d\s\-]{8,14}\d(?!\d)",
+}
+
+# Invisible characters are dropped and Arabic letters typed on Persian keyboards mapped to the
+# Persian ones. A regex finds them much faster than str.translate scans non-ASCII text.
+_SCREEN_REPLACEMENTS = {"ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه"}
+_SCREEN_REPLACE_RE = re.compile("[\u200b-\u200f\u2060\ufeff" + "".join(_SCREEN_REPLACEMENTS) + "]")
+
+
+def normalize_screen_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    text = _SCREEN_REPLACE_RE.sub(lambda found: _SCREEN_REPLACEMENTS.get(found.group(0), ""), text)
+    return " ".join(text.split()).casefold()
+
+
+class AhoCorasick:
+    """
+    Finds any of a set of keywords in one pass over the text.
+    """
+
+    def __init__(self, keywords: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]
+
+        for keyword in keywords:
+            self._add(keyword)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def find(self, text: str) -> Optional[str]:
+        goto, fail, output = self._goto, self._fail, self._output
+
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+
+        return None
+
+    def _add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = next_state
+
+        if self._output[state] is None:
+            self._output[state] = keyword
+
+    def _link(self):
+        # Breadth-first, so the fail state of every node is final before its children are linked.
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # A keyword that ends inside a longer one is reported too.
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+                queue.append(child)
+
+
+def combine_patterns(patterns: List[str]) -> re.Pattern:
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+def _subpatterns(value: Any):
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+def _nested_quantifier(parsed: sre_parse.SubPattern, repeated: bool = False) -> bool:
+    r"""
+    Whether an unbounded quantifier is inside another quantifier, e.g. (a+)+ or (\w*\s?)*.
+    """
+    for op, value in parsed:
+        if op in _REPEATS:
+            _, high, item = value
+            if repeated and high == sre_parse.MAXREPEAT:
+                return True
+            if _nested_quantifier(item, repeated or high > 1):
+                return True
+        elif any(_nested_quantifier(subpattern, repeated) for subpattern in _subpatterns(value)):
+            return True
+
+    return False
+
+
+def _check_pattern(pattern: str) -> Optional[str]:
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        return f"longer than {MAX_PATTERN_LENGTH} characters"
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        return str(e)
+
+    if _nested_quantifier(parsed):
+        return "nested quantifiers like (a+)+ can take too long to match"
+
+    return None
+
+
+def parse_rules(text: str) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Splits a group's rules into keywords, regular expressions and error messages.
+
+    One rule per line: a keyword or phrase, "re:<pattern>" for a regular expression, or
+    ":links", ":mentions" or ":phones" for a built-in pattern. Lines starting with "#" are comments.
+    Patterns are checked the way ScreenEngine combines them, so rules without errors always compile.
+    """
+    keywords, patterns, errors = [], [], []
+
+    for line in (text or "").splitlines():
+        rule = line.strip()
+        if not rule or rule.startswith("#"):
+            continue
+
+        if rule.startswith(REGEX_PREFIX):
+            # Case-insensitive on its own, the presets don't need the slower flag.
+            pattern = rule[len(REGEX_PREFIX):].strip()
+            error = _check_pattern(pattern)
+            if error is not None:
+                errors.append(f"{rule}: {error}")
+                continue
+            pattern = f"(?i:{pattern})"
+        elif rule.startswith(PRESET_PREFIX):
+            pattern = PRESETS.get(rule[len(PRESET_PREFIX):].strip().lower())
+            if pattern is None:
+                errors.append(f"{rule}: unknown preset, use one of {', '.join(':' + name for name in PRESETS)}")
+                continue
+        else:
+            keyword = normalize_screen_text(rule)
+            if keyword:
+                keywords.append(keyword)
+            continue
+
+        # Inline flags and repeated group names only fail once the patterns are wrapped and joined.
+        try:
+            combine_patterns(patterns + [pattern])
+        except re.error as e:
+            errors.append(f"{rule}: {e}")
+            continue
+        patterns.append(pattern)
+
+    return keywords, patterns, errors
+
+
+class ScreenEngine:
+    """
+    A group's rules compiled into one Aho-Corasick automaton for the keywords and one combined
+    regular expression for the patterns. Both run on normalized text.
+    """
+
+    def __init__(self, rules: str):
+        keywords, patterns, self.errors = parse_rules(rules)
+
+        self._keywords = AhoCorasick(keywords) if keywords else None
+        self._pattern: Optional[re.Pattern] = None
+        if patterns:
+            try:
+                self._pattern = combine_patterns(patterns)
+            except re.error as e:
+                self.errors.append(f"patterns skipped: {e}")
+                patterns = []
+
+        self.rules = len(keywords) + len(patterns)
+
+    def match(self, text: str) -> Optional[str]:
+        if not text or not self.rules:
+            return None
+
+        text = normalize_screen_text(text)
+        if self._keywords is not None:
+            keyword = self._keywords.find(text)
+            if keyword is not None:
+                return keyword
+
+        if self._pattern is not None:
+            found = self._pattern.search(text)
+            if found is not None:
+                return found.group(0)
+
+        return None
+
+
+class ScreenCache:
+    """
+    Compiled rule engines keyed by group id. An engine is rebuilt only when the group's rules
+    text differs from the one it was compiled from.
+    """
+
+    def __init__(self, max_size: int = 50_000):
+        self.max_size = max_size
+
+        self._engines: "OrderedDict[int, Tuple[str, ScreenEngine]]" = OrderedDict()
+
+        self.builds = 0
+        self.checks = 0
+        self.matches = 0
+
+    def engine(self, group_id: int, rules: str) -> ScreenEngine:
+        cached = self._engines.get(group_id)
+        if cached is not None and cached[0] == rules:
+            self._engines.move_to_end(group_id)
+            return cached[1]
+
+        engine = ScreenEngine(rules)
+        self.builds += 1
+        if engine.errors:
+            logger.warning("invalid screen rules skipped", group_id=group_id, errors=engine.errors)
+
+        self._engines[group_id] = (rules, engine)
+        self._engines.move_to_end(group_id)
+        while len(self._engines) > self.max_size:
+            self._engines.popitem(last=False)
+
+        return engine
+
+    def screen(self, group_id: int, rules: str, text: str) -> Optional[Tuple[FlagResponse, JudgmentResponse]]:
+        """
+        Returns a verdict when the text hits one of the group's rules. Other messages need the LLM.
+        """
+        if not rules:
+            return None
+
+        self.checks += 1
+        hit = self.engine(group_id, rules).match(text)
+        if hit is None:
+            return None
+
+        self.matches += 1
+        return (
+            FlagResponse(classification="SPAM", confidence="High", level="Medium", primary_evidence=hit[:20],
+                         reasoning="group rule"),
+            JudgmentResponse(
+                user_account_action="DISMISS",
+                user_message_action="DELETE",
+                confidence="5",
+                reasoning="group rule",
+                message_to_user="پیام شما با قوانین گروه مغایرت داشت و حذف شد.",
+            ),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engines": len(self._engines),
+            "builds": self.builds,
+            "checks": self.checks,
+            "matches": self.matches,
+            "match_ratio": self.matches / self.checks if self.checks else 0.0,
+        }
+
+
+screen_cache = ScreenCache(
+    max_size=int(os.getenv("SCREEN_CACHE_MAX_SIZE", "50000")),
+)
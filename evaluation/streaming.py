@@ -0,0 +1,135 @@
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+STATE_START = "start"
+STATE_KEY = "key"
+STATE_COLON = "colon"
+STATE_VALUE = "value"
+STATE_LITERAL = "literal"
+STATE_CONTAINER = "container"
+STATE_AFTER_VALUE = "after_value"
+STATE_DONE = "done"
+
+
+class PartialJSONObject:
+    """
+    Incremental parser for a JSON object that arrives in chunks, e.g. a streamed structured answer.
+
+    Each top-level field is added to fields as soon as its value is complete, so a caller can act on
+    the first fields of the answer before the rest has been generated. Nested values are parsed
+    whole once they close.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+
+        self._text = ""
+        self._position = 0
+        self._state = STATE_START
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = 0
+        self._key: Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return self._state == STATE_DONE
+
+    def feed(self, chunk: str):
+        self._text += chunk
+        text = self._text
+
+        for position in range(self._position, len(text)):
+            char = text[position]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._string_closed(position)
+                continue
+
+            if self._state == STATE_START:
+                if char == "{":
+                    self._depth = 1
+                    self._state = STATE_KEY
+            elif self._state == STATE_KEY:
+                if char == '"':
+                    self._open_string(position)
+                elif char == "}":
+                    self._state = STATE_DONE
+            elif self._state == STATE_COLON:
+                if char == ":":
+                    self._state = STATE_VALUE
+            elif self._state == STATE_VALUE:
+                if char == '"':
+                    self._open_string(position)
+                elif char in "{[":
+                    self._start = position
+                    self._depth += 1
+                    self._state = STATE_CONTAINER
+                elif not char.isspace():
+                    self._start = position
+                    self._state = STATE_LITERAL
+            elif self._state == STATE_LITERAL:
+                if char in ",}":
+                    self._set(text[self._start:position].strip())
+                    self._state = STATE_KEY if char == "," else STATE_DONE
+            elif self._state == STATE_CONTAINER:
+                if char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                    if self._depth == 1:
+                        self._set(text[self._start:position + 1])
+                        self._state = STATE_AFTER_VALUE
+            elif self._state == STATE_AFTER_VALUE:
+                if char == ",":
+                    self._state = STATE_KEY
+                elif char == "}":
+                    self._state = STATE_DONE
+
+            if self._state == STATE_DONE:
+                break
+
+        self._position = len(text)
+
+    def _open_string(self, position: int):
+        self._in_string = True
+        self._start = position
+
+    def _string_closed(self, position: int):
+        if self._state == STATE_KEY:
+            self._key = json.loads(self._text[self._start:position + 1])
+            self._state = STATE_COLON
+        elif self._state == STATE_VALUE:
+            self._set(self._text[self._start:position + 1])
+            self._state = STATE_AFTER_VALUE
+
+    def _set(self, raw: str):
+        self.fields[self._key] = json.loads(raw)
+
+
+async def stream_fields(chunks: AsyncIterator[str], decided: Callable[[Dict[str, Any]], bool]) -> Dict[str, Any]:
+    """
+    Reads a streamed JSON answer until decided(fields) holds or the answer is complete, and closes the
+    stream either way, which cancels the rest of the generation.
+
+    Raises ValueError when the stream ends before the answer does.
+    """
+    parser = PartialJSONObject()
+    try:
+        async for chunk in chunks:
+            parser.feed(chunk)
+            if parser.complete or decided(parser.fields):
+                return parser.fields
+    finally:
+        await chunks.aclose()
+
+    raise ValueError(f"structured answer ended early, fields received: {sorted(parser.fields)}")
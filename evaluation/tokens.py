@@ -0,0 +1,58 @@
+import os
+from typing import Optional
+
+import tiktoken
+from structlog import get_logger
+
+logger = get_logger()
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+_encoding: Optional[tiktoken.Encoding] = None
+_encoding_failed = False
+
+
+def get_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Loads the tiktoken encoding once. tiktoken downloads it on first use, so when that isn't
+    possible token counts fall back to an estimate instead of failing the evaluation.
+    """
+    global _encoding, _encoding_failed
+
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning("tiktoken encoding unavailable, estimating token counts", error=str(e))
+
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 3 + 1
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, marker: str = "…") -> str:
+    # A byte-level BPE token is at least one UTF-8 byte, so short texts can't exceed the limit.
+    # Characters aren't enough: an emoji or a Persian letter can take several tokens.
+    if not text or len(text.encode("utf-8")) <= max_tokens:
+        return text
+
+    encoding = get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * 3
+        return text if len(text) <= max_chars else text[:max_chars] + marker
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+
+    return encoding.decode(tokens[:max_tokens]) + marker
@@ -0,0 +1,238 @@
+"""
+Trains the local classifier on the verdicts stored in SuspiciousMessage and prints its calibration.
+
+    python -m evaluation.train_classifier [--out classifier.npz] [--limit 200000] [--max-error 0.01]
+
+Messages the LLM found CLEAN, and messages it deleted, labelled with their classification, are
+used; flagged messages that were let through are ambiguous and left out, and so are classes that
+depend on the group's rules, like IRRELEVANT_TO_GROUP. Repeated texts count once. The verdicts
+are split three ways: the model is trained on the first part, its temperature and short-circuit
+thresholds are fitted on the second, and the report is computed on the third, which the model
+has never seen.
+
+A threshold is the lowest probability at which at most --max-error of the calibration messages
+above it were decided otherwise by the LLM, over at least --min-support messages, and never
+below 1 - --max-error, so no single message is decided on a weaker guess. When none qualifies,
+that side never short-circuits. The bot loads the model from CLASSIFIER_PATH on start.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database.database import close_db, init_db
+from database.models import SuspiciousMessage
+from evaluation.classifier import CLEAN, GROUP_DEPENDENT_CLASSES, HashedNgramModel, train_model
+from evaluation.screen import normalize_screen_text
+
+TEMPERATURES = np.geomspace(0.05, 5.0, 41)
+
+
+async def load_examples(limit: int) -> Tuple[List[str], List[str]]:
+    await init_db()
+    try:
+        rows = await SuspiciousMessage.all().order_by("-timestamp").limit(limit) \
+            .values("message", "classification", "deleted")
+    finally:
+        await close_db()
+
+    # Newest first, so a repeated text keeps its latest verdict.
+    examples: Dict[str, Tuple[str, str]] = {}
+    for row in rows:
+        if row["classification"] in GROUP_DEPENDENT_CLASSES:
+            continue
+        if row["deleted"] and row["classification"] != CLEAN:
+            label = row["classification"]
+        elif not row["deleted"] and row["classification"] == CLEAN:
+            label = CLEAN
+        else:
+            continue
+        examples.setdefault(normalize_screen_text(row["message"] or ""), (row["message"], label))
+
+    return [text for text, _ in examples.values()], [label for _, label in examples.values()]
+
+
+def predict_all(model: HashedNgramModel, texts: List[str]) -> np.ndarray:
+    return np.array([model.predict_proba(text) for text in texts])
+
+
+def fit_temperature(model: HashedNgramModel, texts: List[str], targets: np.ndarray) -> float:
+    model.temperature = 1.0
+    logits = np.log(np.clip(predict_all(model, texts), 1e-12, None))
+
+    def log_loss(temperature: float) -> float:
+        scaled = logits / temperature
+        scaled -= scaled.max(axis=1, keepdims=True)
+        log_probabilities = scaled - np.log(np.exp(scaled).sum(axis=1, keepdims=True))
+        return float(-log_probabilities[np.arange(len(targets)), targets].mean())
+
+    return float(min(TEMPERATURES, key=log_loss))
+
+
+def pick_threshold(scores: np.ndarray, wrong: np.ndarray, max_error: float, min_support: int) -> float:
+    """
+    Lowest score at which the messages scoring at least that much are wrong at most max_error of the time.
+    """
+    order = np.argsort(-scores)
+    errors = np.cumsum(wrong[order]) / np.arange(1, len(order) + 1)
+
+    threshold = math.inf
+    for position in range(min_support - 1, len(order)):
+        # Ties are decided together, only the last message of a run of equal scores is a cut-off.
+        if position + 1 < len(order) and scores[order[position + 1]] == scores[order[position]]:
+            continue
+        if errors[position] <= max_error:
+            threshold = float(scores[order[position]])
+
+    return threshold
+
+
+def split(count: int, holdout: float, seed: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    order = np.random.default_rng(seed).permutation(count)
+    held_out = int(count * holdout)
+    return order[2 * held_out:], order[:held_out], order[held_out:2 * held_out]
+
+
+def calibration_report(model: HashedNgramModel, texts: List[str], labels: List[str], bins: int) -> Dict[str, Any]:
+    probabilities = predict_all(model, texts)
+    targets = np.array([model.classes.index(label) for label in labels])
+    clean_probability = probabilities[:, model.clean_index]
+    is_clean = targets == model.clean_index
+
+    reliability = []
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    expected_error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (clean_probability >= low) & ((clean_probability < high) | (high == 1.0))
+        if not in_bin.any():
+            continue
+        predicted, observed = float(clean_probability[in_bin].mean()), float(is_clean[in_bin].mean())
+        expected_error += in_bin.sum() / len(texts) * abs(predicted - observed)
+        reliability.append({"bin": f"{low:.1f}-{high:.1f}", "messages": int(in_bin.sum()),
+                            "predicted_clean": predicted, "observed_clean": observed})
+
+    decided_clean = clean_probability >= model.clean_threshold
+    decided_violation = 1.0 - clean_probability >= model.violation_threshold
+
+    timings = []
+    for text in texts[:1000]:
+        started = time.perf_counter()
+        model.predict_proba(text)
+        timings.append(time.perf_counter() - started)
+
+    return {
+        "messages": len(texts),
+        "accuracy": float((probabilities.argmax(axis=1) == targets).mean()),
+        "log_loss": float(-np.log(np.clip(probabilities[np.arange(len(targets)), targets], 1e-12, None)).mean()),
+        "brier_clean": float(((clean_probability - is_clean) ** 2).mean()),
+        "expected_calibration_error": float(expected_error),
+        "temperature": model.temperature,
+        "clean_threshold": model.clean_threshold,
+        "violation_threshold": model.violation_threshold,
+        "clean_coverage": float(decided_clean.mean()),
+        # Violations that a CLEAN short-circuit would have let through, and clean messages it would have deleted.
+        "clean_error": float((~is_clean[decided_clean]).mean()) if decided_clean.any() else 0.0,
+        "violation_coverage": float(decided_violation.mean()),
+        "violation_error": float(is_clean[decided_violation].mean()) if decided_violation.any() else 0.0,
+        "llm_calls_saved": float((decided_clean | decided_violation).mean()),
+        "predict_p50_ms": float(np.percentile(timings, 50) * 1000),
+        "predict_p99_ms": float(np.percentile(timings, 99) * 1000),
+        "reliability": reliability,
+    }
+
+
+def print_report(report: Dict[str, Any], label_counts: Dict[str, int]):
+    print(f"labelled verdicts: {sum(label_counts.values())}")
+    for label, count in sorted(label_counts.items(), key=lambda item: -item[1]):
+        print(f"  {label:<20} {count}")
+
+    print(f"\ntest messages: {report['messages']}")
+    print(f"accuracy: {report['accuracy']:.3f}  log loss: {report['log_loss']:.3f}  "
+          f"brier (clean): {report['brier_clean']:.4f}  ECE (clean): {report['expected_calibration_error']:.4f}")
+    print(f"temperature: {report['temperature']:.2f}")
+
+    print(f"\n{'P(CLEAN)':<10} {'messages':>9} {'predicted':>10} {'observed':>9}")
+    for row in report["reliability"]:
+        print(f"{row['bin']:<10} {row['messages']:>9} {row['predicted_clean']:>10.3f} {row['observed_clean']:>9.3f}")
+
+    print(f"\nclean short-circuit:     P(CLEAN) >= {report['clean_threshold']:.3f}  "
+          f"coverage {report['clean_coverage']:.1%}  violations let through {report['clean_error']:.2%}")
+    print(f"violation short-circuit: 1 - P(CLEAN) >= {report['violation_threshold']:.3f}  "
+          f"coverage {report['violation_coverage']:.1%}  clean messages deleted {report['violation_error']:.2%}")
+    print(f"LLM calls saved: {report['llm_calls_saved']:.1%}")
+    print(f"predict: p50 {report['predict_p50_ms']:.3f} ms, p99 {report['predict_p99_ms']:.3f} ms")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.getenv("CLASSIFIER_PATH", "classifier.npz"))
+    parser.add_argument("--limit", type=int, default=200_000, help="newest verdicts to train on")
+    parser.add_argument("--holdout", type=float, default=0.15,
+                        help="fraction of the verdicts for calibration, and again for the report")
+    parser.add_argument("--max-error", type=float, default=0.01)
+    parser.add_argument("--min-support", type=int, default=20)
+    parser.add_argument("--min-examples", type=int, default=200)
+    parser.add_argument("--features-log2", type=int, default=18)
+    parser.add_argument("--ngrams", default="2,3,4")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--bins", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    texts, labels = asyncio.run(load_examples(args.limit))
+    label_counts = {label: labels.count(label) for label in set(labels)}
+    if len(texts) < args.min_examples or len(label_counts) < 2:
+        print(f"not enough labelled verdicts to train on: {len(texts)} messages, {len(label_counts)} classes",
+              file=sys.stderr)
+        sys.exit(1)
+
+    train, calibration, test = split(len(texts), args.holdout, args.seed)
+    model = train_model(
+        [texts[i] for i in train], [labels[i] for i in train],
+        n_features=1 << args.features_log2,
+        ngram_sizes=[int(size) for size in args.ngrams.split(",")],
+        epochs=args.epochs,
+        learning_rate=args.learning_rate,
+        seed=args.seed,
+    )
+
+    # Classes missing from the training part can't be predicted, their messages are left out.
+    calibration = [i for i in calibration if labels[i] in model.classes]
+    test = [i for i in test if labels[i] in model.classes]
+
+    calibration_texts = [texts[i] for i in calibration]
+    calibration_targets = np.array([model.classes.index(labels[i]) for i in calibration])
+    model.temperature = fit_temperature(model, calibration_texts, calibration_targets)
+
+    clean_probability = predict_all(model, calibration_texts)[:, model.clean_index]
+    is_clean = calibration_targets == model.clean_index
+    floor = 1.0 - args.max_error
+    model.clean_threshold = max(floor, pick_threshold(clean_probability, ~is_clean, args.max_error, args.min_support))
+    model.violation_threshold = max(
+        floor, pick_threshold(1.0 - clean_probability, is_clean, args.max_error, args.min_support)
+    )
+
+    report = calibration_report(model, [texts[i] for i in test], [labels[i] for i in test], args.bins)
+    print_report(report, label_counts)
+
+    model.save(args.out)
+    print(f"\nmodel written to {args.out}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"label_counts": label_counts, **report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
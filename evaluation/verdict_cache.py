@@ -0,0 +1,281 @@
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import xxhash
+from structlog import get_logger
+
+logger = get_logger()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_INVISIBLE_RE = re.compile(r"[\u200b-\u200f\u2060\ufeff]")
+
+SIMHASH_BITS = 64
+# Any two fingerprints within SIMHASH_BANDS - 1 bits of each other share at least one band.
+SIMHASH_BANDS = 8
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+SIMHASH_SHINGLE = 3
+
+# Sender history classes. A verdict is only reused for a sender whose recent history relates
+# to the message the same way as it did for the sender the verdict was computed for:
+# repeating a message is what turns it into SPAM, so these never share entries.
+HISTORY_NONE = "none"
+HISTORY_REPEAT = "repeat"
+HISTORY_OTHER = "other"
+
+Verdict = Tuple[Any, Any]
+Scope = Tuple[int, int, str]
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    text = _INVISIBLE_RE.sub("", text)
+    text = _WHITESPACE_RE.sub(" ", text)
+    return text.strip().casefold()
+
+
+def text_hash(text: str) -> int:
+    return xxhash.xxh3_64_intdigest(text)
+
+
+def simhash(text: str) -> int:
+    if len(text) <= SIMHASH_SHINGLE:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + SIMHASH_SHINGLE] for i in range(len(text) - SIMHASH_SHINGLE + 1)]
+
+    # Column-wise bit counts over the binary strings of all shingle hashes.
+    rows = [format(xxhash.xxh3_64_intdigest(shingle), "064b") for shingle in set(shingles)]
+    threshold = len(rows) / 2
+
+    fingerprint = 0
+    for bit, column in enumerate(zip(*rows)):
+        if column.count("1") > threshold:
+            fingerprint |= 1 << (SIMHASH_BITS - 1 - bit)
+
+    return fingerprint
+
+
+def history_class(normalized_text: str, user_message_history: List[Dict[str, Any]]) -> str:
+    if not user_message_history:
+        return HISTORY_NONE
+
+    for msg in user_message_history:
+        if normalize_text(msg.get("text") or "") == normalized_text:
+            return HISTORY_REPEAT
+
+    return HISTORY_OTHER
+
+
+class _Entry:
+    __slots__ = ("key", "scope", "fingerprint", "verdict", "expires_at", "size")
+
+    def __init__(self, key, scope, fingerprint, verdict, expires_at, size):
+        self.key = key
+        self.scope = scope
+        self.fingerprint = fingerprint
+        self.verdict = verdict
+        self.expires_at = expires_at
+        self.size = size
+
+
+class VerdictCache:
+    """
+    Caches (FlagResponse, JudgmentResponse) verdicts for repeated messages.
+
+    Exact matches are keyed by the hash of the normalized text, the group, the hash of the
+    group's title, rules and moderation mode, all of which are in the prompt, and the sender
+    history class. Messages long enough to fingerprint are also matched against near-duplicates
+    through a banded SimHash index.
+    """
+
+    def __init__(self, max_entries: int = 50_000, max_bytes: int = 32 * 1024 * 1024, ttl: float = 600,
+                 max_distance: int = 6, min_fingerprint_length: int = 24):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_distance = min(max_distance, SIMHASH_BANDS - 1)
+        self.min_fingerprint_length = min_fingerprint_length
+
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._bands: Dict[Tuple, Set[Tuple]] = {}
+        self._groups: Dict[int, Set[Tuple]] = {}
+        self._bytes = 0
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup_key(self, group_id: int, text: str, group_title: str, rules_context: str, moderation_mode: str,
+                    user_message_history: List[Dict[str, Any]]) -> Tuple[Tuple, Scope, str]:
+        normalized = normalize_text(text)
+        group_hash = text_hash("\0".join((group_title or "", rules_context or "", moderation_mode or "")))
+        scope = (group_id, group_hash, history_class(normalized, user_message_history))
+        return (scope, text_hash(normalized)), scope, normalized
+
+    def get(self, group_id: int, text: str, group_title: str, rules_context: str, moderation_mode: str,
+            user_message_history: List[Dict[str, Any]]) -> Optional[Verdict]:
+        if not text:
+            return None
+
+        key, scope, normalized = self._lookup_key(
+            group_id, text, group_title, rules_context, moderation_mode, user_message_history,
+        )
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.verdict
+
+            self._remove(entry)
+            self.expirations += 1
+
+        if len(normalized) >= self.min_fingerprint_length:
+            entry = self._nearest(scope, simhash(normalized), now)
+            if entry is not None:
+                self._entries.move_to_end(entry.key)
+                self.near_hits += 1
+                return entry.verdict
+
+        self.misses += 1
+        return None
+
+    def put(self, group_id: int, text: str, group_title: str, rules_context: str, moderation_mode: str,
+            user_message_history: List[Dict[str, Any]], verdict: Verdict):
+        if not text:
+            return
+
+        key, scope, normalized = self._lookup_key(
+            group_id, text, group_title, rules_context, moderation_mode, user_message_history,
+        )
+
+        old = self._entries.get(key)
+        if old is not None:
+            self._remove(old)
+
+        fingerprint = simhash(normalized) if len(normalized) >= self.min_fingerprint_length else None
+        entry = _Entry(
+            key=key,
+            scope=scope,
+            fingerprint=fingerprint,
+            verdict=verdict,
+            expires_at=time.monotonic() + self.ttl,
+            size=self._estimate_size(verdict),
+        )
+
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._groups.setdefault(group_id, set()).add(key)
+        if fingerprint is not None:
+            for band in self._band_keys(scope, fingerprint):
+                self._bands.setdefault(band, set()).add(key)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, oldest = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_group(self, group_id: int):
+        keys = self._groups.pop(group_id, set())
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(entry)
+
+        logger.info("verdict cache invalidated", group_id=group_id, entries=len(keys))
+
+    def clear(self):
+        self._entries.clear()
+        self._bands.clear()
+        self._groups.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+    def _nearest(self, scope: Scope, fingerprint: int, now: float) -> Optional[_Entry]:
+        candidates: Set[Tuple] = set()
+        for band in self._band_keys(scope, fingerprint):
+            candidates.update(self._bands.get(band, ()))
+
+        best: Optional[_Entry] = None
+        best_distance = self.max_distance + 1
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+
+            if entry.expires_at <= now:
+                self._remove(entry)
+                self.expirations += 1
+                continue
+
+            distance = (entry.fingerprint ^ fingerprint).bit_count()
+            if distance < best_distance:
+                best, best_distance = entry, distance
+
+        return best
+
+    @staticmethod
+    def _band_keys(scope: Scope, fingerprint: int):
+        mask = (1 << SIMHASH_BAND_BITS) - 1
+        for band in range(SIMHASH_BANDS):
+            yield scope, band, (fingerprint >> (band * SIMHASH_BAND_BITS)) & mask
+
+    @staticmethod
+    def _estimate_size(verdict: Verdict) -> int:
+        size = 256  # entry, key tuples and index bookkeeping
+        for part in verdict:
+            if part is None:
+                continue
+            size += sys.getsizeof(part)
+            for value in part.__dict__.values():
+                size += sys.getsizeof(value)
+        return size
+
+    def _remove(self, entry: _Entry):
+        if self._entries.pop(entry.key, None) is None:
+            return
+
+        self._bytes -= entry.size
+
+        group_keys = self._groups.get(entry.scope[0])
+        if group_keys is not None:
+            group_keys.discard(entry.key)
+            if not group_keys:
+                del self._groups[entry.scope[0]]
+
+        if entry.fingerprint is not None:
+            for band in self._band_keys(entry.scope, entry.fingerprint):
+                band_keys = self._bands.get(band)
+                if band_keys is not None:
+                    band_keys.discard(entry.key)
+                    if not band_keys:
+                        del self._bands[band]
+
+
+verdict_cache = VerdictCache(
+    max_entries=int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "50000")),
+    max_bytes=int(os.getenv("VERDICT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("VERDICT_CACHE_TTL", "600")),
+    max_distance=int(os.getenv("VERDICT_CACHE_MAX_DISTANCE", "6")),
+)
@@ -1,20 +1,81 @@
 import asyncio
+import os
 
 from dotenv import load_dotenv
+
+# Module-level settings are read from the environment at import time.
+load_dotenv()
+
 from structlog import get_logger
 
-from database.database import init_db
+from clients.openai import close_chat_clients
+from database.database import init_db, close_db
+from database.group_cache import group_cache
+from database.history import history_buffer
+from database.retention import retention_job
+from database.user_cache import known_users
+from database.writer import credit_writer, message_writer, user_writer, verdict_writer
+from evaluation.cascade import cascade
+from evaluation.classifier import local_classifier
+from evaluation.flag import init_llm_clients
+from evaluation.flood import flood_detector
+from evaluation.prompt_cache import prompt_builder
+from evaluation.reputation import reputation
+from evaluation.resilience import llm_guard
+from evaluation.scheduler import evaluation_scheduler
+from evaluation.screen import screen_cache
+from evaluation.verdict_cache import verdict_cache
+from metrics.metrics import registry
+from metrics.server import metrics_server
+from telegram.admins import admin_roster
+from telegram.deletions import deletion_scheduler
 from telegram.telegram import init_telegram
+from warden.shards import current_shard
 from warden.warden import Warden
 
 logger = get_logger()
 
-if __name__ == '__main__':
-    load_dotenv()
+# Components that keep their own counters are exported as gauges.
+registry.register_stats("user_writer", user_writer.stats)
+registry.register_stats("message_writer", message_writer.stats)
+registry.register_stats("credit_writer", credit_writer.stats)
+registry.register_stats("verdict_writer", verdict_writer.stats)
+registry.register_stats("known_users", known_users.stats)
+registry.register_stats("group_cache", group_cache.stats)
+registry.register_stats("history", history_buffer.stats)
+registry.register_stats("verdict_cache", verdict_cache.stats)
+registry.register_stats("scheduler", evaluation_scheduler.stats)
+registry.register_stats("cascade", cascade.stats)
+registry.register_stats("prompts", prompt_builder.stats)
+registry.register_stats("llm", llm_guard.stats)
+registry.register_stats("screen", screen_cache.stats)
+registry.register_stats("flood", flood_detector.stats)
+registry.register_stats("admins", admin_roster.stats)
+registry.register_stats("reputation", reputation.stats)
+registry.register_stats("local_classifier", local_classifier.stats)
+registry.register_stats("retention", retention_job.stats)
+registry.register_stats("deletions", deletion_scheduler.stats)
 
+if __name__ == '__main__':
     warden = Warden(
         init_telegram=init_telegram,
-        init_db=init_db
+        init_db=init_db,
+        close_db=close_db,
+        init_clients=init_llm_clients,
+        close_clients=close_chat_clients,
+        services=[
+            metrics_server,
+            user_writer,
+            message_writer,
+            credit_writer,
+            verdict_writer,
+            local_classifier,
+            # Sharded workers share the database, one retention job is enough.
+            *([retention_job] if current_shard.index == 0 else []),
+            deletion_scheduler,
+        ],
+        telegram_mode=os.getenv("TELEGRAM_MODE", "polling"),
+        workers=int(os.getenv("WARDEN_WORKERS", "1")),
     )
     asyncio.run(
         warden.start()
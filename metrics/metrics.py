@@ -0,0 +1,152 @@
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from clients.openai import estimate_cost
+from evaluation.tokens import count_tokens
+from metrics.registry import Registry
+
+registry = Registry()
+
+# Per-group labels are useful for finding expensive groups but grow with the number of groups.
+GROUP_LABELS = os.getenv("METRICS_GROUP_LABELS", "true").lower() in ("1", "true", "yes")
+
+stage_seconds = registry.histogram(
+    "stage_seconds", "Duration of message pipeline stages.", ["stage"],
+)
+stage_errors = registry.counter(
+    "stage_errors_total", "Pipeline stages that raised.", ["stage"],
+)
+telegram_api_seconds = registry.histogram(
+    "telegram_api_seconds", "Duration of Telegram Bot API calls.", ["method"],
+)
+telegram_api_errors = registry.counter(
+    "telegram_api_errors_total", "Telegram Bot API calls that failed.", ["method"],
+)
+db_write_seconds = registry.histogram(
+    "db_write_seconds", "Duration of batched database writes.", ["model"],
+)
+db_write_errors = registry.counter(
+    "db_write_errors_total", "Batched database writes that failed.", ["model"],
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "LLM tokens used, by kind (prompt or completion).", ["model", "group", "kind"],
+)
+llm_cost = registry.counter(
+    "llm_cost_usd_total", "Estimated LLM cost in USD.", ["model", "group"],
+)
+prompt_tokens = registry.counter(
+    "prompt_tokens_total", "Tokens of the prompts built, by kind and whether they are in the cacheable prefix.",
+    ["kind", "cached"],
+)
+prompts_built = registry.counter(
+    "prompts_built_total", "Prompts built, by kind.", ["kind"],
+)
+cascade_decisions = registry.counter(
+    "cascade_decisions_total", "Weak model answers accepted or escalated to the strong model.",
+    ["stage", "outcome", "reason"],
+)
+cascade_saved_seconds = registry.counter(
+    "cascade_saved_seconds_total", "Estimated strong model latency saved by accepted weak answers.", ["stage"],
+)
+cascade_saved_usd = registry.counter(
+    "cascade_saved_usd_total", "Estimated strong model cost saved by accepted weak answers.", ["stage"],
+)
+cascade_wasted_seconds = registry.counter(
+    "cascade_wasted_seconds_total", "Latency of weak model calls that were escalated anyway.", ["stage"],
+)
+cascade_wasted_usd = registry.counter(
+    "cascade_wasted_usd_total", "Estimated cost of weak model calls that were escalated anyway.", ["stage"],
+)
+llm_attempts = registry.counter(
+    "llm_attempts_total", "LLM requests sent, by kind (primary, hedge or retry).", ["stage", "kind"],
+)
+llm_hedge_wins = registry.counter(
+    "llm_hedge_wins_total", "LLM calls answered by the hedged request first.", ["stage"],
+)
+llm_unavailable = registry.counter(
+    "llm_unavailable_total", "LLM calls given up on and decided locally, by reason.", ["stage", "reason"],
+)
+llm_early_exits = registry.counter(
+    "llm_early_exits_total", "Streamed LLM answers decided before they were complete.", ["stage"],
+)
+moderation_skipped = registry.counter(
+    "moderation_skipped_total", "Group messages not moderated because of their sender, by reason.", ["reason"],
+)
+evaluations_in_flight = registry.gauge(
+    "evaluations_in_flight", "Evaluations currently running.",
+)
+event_loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late a periodic timer fires on the event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    Times a pipeline stage and counts it as an error if it raises.
+    """
+    try:
+        with stage_seconds.time(stage=stage):
+            yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+
+
+def group_label(group_id: Optional[int]) -> str:
+    if group_id is None or not GROUP_LABELS:
+        return "all"
+    return str(group_id)
+
+
+class LLMUsageRecorder(AsyncCallbackHandler):
+    """
+    Counts the tokens and estimated cost of every LLM call in a run, attributed to one group.
+    Pass a new instance in the run's config callbacks.
+
+    Generations cancelled before the end, such as streams closed after an early decision or
+    hedges that lost, report no usage; their tokens are estimated from the prompt and the text
+    generated so far.
+    """
+
+    run_inline = True
+
+    def __init__(self, group_id: Optional[int] = None):
+        self.group = group_label(group_id)
+        self._runs: Dict[UUID, Tuple[str, List[BaseMessage]]] = {}
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *,
+                                  run_id: UUID, **kwargs: Any):
+        params = kwargs.get("invocation_params") or {}
+        self._runs[run_id] = (params.get("model_name") or params.get("model") or "unknown", messages[0])
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        model, _ = self._runs.pop(run_id, ("unknown", []))
+        llm_output: Dict[str, Any] = response.llm_output or {}
+        usage = llm_output.get("token_usage") or {}
+        self._record(llm_output.get("model_name", model), usage.get("prompt_tokens", 0),
+                     usage.get("completion_tokens", 0))
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+
+        model, messages = run
+        response: Optional[LLMResult] = kwargs.get("response")
+        generated = response.generations[0][0].text if response and response.generations and response.generations[0] \
+            else ""
+        self._record(model, count_tokens("".join(str(message.content) for message in messages)),
+                     count_tokens(generated))
+
+    def _record(self, model: str, prompt_tokens: int, completion_tokens: int):
+        llm_tokens.inc(prompt_tokens, model=model, group=self.group, kind="prompt")
+        llm_tokens.inc(completion_tokens, model=model, group=self.group, kind="completion")
+        llm_cost.inc(estimate_cost(model, prompt_tokens, completion_tokens), model=model, group=self.group)
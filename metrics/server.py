@@ -0,0 +1,71 @@
+import asyncio
+import os
+from typing import Optional
+
+from aiohttp import web
+from structlog import get_logger
+
+from metrics.metrics import event_loop_lag, registry
+
+logger = get_logger()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """
+    Serves the metrics registry on /metrics in the Prometheus text format and probes the event
+    loop lag in the background. Disabled when port is 0.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9464, lag_interval: float = 0.5):
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.port:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        self._lag_task = asyncio.create_task(self._probe_lag(), name="event-loop-lag")
+        logger.info("metrics server started", host=self.host, port=self.port)
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def _probe_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            event_loop_lag.observe(max(0.0, loop.time() - expected))
+
+
+metrics_server = MetricsServer(
+    host=os.getenv("METRICS_HOST", "0.0.0.0"),
+    port=int(os.getenv("METRICS_PORT", "9464") or 0),
+    lag_interval=float(os.getenv("METRICS_LAG_INTERVAL", "0.5")),
+)
@@ -1,3 +1,4 @@
+from .admins import *
 from .group_context import *
 from .group_message import *
 from .dispatcher import *
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import ChatMemberUpdated, Message
+from structlog import get_logger
+
+from metrics.metrics import moderation_skipped
+from telegram.dispatcher import dispatcher
+
+logger = get_logger()
+
+ADMIN_STATUSES = ("creator", "administrator")
+
+SKIP_ADMIN = "admin"
+SKIP_ANONYMOUS_ADMIN = "anonymous_admin"
+SKIP_TRUSTED = "trusted"
+
+
+def parse_trusted_users(text: str) -> Tuple[FrozenSet[int], List[str]]:
+    """
+    Parses a group's trusted user ids, separated by spaces, commas or new lines.
+    """
+    user_ids, errors = set(), []
+    for item in (text or "").replace(",", " ").split():
+        try:
+            user_ids.add(int(item))
+        except ValueError:
+            errors.append(f"{item}: not a numeric user id")
+
+    return frozenset(user_ids), errors
+
+
+class AdminRoster:
+    """
+    Per-group sets of admin user ids, so admin messages can be recognised in O(1).
+
+    A group's admins are fetched with get_chat_administrators on its first message and
+    refetched in the background once they are older than ttl, while the old set keeps being
+    served. chat_member updates keep the sets current in between. Groups whose admins can't be
+    fetched keep their last known admins, or none, for failure_ttl seconds.
+    """
+
+    def __init__(self, ttl: float = 600, failure_ttl: float = 60):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+
+        self._admins: Dict[int, Tuple[FrozenSet[int], float]] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        self._trusted: Dict[int, Tuple[str, FrozenSet[int]]] = {}
+
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.member_updates = 0
+        self.skipped: Dict[str, int] = {SKIP_ADMIN: 0, SKIP_ANONYMOUS_ADMIN: 0, SKIP_TRUSTED: 0}
+
+    async def skip_reason(self, message: Message, trusted_users: str = "") -> Optional[str]:
+        """
+        Why the message needs no moderation: it's from an admin or a trusted user. None otherwise.
+        """
+        group_id = message.chat.id
+
+        # Anonymous admins post as the group itself.
+        if message.sender_chat is not None and message.sender_chat.id == group_id:
+            return self._skip(SKIP_ANONYMOUS_ADMIN)
+
+        user_id = message.from_user.id
+        if user_id in await self.admins(message.bot, group_id):
+            return self._skip(SKIP_ADMIN)
+
+        if trusted_users and user_id in self.trusted(group_id, trusted_users):
+            return self._skip(SKIP_TRUSTED)
+
+        return None
+
+    async def admins(self, bot: Bot, group_id: int) -> FrozenSet[int]:
+        cached = self._admins.get(group_id)
+        if cached is not None:
+            admins, expires_at = cached
+            if expires_at <= time.monotonic() and group_id not in self._loading:
+                self._loading[group_id] = asyncio.create_task(self._fetch(bot, group_id))
+            return admins
+
+        loading = self._loading.get(group_id)
+        if loading is None:
+            loading = self._loading[group_id] = asyncio.create_task(self._fetch(bot, group_id))
+        return await asyncio.shield(loading)
+
+    def trusted(self, group_id: int, trusted_users: str) -> FrozenSet[int]:
+        cached = self._trusted.get(group_id)
+        if cached is not None and cached[0] == trusted_users:
+            return cached[1]
+
+        user_ids, _ = parse_trusted_users(trusted_users)
+        self._trusted[group_id] = (trusted_users, user_ids)
+        return user_ids
+
+    def store(self, group_id: int, user_ids: Iterable[int], ttl: Optional[float] = None):
+        self._admins[group_id] = (frozenset(user_ids), time.monotonic() + (self.ttl if ttl is None else ttl))
+
+    def update_member(self, group_id: int, user_id: int, status: str):
+        cached = self._admins.get(group_id)
+        if cached is None:
+            return
+
+        self.member_updates += 1
+        admins, expires_at = cached
+        admins = admins | {user_id} if status in ADMIN_STATUSES else admins - {user_id}
+        self._admins[group_id] = (admins, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "groups": len(self._admins),
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "member_updates": self.member_updates,
+            **{f"skipped_{reason}": count for reason, count in self.skipped.items()},
+        }
+
+    def _skip(self, reason: str) -> str:
+        self.skipped[reason] += 1
+        moderation_skipped.inc(reason=reason)
+        return reason
+
+    async def _fetch(self, bot: Bot, group_id: int) -> FrozenSet[int]:
+        self.fetches += 1
+        try:
+            members = await bot.get_chat_administrators(chat_id=group_id)
+        except TelegramAPIError as e:
+            self.fetch_failures += 1
+            logger.warning("admin roster fetch failed", group_id=group_id, error=str(e))
+            # Keep the last known admins rather than treating them as members.
+            previous = self._admins.get(group_id)
+            self.store(group_id, previous[0] if previous else (), ttl=self.failure_ttl)
+        else:
+            self.store(group_id, (member.user.id for member in members))
+        finally:
+            self._loading.pop(group_id, None)
+
+        return self._admins[group_id][0]
+
+
+admin_roster = AdminRoster(
+    ttl=float(os.getenv("ADMIN_ROSTER_TTL", "600")),
+    failure_ttl=float(os.getenv("ADMIN_ROSTER_FAILURE_TTL", "60")),
+)
+
+
+@dispatcher.chat_member()
+async def on_chat_member_updated(update: ChatMemberUpdated) -> None:
+    admin_roster.update_member(update.chat.id, update.new_chat_member.user.id, update.new_chat_member.status)
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from structlog import get_logger
+
+from database.models import PendingDeletion
+from database.writer import BatchWriter
+from warden.shards import ShardInfo, current_shard
+
+logger = get_logger()
+
+# Telegram accepts at most 100 message ids per deleteMessages call.
+MAX_IDS_PER_CALL = 100
+
+Entry = Tuple[float, int, int]
+
+
+class DeletionScheduler:
+    """
+    Deletes messages after a delay from a single background task.
+
+    Pending deletions are kept in a heap of (due time, chat id, message id) and mirrored in the
+    PendingDeletion table, so they survive a restart. Everything due within coalesce_window is
+    deleted together with one delete_messages call per chat.
+
+    Rows are stored with the shard that scheduled them and only that shard restores them on start,
+    so sharded workers don't delete the same messages. Notices sent to private chats are scheduled
+    by the group's worker, whichever shard the private chat id maps to. Rows without a shard, or
+    from a shard that no longer exists, go to the shard owning the chat.
+    """
+
+    def __init__(self, coalesce_window: float = 1.0, shard: Optional[ShardInfo] = None):
+        self.coalesce_window = coalesce_window
+        self.shard = shard or ShardInfo()
+        self.writer = BatchWriter(PendingDeletion, max_batch=200, flush_interval=1.0, max_pending=10_000)
+
+        self._heap: List[Entry] = []
+        self._wakeup = asyncio.Event()
+        self._bot: Optional[Bot] = None
+        self._bound = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.scheduled = 0
+        self.deleted = 0
+        self.calls = 0
+        self.failed = 0
+
+    def bind(self, bot: Bot):
+        self._bot = bot
+        self._bound.set()
+
+    async def schedule(self, chat_id: int, message_id: int, delay: float):
+        due = time.time() + delay
+        heapq.heappush(self._heap, (due, chat_id, message_id))
+        self.scheduled += 1
+
+        await self.writer.put(PendingDeletion(
+            chat_id=chat_id,
+            message_id=message_id,
+            due_at=datetime.fromtimestamp(due, timezone.utc),
+            shard=self.shard.index,
+        ))
+
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    async def start(self):
+        rows = await PendingDeletion.all().values_list("due_at", "chat_id", "message_id", "shard")
+        rows = [row for row in rows if self._restores(row[1], row[3])]
+        for due_at, chat_id, message_id, _ in rows:
+            heapq.heappush(self._heap, (due_at.timestamp(), chat_id, message_id))
+        if rows:
+            logger.info("pending deletions restored", count=len(rows))
+
+        await self.writer.start()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="deletion-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Whatever is left stays in the table for the next start.
+        await self.writer.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._heap),
+            "scheduled": self.scheduled,
+            "deleted": self.deleted,
+            "calls": self.calls,
+            "failed": self.failed,
+        }
+
+    def _restores(self, chat_id: int, shard: Optional[int]) -> bool:
+        if shard is None or shard >= self.shard.count:
+            return self.shard.owns(chat_id)
+        return shard == self.shard.index
+
+    async def _run(self):
+        await self._bound.wait()
+
+        while True:
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due: Dict[int, List[int]] = {}
+            horizon = time.time() + self.coalesce_window
+            while self._heap and self._heap[0][0] <= horizon:
+                _, chat_id, message_id = heapq.heappop(self._heap)
+                due.setdefault(chat_id, []).append(message_id)
+
+            await self._delete(due)
+
+    async def _delete(self, due: Dict[int, List[int]]):
+        # Rows may still be queued in the writer.
+        await self.writer.flush()
+
+        for chat_id, message_ids in due.items():
+            for i in range(0, len(message_ids), MAX_IDS_PER_CALL):
+                chunk = message_ids[i:i + MAX_IDS_PER_CALL]
+                self.calls += 1
+                try:
+                    await self._bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                    self.deleted += len(chunk)
+                except Exception as e:
+                    self.failed += len(chunk)
+                    logger.warning("scheduled deletion failed", chat_id=chat_id, count=len(chunk), error=str(e))
+
+            try:
+                await PendingDeletion.filter(chat_id=chat_id, message_id__in=message_ids).delete()
+            except Exception as e:
+                logger.error("pending deletion cleanup failed", chat_id=chat_id, error=str(e))
+
+
+deletion_scheduler = DeletionScheduler(
+    coalesce_window=float(os.getenv("DELETION_COALESCE_WINDOW", "1.0")),
+    shard=current_shard,
+)
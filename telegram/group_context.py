@@ -1,11 +1,37 @@
 from aiogram import F
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import CallbackQuery, Message
 
 from database.models import GroupInfo
+from database.writer import user_writer
+from evaluation.classifier import local_classifier
+from evaluation.flood import GROUP_LIMIT_FIELDS, flood_detector, parse_limits
+from evaluation.screen import parse_rules
+from telegram.admins import admin_roster, parse_trusted_users
 from telegram.dispatcher import dispatcher
-from .keyboard import get_group_management_keyboard, get_edit_context_keyboard, get_main_menu_keyboard
+from warden.shards import invalidate_group
+from .keyboard import get_group_management_keyboard, get_edit_context_keyboard, get_main_menu_keyboard, \
+    get_edit_rules_keyboard, MODERATION_MODE_LABELS
+
+RULES_HELP = (
+    "Messages matching a rule are deleted right away, without asking the AI.\n"
+    "Send one rule per line:\n"
+    "- a word or phrase, matched anywhere in the message\n"
+    "- re:<pattern> for a regular expression\n"
+    "- :links, :mentions or :phones for built-in patterns\n"
+    "Lines starting with # are ignored."
+)
+
+FLOOD_HELP = (
+    "messages: most messages a user may send within {window:g} seconds\n"
+    "repeats: most identical messages a user may send within {repeat_window:g} seconds\n"
+    "raid: users sending the same text within {raid_window:g} seconds that count as a raid\n"
+    "restrict: seconds to mute flooders for (30 to 31622400), 0 only deletes their messages\n\n"
+    "Send the settings to change, e.g. \"messages=8 repeats=2 raid=5 restrict=300\". "
+    "0 turns a check off, \"default\" goes back to the default."
+)
 
 
 ###### Manage Group Context (New Implementation) #######
@@ -13,6 +39,9 @@ from .keyboard import get_group_management_keyboard, get_edit_context_keyboard,
 class ManageGroupContext(StatesGroup):
     viewing_group = State()
     editing_context = State()
+    editing_rules = State()
+    editing_flood_limits = State()
+    editing_trusted_users = State()
 
 
 @dispatcher.callback_query(F.data.startswith("manage_group_"))
@@ -29,7 +58,7 @@ async def on_group_selected_handler(cq: CallbackQuery, state: FSMContext):
         f"Group: {group.name}\n"
         f"Description: {group.description or 'N/A'}\n"
         f"Current Context: \n{group.rules_context or 'Not set'}",
-        reply_markup=get_group_management_keyboard(group_id)
+        reply_markup=get_group_management_keyboard(group_id, group.moderation_mode, group.local_classifier)
     )
     await state.set_state(ManageGroupContext.viewing_group)
 
@@ -84,6 +113,7 @@ async def process_new_context_handler(message: Message, state: FSMContext):
 
     group.rules_context = message.text
     await group.save()
+    await invalidate_group(group_id)
 
     await message.answer("Group context updated successfully.")
     
@@ -91,12 +121,18 @@ async def process_new_context_handler(message: Message, state: FSMContext):
         f"Group: {group.name}\n"
         f"Description: {group.description or 'N/A'}\n"
         f"Current Context: \n{group.rules_context or 'Not set'}",
-        reply_markup=get_group_management_keyboard(group_id)
+        reply_markup=get_group_management_keyboard(group_id, group.moderation_mode, group.local_classifier)
     )
     await state.set_state(ManageGroupContext.viewing_group)
 
 
-@dispatcher.callback_query(F.data == "cancel_edit_context", ManageGroupContext.editing_context)
+@dispatcher.callback_query(
+    F.data == "cancel_edit_context",
+    StateFilter(
+        ManageGroupContext.editing_context, ManageGroupContext.editing_rules, ManageGroupContext.editing_flood_limits,
+        ManageGroupContext.editing_trusted_users,
+    ),
+)
 async def on_cancel_edit_context_handler(cq: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     group_id = data.get("current_group_id")
@@ -120,11 +156,247 @@ async def on_cancel_edit_context_handler(cq: CallbackQuery, state: FSMContext):
         f"Group: {group.name}\n"
         f"Description: {group.description or 'N/A'}\n"
         f"Current Context: \n{group.rules_context or 'Not set'}",
-        reply_markup=get_group_management_keyboard(group_id)
+        reply_markup=get_group_management_keyboard(group_id, group.moderation_mode, group.local_classifier)
     )
     await state.set_state(ManageGroupContext.viewing_group)
 
 
+@dispatcher.callback_query(F.data.startswith("edit_group_rules_"), ManageGroupContext.viewing_group)
+async def on_edit_rules_pressed_handler(cq: CallbackQuery, state: FSMContext):
+    group_id = int(cq.data.split("_")[-1])
+    group = await GroupInfo.get_or_none(id=group_id, owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        return
+
+    await state.update_data(current_group_id=group_id)
+    await cq.message.edit_text(
+        f"Current rules for {group.name}:\n\n"
+        f"{group.screen_rules or 'Not set'}\n\n"
+        f"{RULES_HELP}",
+        reply_markup=get_edit_rules_keyboard()
+    )
+    await state.set_state(ManageGroupContext.editing_rules)
+
+
+async def save_group_rules(group: GroupInfo, rules: str):
+    group.screen_rules = rules
+    await group.save()
+    await invalidate_group(group.id)
+
+
+@dispatcher.message(ManageGroupContext.editing_rules)
+async def process_new_rules_handler(message: Message, state: FSMContext):
+    data = await state.get_data()
+    group = await GroupInfo.get_or_none(id=data.get("current_group_id"), owner_id=message.from_user.id)
+
+    if not group:
+        await message.answer("Error: Group not found. Please start over.")
+        await state.clear()
+        return
+
+    keywords, patterns, errors = parse_rules(message.text or "")
+    if errors:
+        await message.answer(
+            "Some rules are invalid, please fix them and send the rules again:\n\n" + "\n".join(errors),
+            reply_markup=get_edit_rules_keyboard()
+        )
+        return
+
+    await save_group_rules(group, message.text)
+
+    await message.answer(f"Group rules updated: {len(keywords)} keywords, {len(patterns)} patterns.")
+    await message.answer(
+        f"Group: {group.name}\n"
+        f"Description: {group.description or 'N/A'}\n"
+        f"Current Context: \n{group.rules_context or 'Not set'}",
+        reply_markup=get_group_management_keyboard(group.id, group.moderation_mode, group.local_classifier)
+    )
+    await state.set_state(ManageGroupContext.viewing_group)
+
+
+@dispatcher.callback_query(F.data == "clear_group_rules", ManageGroupContext.editing_rules)
+async def on_clear_rules_handler(cq: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    group = await GroupInfo.get_or_none(id=data.get("current_group_id"), owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        await state.clear()
+        return
+
+    await save_group_rules(group, "")
+
+    await cq.answer("Group rules cleared.")
+    await cq.message.edit_text(
+        f"Group: {group.name}\n"
+        f"Description: {group.description or 'N/A'}\n"
+        f"Current Context: \n{group.rules_context or 'Not set'}",
+        reply_markup=get_group_management_keyboard(group.id, group.moderation_mode, group.local_classifier)
+    )
+    await state.set_state(ManageGroupContext.viewing_group)
+
+
+def describe_flood_limits(group: GroupInfo) -> str:
+    limits = flood_detector.limits.for_group(group)
+    lines = []
+    for name, (column, attribute) in GROUP_LIMIT_FIELDS.items():
+        source = "default" if getattr(group, column) is None else "group"
+        lines.append(f"{name}={getattr(limits, attribute)} ({source})")
+
+    return "\n".join(lines) + "\n\n" + FLOOD_HELP.format(**limits.__dict__)
+
+
+@dispatcher.callback_query(F.data.startswith("edit_flood_limits_"), ManageGroupContext.viewing_group)
+async def on_edit_flood_limits_pressed_handler(cq: CallbackQuery, state: FSMContext):
+    group_id = int(cq.data.split("_")[-1])
+    group = await GroupInfo.get_or_none(id=group_id, owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        return
+
+    await state.update_data(current_group_id=group_id)
+    await cq.message.edit_text(
+        f"Flood limits for {group.name}:\n\n{describe_flood_limits(group)}",
+        reply_markup=get_edit_context_keyboard()
+    )
+    await state.set_state(ManageGroupContext.editing_flood_limits)
+
+
+@dispatcher.message(ManageGroupContext.editing_flood_limits)
+async def process_new_flood_limits_handler(message: Message, state: FSMContext):
+    data = await state.get_data()
+    group = await GroupInfo.get_or_none(id=data.get("current_group_id"), owner_id=message.from_user.id)
+
+    if not group:
+        await message.answer("Error: Group not found. Please start over.")
+        await state.clear()
+        return
+
+    values, errors = parse_limits(message.text or "")
+    if not values and not errors:
+        errors = ["No settings found."]
+    if errors:
+        await message.answer(
+            "Could not read the settings, please send them again:\n\n" + "\n".join(errors),
+            reply_markup=get_edit_context_keyboard()
+        )
+        return
+
+    for column, value in values.items():
+        setattr(group, column, value)
+    await group.save()
+    await invalidate_group(group.id)
+
+    await message.answer(f"Flood limits updated:\n\n{describe_flood_limits(group)}")
+    await message.answer(
+        f"Group: {group.name}\n"
+        f"Description: {group.description or 'N/A'}\n"
+        f"Current Context: \n{group.rules_context or 'Not set'}",
+        reply_markup=get_group_management_keyboard(group.id, group.moderation_mode, group.local_classifier)
+    )
+    await state.set_state(ManageGroupContext.viewing_group)
+
+
+@dispatcher.callback_query(F.data.startswith("edit_trusted_users_"), ManageGroupContext.viewing_group)
+async def on_edit_trusted_users_pressed_handler(cq: CallbackQuery, state: FSMContext):
+    group_id = int(cq.data.split("_")[-1])
+    group = await GroupInfo.get_or_none(id=group_id, owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        return
+
+    await state.update_data(current_group_id=group_id)
+    await cq.message.edit_text(
+        f"Trusted users of {group.name}:\n\n"
+        f"{group.trusted_users or 'None'}\n\n"
+        f"Messages of admins and trusted users are never moderated. "
+        f"Send the numeric user ids to trust, separated by spaces, or - to trust nobody.",
+        reply_markup=get_edit_context_keyboard()
+    )
+    await state.set_state(ManageGroupContext.editing_trusted_users)
+
+
+@dispatcher.message(ManageGroupContext.editing_trusted_users)
+async def process_new_trusted_users_handler(message: Message, state: FSMContext):
+    data = await state.get_data()
+    group = await GroupInfo.get_or_none(id=data.get("current_group_id"), owner_id=message.from_user.id)
+
+    if not group:
+        await message.answer("Error: Group not found. Please start over.")
+        await state.clear()
+        return
+
+    text = "" if (message.text or "").strip() == "-" else message.text or ""
+    user_ids, errors = parse_trusted_users(text)
+    if errors:
+        await message.answer(
+            "Some user ids are invalid, please send them again:\n\n" + "\n".join(errors),
+            reply_markup=get_edit_context_keyboard()
+        )
+        return
+
+    group.trusted_users = " ".join(str(user_id) for user_id in sorted(user_ids))
+    await group.save()
+    await invalidate_group(group.id)
+
+    await message.answer(f"Trusted users updated: {len(user_ids)} users.")
+    await message.answer(
+        f"Group: {group.name}\n"
+        f"Description: {group.description or 'N/A'}\n"
+        f"Current Context: \n{group.rules_context or 'Not set'}",
+        reply_markup=get_group_management_keyboard(group.id, group.moderation_mode, group.local_classifier)
+    )
+    await state.set_state(ManageGroupContext.viewing_group)
+
+
+@dispatcher.callback_query(F.data.startswith("toggle_group_mode_"), ManageGroupContext.viewing_group)
+async def on_toggle_mode_handler(cq: CallbackQuery, state: FSMContext):
+    group_id = int(cq.data.split("_")[-1])
+    group = await GroupInfo.get_or_none(id=group_id, owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        return
+
+    modes = list(MODERATION_MODE_LABELS)
+    group.moderation_mode = modes[(modes.index(group.moderation_mode) + 1) % len(modes)] \
+        if group.moderation_mode in modes else ""
+    await group.save()
+    await invalidate_group(group_id)
+
+    await cq.answer(f"Moderation mode: {MODERATION_MODE_LABELS[group.moderation_mode]}")
+    await cq.message.edit_reply_markup(
+        reply_markup=get_group_management_keyboard(group_id, group.moderation_mode, group.local_classifier)
+    )
+
+
+@dispatcher.callback_query(F.data.startswith("toggle_local_classifier_"), ManageGroupContext.viewing_group)
+async def on_toggle_local_classifier_handler(cq: CallbackQuery, state: FSMContext):
+    group_id = int(cq.data.split("_")[-1])
+    group = await GroupInfo.get_or_none(id=group_id, owner_id=cq.from_user.id)
+
+    if not group:
+        await cq.answer("Group not found.", show_alert=True)
+        return
+
+    group.local_classifier = not group.local_classifier
+    await group.save()
+    await invalidate_group(group_id)
+
+    if group.local_classifier and local_classifier.model is None:
+        await cq.answer("Local model on. No model is trained yet, every message still goes to the AI.",
+                        show_alert=True)
+    else:
+        await cq.answer(f"Local model: {'On' if group.local_classifier else 'Off'}")
+    await cq.message.edit_reply_markup(
+        reply_markup=get_group_management_keyboard(group_id, group.moderation_mode, group.local_classifier)
+    )
+
+
 @dispatcher.callback_query(F.data == "back_to_main_menu", ManageGroupContext.viewing_group)
 async def on_back_to_main_menu_handler(cq: CallbackQuery, state: FSMContext):
     await state.clear()
@@ -175,6 +447,8 @@ async def process_forward_message(
         return
 
 
+    admin_roster.store(group_id, (admin.user.id for admin in admins))
+
     if not any(admin.user.id == message.from_user.id for admin in admins):
         await message.answer(
             "You are not an admin in this group. Please contact the group admin to add me, or ensure you are an admin."
@@ -195,6 +469,9 @@ async def process_forward_message(
         return
 
 
+    # The owner may be a brand new user whose row is still queued.
+    await user_writer.flush()
+
     group = await GroupInfo.create(
         id=group_id,
         name=tg_group.title or "Unknown Group",
@@ -202,6 +479,7 @@ async def process_forward_message(
         rules_context="",
         owner_id=message.from_user.id,
     )
+    await invalidate_group(group_id)
 
     await message.answer(
         f"Group {group.name} ({group_id}) has been added successfully."
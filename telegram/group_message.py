@@ -1,19 +1,38 @@
 import asyncio
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timedelta, timezone
 
 from aiogram import F
-from aiogram.types import Message
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import ChatPermissions, Message
 from structlog import get_logger
-from typing_extensions import List, Any, Dict
+from typing_extensions import List, Any, Dict, Tuple
 
-from database.models import GroupInfo, UserGroupMessage
+from clients.openai import MAIN_MODEL, WEAK_MODEL
+from database.group_cache import group_cache
+from database.history import history_buffer, HistoryRecord
+from database.models import GroupInfo, SuspiciousMessage, UserGroupMessage
+from database.writer import message_writer, verdict_id, verdict_writer
+from evaluation.classifier import local_classifier
+from evaluation.fallback import local_verdict
 from evaluation.flag import associate_flag
+from evaluation.flood import MAX_RESTRICT_SECONDS, MIN_RESTRICT_SECONDS, FloodVerdict, flood_detector
+from evaluation.reputation import reputation
+from evaluation.resilience import ProviderUnavailable, llm_guard
+from evaluation.scheduler import evaluation_scheduler
+from evaluation.screen import screen_cache
+from evaluation.verdict_cache import verdict_cache
+from metrics.metrics import LLMUsageRecorder, track_stage
+from telegram.admins import admin_roster
+from telegram.deletions import MAX_IDS_PER_CALL, deletion_scheduler
 from telegram.dispatcher import dispatcher
 
 logger = get_logger()
 
 is_group_chat = F.chat.func(lambda chat: chat.id < 0)
 
+# Seconds before the bot's own notices are deleted
+BOT_MESSAGE_TTL = 30
+
 
 @dispatcher.message(is_group_chat & F.text == "warden:gp_id")
 async def get_group_id(message: Message) -> None:
@@ -23,31 +42,59 @@ async def get_group_id(message: Message) -> None:
     )
 
     await message.delete()
-    await asyncio.sleep(30)
-    await bot_message.delete()
+    await deletion_scheduler.schedule(bot_message.chat.id, bot_message.message_id, delay=BOT_MESSAGE_TTL)
 
 
 @dispatcher.message(is_group_chat)
 async def handle_message(message: Message) -> None:
-    group_info, _ = await GroupInfo.get_or_create(id=message.chat.id, defaults={
+    group_info = await group_cache.get_or_create(message.chat.id, defaults={
         "name": message.chat.title,
         "description": message.chat.description or "",
     })
 
-    user_message_history_qs = await UserGroupMessage.filter(
-        user=message.from_user.id,
-        group=group_info,
-        message_created_at__gte=datetime.now(timezone.utc) - timedelta(minutes=5)
-    ).order_by("-db_created_at").limit(10)
+    # Admins and trusted users aren't moderated, their messages are only logged.
+    skip_reason = await admin_roster.skip_reason(message, group_info.trusted_users)
+    if skip_reason is not None:
+        logger.debug("moderation skipped", chat_id=message.chat.id, user_id=message.from_user.id, reason=skip_reason)
+        await log_current_chat_in_history(message)
+        return
+
+    # Floods and messages that hit the group's own rules are decided right away, without the LLM.
+    flood_limits = flood_detector.limits.for_group(group_info)
+    with track_stage("flood_check"):
+        flood = flood_detector.check(
+            group_info.id, message.from_user.id, message.message_id, message.text or message.caption or "",
+            message.date.timestamp(), flood_limits,
+        )
+    if flood is not None:
+        await asyncio.gather(
+            remove_flood(message, flood, flood_limits.restrict_seconds),
+            log_current_chat_in_history(message),
+            reputation.record(message.from_user.id, message.chat.id, violation=True),
+        )
+        return
+
+    with track_stage("pre_screen"):
+        verdict = screen_cache.screen(group_info.id, group_info.screen_rules, message.text or message.caption or "")
+    if verdict is not None:
+        await asyncio.gather(
+            apply_verdict(message, verdict, screened=True),
+            log_current_chat_in_history(message),
+            reputation.record(message.from_user.id, message.chat.id, violation=True),
+        )
+        return
+
+    with track_stage("history_load"):
+        user_message_history = await history_buffer.recent(message.from_user.id, group_info.id)
 
     # Await both tasks
     await asyncio.gather(
-        process_flag_message(message, group_info, user_message_history_qs),
+        process_flag_message(message, group_info, user_message_history),
         log_current_chat_in_history(message)
     )
 
 
-async def process_flag_message(message: Message, group: GroupInfo, messages_history: list[UserGroupMessage]):
+async def process_flag_message(message: Message, group: GroupInfo, messages_history: list[HistoryRecord]):
     current_time_utc = datetime.now(timezone.utc)
     user_message_history: List[Dict[str, Any]] = [
         {
@@ -58,41 +105,170 @@ async def process_flag_message(message: Message, group: GroupInfo, messages_hist
         for msg in messages_history
     ]
 
-    (flag, action) = await associate_flag(
-        first_name=message.from_user.first_name,
+    async def evaluate(model_name: str = MAIN_MODEL):
+        return await associate_flag(
+            first_name=message.from_user.first_name,
+            message=message.text,
+            group_title=group.name,
+            group_context=group.rules_context,
+            user_message_history=user_message_history,
+            current_time=current_time_utc,
+            model_name=model_name,
+            mode=group.moderation_mode or None,
+            config={"callbacks": [LLMUsageRecorder(group.id)]},
+        )
+
+    async def evaluate_or_fallback(model_name: str = MAIN_MODEL, cache: bool = False):
+        try:
+            with llm_guard.answering_models() as models:
+                result = await evaluate(model_name)
+        except ProviderUnavailable:
+            # Local decisions are never cached, the next message goes to the provider again.
+            return local_verdict(message.text, user_message_history)
+
+        if cache:
+            verdict_cache.put(group.id, message.text, group.name, group.rules_context, group.moderation_mode,
+                              user_message_history, result)
+        # The classification's model, e.g. the weak one when the cascade accepted its answer.
+        classified_by = models.get("initial_flag_content") or models.get("single_pass") or model_name
+        await asyncio.gather(
+            record_reputation(message, result),
+            record_verdict(message, result, classified_by),
+        )
+        return result
+
+    async def degraded_evaluation():
+        # A weak model that is the main one would only add load to an overloaded provider.
+        if WEAK_MODEL == MAIN_MODEL:
+            return local_verdict(message.text, user_message_history)
+        return await evaluate_or_fallback(model_name=WEAK_MODEL)
+
+    verdict = verdict_cache.get(group.id, message.text, group.name, group.rules_context, group.moderation_mode,
+                                user_message_history)
+    cached = verdict is not None
+    classified = False
+    if not cached and group.local_classifier:
+        # Messages the local model is confident about never reach the LLM.
+        with track_stage("local_classifier"):
+            verdict = local_classifier.predict(message.text)
+        classified = verdict is not None
+
+    if verdict is not None:
+        # Only the LLM's own clean verdicts earn credit, reposting a known clean message doesn't.
+        await record_reputation(message, verdict, clean=False)
+    else:
+        # Users with a long clean record are only evaluated on a sample of their messages.
+        if not await reputation.should_evaluate(message.from_user.id, message.chat.id, message.text):
+            return
+
+        verdict = await evaluation_scheduler.submit(
+            group.id,
+            lambda: evaluate_or_fallback(cache=True),
+            degraded=degraded_evaluation,
+        )
+        if verdict is None:
+            return
+
+    await apply_verdict(message, verdict, cached=cached, classified=classified)
+
+
+def should_delete(verdict: Tuple[Any, Any]) -> bool:
+    (flag, action) = verdict
+    if not action or action.user_message_action == "DISMISS":
+        return False
+
+    if flag.classification == "IRRELEVANT_TO_GROUP" and int(action.confidence) <= 3:
+        return False
+
+    return int(action.confidence) > 2
+
+
+async def record_reputation(message: Message, verdict: Tuple[Any, Any], clean: bool = True):
+    # Flagged messages that are let through neither raise nor lower the sender's credit.
+    if should_delete(verdict):
+        await reputation.record(message.from_user.id, message.chat.id, violation=True)
+    elif clean and verdict[0].classification == "CLEAN":
+        await reputation.record(message.from_user.id, message.chat.id, violation=False)
+
+
+async def record_verdict(message: Message, verdict: Tuple[Any, Any], model_name: str):
+    # Only the LLM's own verdicts are kept, they are what the local classifier is trained on.
+    if not message.text:
+        return
+
+    (flag, action) = verdict
+    await verdict_writer.put(SuspiciousMessage(
+        id=verdict_id(message.chat.id, message.message_id),
+        user_id=message.from_user.id,
+        group_id=message.chat.id,
         message=message.text,
-        group_title=group.name,
-        group_context=group.rules_context,
-        user_message_history=user_message_history,
-        current_time=current_time_utc
-    )
+        classification=flag.classification,
+        confidence=flag.confidence,
+        user_message_action=action.user_message_action if action else "",
+        action_confidence=action.confidence if action else "",
+        deleted=should_delete(verdict),
+        model=model_name,
+    ))
+
+
+async def apply_verdict(message: Message, verdict: Tuple[Any, Any], cached: bool = False, screened: bool = False,
+                        classified: bool = False):
+    (flag, action) = verdict
 
     logger.info("flag handled",
                 message_text=message.text,
+                cached=cached,
+                screened=screened,
+                classified=classified,
                 reason=flag.classification if flag else None,
                 action=action.user_message_action if action else None,
                 action_message=action.message_to_user if action else None,
                 confidence=action.confidence if action else None,
                 )
-    if action and action.user_message_action != "DISMISS":
-
-        if flag.classification == "IRRELEVANT_TO_GROUP" and int(action.confidence) <= 3:
-            return
-
-        if int(action.confidence) <= 2:
-            return
-
+    if should_delete(verdict):
         await message.delete()
         bot_message = await message.bot.send_message(
             chat_id=message.chat.id,
             text=f"""{message.from_user.first_name}: {action.message_to_user}"""
         )
-        await asyncio.sleep(30)
-        await bot_message.delete()
+        await deletion_scheduler.schedule(bot_message.chat.id, bot_message.message_id, delay=BOT_MESSAGE_TTL)
+
+
+async def remove_flood(message: Message, flood: FloodVerdict, restrict_seconds: int):
+    logger.info("flood detected", chat_id=message.chat.id, reason=flood.reason, messages=len(flood.message_ids),
+                restricted=len(flood.restrict_user_ids))
+
+    for i in range(0, len(flood.message_ids), MAX_IDS_PER_CALL):
+        chunk = flood.message_ids[i:i + MAX_IDS_PER_CALL]
+        try:
+            await message.bot.delete_messages(chat_id=message.chat.id, message_ids=chunk)
+        except TelegramAPIError as e:
+            logger.warning("flood deletion failed", chat_id=message.chat.id, count=len(chunk), error=str(e))
+
+    # Kept clear of Telegram's limits, where the time the request takes would make the restriction permanent.
+    restrict_seconds = min(max(restrict_seconds, MIN_RESTRICT_SECONDS + 5), MAX_RESTRICT_SECONDS - 5)
+    until = datetime.now(timezone.utc) + timedelta(seconds=restrict_seconds)
+    for user_id in flood.restrict_user_ids:
+        try:
+            await message.bot.restrict_chat_member(
+                chat_id=message.chat.id,
+                user_id=user_id,
+                permissions=ChatPermissions(can_send_messages=False),
+                until_date=until,
+            )
+        except TelegramAPIError as e:
+            logger.warning("flood restriction failed", chat_id=message.chat.id, user_id=user_id, error=str(e))
 
 
 async def log_current_chat_in_history(message: Message):
-    await UserGroupMessage.create(
+    history_buffer.append(message.from_user.id, message.chat.id, HistoryRecord(
+        message_id=message.message_id,
+        text=message.text or message.caption or "",
+        message_created_at=message.date,
+        replied_to_message_text=message.reply_to_message.text if message.reply_to_message else None,
+    ))
+
+    await message_writer.put(UserGroupMessage(
         user_id=message.from_user.id,
         group_id=message.chat.id,
         message_id=message.message_id,
@@ -100,6 +276,7 @@ async def log_current_chat_in_history(message: Message):
         message_created_at=message.date,
         replied_to_message_id=message.reply_to_message.message_id if message.reply_to_message else None,
         replied_to_message_text=message.reply_to_message.text if message.reply_to_message else None,
-    )
+        db_created_at=datetime.now(timezone.utc),
+    ))
 
     logger.info("message logged", text=message.text)
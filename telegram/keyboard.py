@@ -4,6 +4,12 @@ from typing import List
 
 from database.models import GroupInfo
 
+MODERATION_MODE_LABELS = {
+    "": "Default",
+    "two_stage": "Two-stage",
+    "single_pass": "Single-pass",
+}
+
 
 def get_main_menu_keyboard(groups: List[GroupInfo]) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
@@ -16,9 +22,21 @@ def get_main_menu_keyboard(groups: List[GroupInfo]) -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
-def get_group_management_keyboard(group_id: int) -> InlineKeyboardMarkup:
+def get_group_management_keyboard(group_id: int, moderation_mode: str = "",
+                                  local_classifier: bool = False) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="Edit Context", callback_data=f"edit_group_context_{group_id}")
+    kb.button(text="Edit Rules", callback_data=f"edit_group_rules_{group_id}")
+    kb.button(text="Flood Limits", callback_data=f"edit_flood_limits_{group_id}")
+    kb.button(text="Trusted Users", callback_data=f"edit_trusted_users_{group_id}")
+    kb.button(
+        text=f"Mode: {MODERATION_MODE_LABELS.get(moderation_mode, 'Default')}",
+        callback_data=f"toggle_group_mode_{group_id}",
+    )
+    kb.button(
+        text=f"Local Model: {'On' if local_classifier else 'Off'}",
+        callback_data=f"toggle_local_classifier_{group_id}",
+    )
     kb.button(text="Back", callback_data="back_to_main_menu")
     kb.adjust(1)
     return kb.as_markup()
@@ -28,3 +46,11 @@ def get_edit_context_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="Cancel", callback_data="cancel_edit_context")
     return kb.as_markup()
+
+
+def get_edit_rules_keyboard() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Clear Rules", callback_data="clear_group_rules")
+    kb.button(text="Cancel", callback_data="cancel_edit_context")
+    kb.adjust(1)
+    return kb.as_markup()
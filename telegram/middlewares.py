@@ -1,15 +1,21 @@
+import time
 from typing import Callable, Dict, Any, Awaitable
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
 from aiogram.types import Message
 
-from database.models import User
+from database.user_cache import known_users
+from metrics.metrics import telegram_api_errors, telegram_api_seconds
 
 
 class UserMiddleware(BaseMiddleware):
     """
     This middleware saves the user to the database if they don't exist,
     or updates their first name if it has changed.
+    Known users are served from memory and writes are batched.
     """
 
     async def __call__(
@@ -22,12 +28,31 @@ class UserMiddleware(BaseMiddleware):
             user_id = event.from_user.id
             current_first_name = event.from_user.first_name
 
-            user, created = await User.update_or_create(
-                id=user_id,
-                defaults={"first_name": current_first_name}
-            )
+            user, created = await known_users.ensure(user_id, current_first_name)
 
             data["db_user"] = user
             data["user_created"] = created
 
         return await handler(event, data)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Records the duration and failures of every Bot API call, by method.
+    """
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_api_errors.inc(method=name)
+            raise
+        finally:
+            telegram_api_seconds.observe(time.perf_counter() - started, method=name)
@@ -1,13 +1,23 @@
+import asyncio
 import os
+import signal
+from typing import Any, Dict, List, Optional
 
+import aiohttp
 from aiogram import Bot, F
+from aiogram.exceptions import (TelegramAPIError, TelegramConflictError, TelegramNetworkError, TelegramRetryAfter,
+                                TelegramServerError, TelegramUnauthorizedError)
+from aiogram.methods import GetUpdates
 from aiogram.types import Message
 from structlog import get_logger
 
 from database.models import GroupInfo, User
 from telegram import dispatcher
-from telegram.middlewares import UserMiddleware
+from telegram.middlewares import RequestMetricsMiddleware, UserMiddleware
+from telegram.deletions import deletion_scheduler
 from telegram.keyboard import get_main_menu_keyboard
+from telegram.webhook import run_webhook, run_worker_ingress, wait_for_stop_signal
+from warden.workers import WorkerPool
 
 logger = get_logger()
 
@@ -16,13 +26,132 @@ dispatcher.message.middleware(UserMiddleware())
 
 bot: Bot
 
+POLL_TIMEOUT = 30
+# Longest wait between failed getUpdates calls, doubling from one second.
+POLL_MAX_BACKOFF = float(os.getenv("POLL_MAX_BACKOFF", "60"))
 
-async def init_telegram():
+
+async def init_telegram(mode: str = "polling", pool: Optional[WorkerPool] = None):
+    """
+    Receives updates in the given mode. With a worker pool this is the front process and the
+    updates are routed to the workers; in worker mode the updates come from the front.
+    """
     global bot
 
     bot = Bot(token=os.getenv("BOT_TOKEN"))
+    bot.session.middleware(RequestMetricsMiddleware())
+    deletion_scheduler.bind(bot)
+    max_in_flight = int(os.getenv("TELEGRAM_MAX_IN_FLIGHT", "100"))
+
+    if mode == "worker":
+        await run_worker_ingress(dispatcher, bot, max_in_flight=max_in_flight)
+        return
+
+    if mode == "webhook":
+        await run_webhook(dispatcher, bot, max_in_flight=max_in_flight, pool=pool)
+        return
+
+    if pool is not None:
+        await poll_into_pool(bot, pool)
+        return
+
+    # Polling can't receive updates while a webhook is registered.
+    await bot.delete_webhook()
+    await dispatcher.start_polling(bot, tasks_concurrency_limit=max_in_flight)
+
+
+async def get_raw_updates(bot: Bot, offset: Optional[int], allowed_updates: List[str]) -> List[Dict[str, Any]]:
+    """
+    Long-polls getUpdates and returns the updates as the JSON Telegram sent, for routing them
+    without parsing. Failures raise the aiogram exception the Bot client would have raised.
+    """
+    method = GetUpdates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+    session = await bot.session.create_session()
+    try:
+        async with session.post(
+            bot.session.api.api_url(token=bot.token, method="getUpdates"),
+            json=method.model_dump(exclude_none=True),
+            timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + bot.session.timeout),
+        ) as response:
+            status, payload = response.status, await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        raise TelegramNetworkError(method, f"{type(e).__name__}: {e}")
+
+    if payload.get("ok"):
+        return payload["result"]
+
+    description = payload.get("description", "")
+    retry_after = (payload.get("parameters") or {}).get("retry_after")
+    if retry_after is not None:
+        raise TelegramRetryAfter(method, description, retry_after)
+    if status == 401:
+        raise TelegramUnauthorizedError(method, description)
+    if status == 409:
+        raise TelegramConflictError(method, description)
+    if status >= 500:
+        raise TelegramServerError(method, description)
+    raise TelegramAPIError(method, description)
+
+
+async def poll_into_pool(bot: Bot, pool: WorkerPool):
+    """
+    Long-polls Telegram and routes the raw updates to the workers until SIGINT/SIGTERM.
+    """
+    await bot.delete_webhook()
+    allowed_updates = dispatcher.resolve_used_update_types()
+    offset = None
+
+    async def poll():
+        nonlocal offset
+        failures = 0
+        while True:
+            try:
+                for update in await get_raw_updates(bot, offset, allowed_updates):
+                    await pool.route(update)
+                    offset = update["update_id"] + 1
+            except TelegramRetryAfter as e:
+                logger.warning("polling rate limited", retry_after=e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                # Conflicts (another getUpdates consumer) and auth errors may be fixed from outside,
+                # so they're retried like network errors, only less often.
+                failures += 1
+                delay = min(POLL_MAX_BACKOFF, 2.0 ** (failures - 1))
+                log = logger.warning if isinstance(e, (TelegramNetworkError, TelegramServerError)) else logger.error
+                log("polling failed", error=str(e), error_type=type(e).__name__, retry_in=delay)
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+
+    def stopped(task: asyncio.Task):
+        if task.cancelled():
+            return
+        # Polling never ends on its own; if it does, the process stops instead of idling.
+        logger.error("polling stopped unexpectedly, shutting down", error=repr(task.exception()))
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    polling = asyncio.create_task(poll(), name="front-polling")
+    polling.add_done_callback(stopped)
+    logger.info("polling front started", workers=pool.count)
+    try:
+        await wait_for_stop_signal()
+    finally:
+        polling.cancel()
+        try:
+            await polling
+        except (asyncio.CancelledError, Exception):
+            # An unexpected end was already logged by stopped.
+            pass
 
-    await dispatcher.start_polling(bot)
+        if offset is not None:
+            # Confirms the routed updates so Telegram doesn't send them again after a restart.
+            try:
+                await bot.get_updates(offset=offset, timeout=0, limit=1)
+            except Exception as e:
+                logger.warning("confirming polled updates failed", error=str(e))
+        await bot.session.close()
 
 
 @dispatcher.message(F.chat.func(lambda chat: chat.id > 0))  # For private chats
@@ -0,0 +1,236 @@
+import asyncio
+import hmac
+import os
+import signal
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from structlog import get_logger
+
+from metrics.metrics import registry
+from warden.shards import SECRET_HEADER as SHARD_SECRET_HEADER, current_shard, invalidate_group_locally
+from warden.workers import WorkerPool
+
+logger = get_logger()
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookIngress:
+    """
+    aiohttp handler for Telegram webhook updates.
+
+    Requests are authenticated with the secret token and acknowledged right away; the update
+    itself is processed in a background task. At most max_in_flight updates are processed at
+    once and at most max_pending are accepted in total. Beyond that, Telegram gets a 503 and
+    redelivers the update later.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str,
+                 max_in_flight: int = 100, max_pending: int = 1000, secret_header: str = SECRET_HEADER):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.secret_header = secret_header
+        self.max_pending = max(max_pending, max_in_flight)
+
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(self.secret_header, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.unauthorized += 1
+            return web.Response(status=401)
+
+        if len(self._tasks) >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        update = await request.json()
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.accepted += 1
+
+        return web.Response()
+
+    async def drain(self, timeout: float):
+        if not self._tasks:
+            return
+
+        logger.info("draining webhook updates", pending=len(self._tasks))
+        _, still_pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in still_pending:
+            task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "failed": self.failed,
+        }
+
+    async def _process(self, update: Dict[str, Any]):
+        async with self._semaphore:
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update)
+            except Exception as e:
+                self.failed += 1
+                logger.error("webhook update failed", update_id=update.get("update_id"), error=str(e))
+
+
+class ShardedIngress:
+    """
+    Webhook handler of the front process: authenticates updates and queues them for the worker
+    that owns their chat. Answers 503 while that worker's queue is full.
+    """
+
+    def __init__(self, pool: WorkerPool, secret_token: str):
+        self.pool = pool
+        self.secret_token = secret_token
+        self.unauthorized = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.unauthorized += 1
+            return web.Response(status=401)
+
+        if not self.pool.try_route(await request.json()):
+            return web.Response(status=503)
+
+        return web.Response()
+
+    async def drain(self, timeout: float):
+        await self.pool.drain(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"unauthorized": self.unauthorized, **self.pool.stats()}
+
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await stop.wait()
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, max_in_flight: int, app: Optional[web.Application] = None,
+                      pool: Optional[WorkerPool] = None):
+    """
+    Registers the webhook with Telegram and serves it until SIGINT/SIGTERM. With a worker pool,
+    updates are routed to the workers instead of being processed here.
+    """
+    base_url = os.getenv("WEBHOOK_URL", "").rstrip("/")
+    path = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    secret_token = os.getenv("WEBHOOK_SECRET", "")
+    if not base_url or not secret_token:
+        raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET must be set in webhook mode")
+
+    if pool is not None:
+        ingress = ShardedIngress(pool, secret_token=secret_token)
+    else:
+        ingress = WebhookIngress(
+            dispatcher,
+            bot,
+            secret_token=secret_token,
+            max_in_flight=max_in_flight,
+            max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "1000")),
+        )
+
+    registry.register_stats("webhook", ingress.stats)
+
+    app = app or web.Application()
+    app.router.add_post(path, ingress.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=os.getenv("WEBHOOK_HOST", "0.0.0.0"), port=int(os.getenv("WEBHOOK_PORT", "8080")))
+    await site.start()
+
+    try:
+        await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+        await bot.set_webhook(
+            url=f"{base_url}{path}",
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        )
+        logger.info("webhook started", url=f"{base_url}{path}", max_in_flight=max_in_flight)
+
+        await wait_for_stop_signal()
+    finally:
+        # Stop accepting updates first; Telegram keeps undelivered ones for the next start.
+        await runner.cleanup()
+        await ingress.drain(timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")))
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+        await bot.session.close()
+        logger.info("webhook stopped", **ingress.stats())
+
+
+async def run_worker_ingress(dispatcher: Dispatcher, bot: Bot, max_in_flight: int):
+    """
+    Serves the updates of one shard, posted by the front process, until SIGINT/SIGTERM.
+
+    Besides /update there is /health for the front's health checks and /invalidate, which other
+    workers call after editing a group.
+    """
+    ingress = WebhookIngress(
+        dispatcher,
+        bot,
+        secret_token=current_shard.secret,
+        max_in_flight=max_in_flight,
+        max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "1000")),
+        secret_header=SHARD_SECRET_HEADER,
+    )
+    registry.register_stats("worker", ingress.stats)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"shard": current_shard.index, **ingress.stats()})
+
+    async def invalidate(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SHARD_SECRET_HEADER, ""), current_shard.secret):
+            return web.Response(status=401)
+
+        invalidate_group_locally((await request.json())["group_id"])
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/update", ingress.handle)
+    app.router.add_get("/health", health)
+    app.router.add_post("/invalidate", invalidate)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host="127.0.0.1", port=int(os.getenv("WARDEN_WORKER_PORT", "8100"))).start()
+
+    try:
+        await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+        logger.info("worker serving", shard=current_shard.index, shards=current_shard.count)
+
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+        await ingress.drain(timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")))
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+        await bot.session.close()
+        logger.info("worker stopped", shard=current_shard.index, **ingress.stats())
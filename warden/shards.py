@@ -0,0 +1,108 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from structlog import get_logger
+
+from database.group_cache import group_cache
+from evaluation.verdict_cache import verdict_cache
+
+logger = get_logger()
+
+SECRET_HEADER = "X-Warden-Worker-Secret"
+
+# Update types whose chat is found at <type>.chat, or <type>.message.chat for callback queries
+CHAT_UPDATE_TYPES = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "business_message",
+    "edited_business_message", "my_chat_member", "chat_member", "chat_join_request", "message_reaction",
+    "message_reaction_count", "chat_boost", "removed_chat_boost",
+)
+
+
+def shard_for(chat_id: int, shards: int) -> int:
+    return chat_id % shards
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Finds the chat a raw update belongs to, or the user for updates without a chat.
+    """
+    for update_type in CHAT_UPDATE_TYPES:
+        payload = update.get(update_type)
+        if payload is not None:
+            return payload["chat"]["id"]
+
+    callback_query = update.get("callback_query")
+    if callback_query is not None:
+        message = callback_query.get("message")
+        if message is not None:
+            return message["chat"]["id"]
+        return callback_query["from"]["id"]
+
+    for payload in update.values():
+        if isinstance(payload, dict) and "from" in payload:
+            return payload["from"]["id"]
+
+    return None
+
+
+@dataclass
+class ShardInfo:
+    """
+    This process's place in a sharded deployment. Set up by the worker pool through the
+    environment; a single-process bot is shard 0 of 1.
+    """
+    index: int = 0
+    count: int = 1
+    peers: List[str] = field(default_factory=list)
+    secret: str = ""
+
+    @property
+    def sharded(self) -> bool:
+        return self.count > 1
+
+    def owns(self, chat_id: int) -> bool:
+        return shard_for(chat_id, self.count) == self.index
+
+    @classmethod
+    def from_env(cls) -> "ShardInfo":
+        peers = os.getenv("WARDEN_SHARD_PEERS", "")
+        return cls(
+            index=int(os.getenv("WARDEN_SHARD_INDEX", "0")),
+            count=int(os.getenv("WARDEN_SHARD_COUNT", "1")),
+            peers=[peer for peer in peers.split(",") if peer],
+            secret=os.getenv("WARDEN_SHARD_SECRET", ""),
+        )
+
+
+current_shard = ShardInfo.from_env()
+
+
+def invalidate_group_locally(group_id: int):
+    group_cache.invalidate(group_id)
+    verdict_cache.invalidate_group(group_id)
+
+
+async def invalidate_group(group_id: int):
+    """
+    Drops a group's cached settings and verdicts after an edit. Groups are edited from the owner's
+    private chat, which may belong to another worker than the group, so the other workers are
+    told as well.
+    """
+    invalidate_group_locally(group_id)
+    if not current_shard.peers:
+        return
+
+    async def notify(session: aiohttp.ClientSession, peer: str):
+        try:
+            async with session.post(f"{peer}/invalidate", json={"group_id": group_id},
+                                    headers={SECRET_HEADER: current_shard.secret}) as response:
+                response.raise_for_status()
+        except Exception as e:
+            # The group's entries still expire with the cache ttl.
+            logger.warning("group invalidation not delivered", peer=peer, group_id=group_id, error=str(e))
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        await asyncio.gather(*(notify(session, peer) for peer in current_shard.peers))
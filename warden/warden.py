@@ -1,23 +1,123 @@
-from typing import Any
+import os
+from typing import Any, Optional, Sequence
 
 from structlog import get_logger
-from typing_extensions import Callable
+from typing_extensions import Callable, Protocol
+
+from warden.workers import WorkerPool
 
 logger = get_logger()
 
+TELEGRAM_MODES = ("polling", "webhook", "worker")
+
+
+class Service(Protocol):
+    """
+    Background component started after the database and stopped on shutdown.
+    """
+
+    async def start(self): ...
+
+    async def stop(self): ...
+
 
 class Warden:
     init_db: Callable[..., Any]
+    close_db: Optional[Callable[..., Any]]
     telegram: Callable[..., Any]
+    telegram_mode: str
+    init_clients: Optional[Callable[..., Any]]
+    close_clients: Optional[Callable[..., Any]]
+    services: Sequence[Service]
+    workers: int
+
+    def __init__(self, init_telegram: Callable, init_db: Callable,
+                 init_clients: Optional[Callable] = None, close_clients: Optional[Callable] = None,
+                 close_db: Optional[Callable] = None, services: Sequence[Service] = (),
+                 telegram_mode: str = "polling", workers: int = 1):
+        if telegram_mode not in TELEGRAM_MODES:
+            raise ValueError(f"Unknown telegram mode: {telegram_mode}")
+        if workers > 1 and telegram_mode == "worker":
+            raise ValueError("A worker can't run workers of its own")
 
-    def __init__(self, init_telegram: Callable, init_db: Callable):
         self.telegram = init_telegram
         self.init_db = init_db
+        self.close_db = close_db
+        self.init_clients = init_clients
+        self.close_clients = close_clients
+        self.services = services
+        self.telegram_mode = telegram_mode
+        self.workers = workers
 
     async def start(self):
+        if self.workers > 1:
+            await self.start_front()
+            return
+
         logger.info("Starting Warden")
 
         await self.init_db()
         logger.info("Database initialized")
 
-        await self.telegram()
+        try:
+            for service in self.services:
+                await service.start()
+            logger.info("Services started", count=len(self.services))
+
+            if self.init_clients:
+                await self.init_clients()
+                logger.info("LLM clients initialized")
+
+            logger.info("Starting Telegram", mode=self.telegram_mode)
+            await self.telegram(mode=self.telegram_mode)
+        finally:
+            await self.shutdown()
+
+    async def start_front(self):
+        """
+        Runs as the front process of a sharded bot: receives updates and routes them by chat id
+        to worker processes, each running a full Warden in worker mode.
+        """
+        logger.info("Starting Warden front", workers=self.workers)
+
+        # Workers share the database, set it up once here instead of racing on it.
+        await self.init_db()
+        if self.close_db:
+            await self.close_db()
+        logger.info("Database initialized")
+
+        pool = WorkerPool(
+            self.workers,
+            base_port=int(os.getenv("WARDEN_WORKER_BASE_PORT", "8100")),
+            max_pending=int(os.getenv("WARDEN_WORKER_MAX_PENDING", "1000")),
+            health_interval=float(os.getenv("WARDEN_WORKER_HEALTH_INTERVAL", "5")),
+            max_health_failures=int(os.getenv("WARDEN_WORKER_MAX_HEALTH_FAILURES", "3")),
+            startup_timeout=float(os.getenv("WARDEN_WORKER_STARTUP_TIMEOUT", "120")),
+            drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")),
+        )
+        await pool.start()
+
+        try:
+            logger.info("Starting Telegram front", mode=self.telegram_mode)
+            await self.telegram(mode=self.telegram_mode, pool=pool)
+        finally:
+            logger.info("Shutting down Warden front")
+            await pool.stop()
+
+    async def shutdown(self):
+        logger.info("Shutting down Warden")
+
+        # Services may still hold buffered writes, stop them while the database is open.
+        for service in reversed(self.services):
+            try:
+                await service.stop()
+            except Exception as e:
+                logger.error("Service failed to stop", service=type(service).__name__, error=str(e))
+
+        if self.close_clients:
+            await self.close_clients()
+            logger.info("LLM clients closed")
+
+        if self.close_db:
+            await self.close_db()
+            logger.info("Database closed")
@@ -0,0 +1,270 @@
+import asyncio
+import os
+import secrets
+import signal
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from structlog import get_logger
+
+from warden.shards import SECRET_HEADER, shard_for, update_chat_id
+
+logger = get_logger()
+
+
+class WorkerProcess:
+    """
+    One bot worker process serving a shard, restarted with backoff whenever it exits.
+    """
+
+    def __init__(self, index: int, url: str, command: Sequence[str], env: Dict[str, str],
+                 drain_timeout: float = 30):
+        self.index = index
+        self.url = url
+        self.command = list(command)
+        self.env = env
+        self.drain_timeout = drain_timeout
+
+        self.restarts = 0
+        self.health_failures = 0
+        self.ready = False
+        self.started_at = 0.0
+
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process else None
+
+    async def start(self):
+        self._stopping = False
+        self._supervisor = asyncio.create_task(self._supervise(), name=f"worker-{self.index}")
+
+    async def restart(self):
+        """
+        Kills a worker that stopped responding; the supervisor starts a new one.
+        """
+        if self._process is not None and self._process.returncode is None:
+            logger.warning("restarting unhealthy worker", shard=self.index, pid=self._process.pid)
+            self._process.kill()
+
+    async def stop(self):
+        self._stopping = True
+
+        process = self._process
+        if process is not None and process.returncode is None:
+            # The worker stops taking updates, finishes the ones it has and flushes its writers.
+            process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.drain_timeout + 10)
+            except asyncio.TimeoutError:
+                logger.warning("worker did not stop in time, killing it", shard=self.index, pid=process.pid)
+                process.kill()
+                await process.wait()
+
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+
+    async def _supervise(self):
+        backoff = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            # A new session keeps Ctrl+C in the terminal away from the workers, the front stops them in order.
+            self._process = await asyncio.create_subprocess_exec(*self.command, env=self.env, start_new_session=True)
+            self.health_failures = 0
+            self.ready = False
+            self.started_at = time.monotonic()
+            logger.info("worker started", shard=self.index, pid=self._process.pid)
+
+            returncode = await self._process.wait()
+            if self._stopping:
+                return
+
+            self.restarts += 1
+            # Crash loops back off, a worker that ran for a while is restarted right away.
+            backoff = 1.0 if time.monotonic() - started > 60 else min(backoff * 2, 30.0)
+            logger.error("worker exited", shard=self.index, returncode=returncode, restart_in=backoff)
+            await asyncio.sleep(backoff)
+
+
+class WorkerPool:
+    """
+    Runs one bot worker process per shard and routes raw updates to them by chat id.
+
+    Every shard has its own bounded queue and a single sender that posts updates to the worker
+    in order, so the updates of a chat always reach the same worker in the order they arrived.
+    While a worker is down its updates wait in the queue; once a queue is full the front applies
+    backpressure (polling waits, the webhook answers 503).
+
+    Workers are health-checked every health_interval seconds and restarted after
+    max_health_failures failed checks in a row, or when they don't become healthy within
+    startup_timeout seconds.
+    """
+
+    def __init__(self, workers: int, base_port: int = 8100, max_pending: int = 1000,
+                 health_interval: float = 5, max_health_failures: int = 3, startup_timeout: float = 120,
+                 drain_timeout: float = 30, command: Optional[Sequence[str]] = None):
+        self.count = workers
+        self.base_port = base_port
+        self.max_pending = max_pending
+        self.health_interval = health_interval
+        self.max_health_failures = max_health_failures
+        self.startup_timeout = startup_timeout
+        self.drain_timeout = drain_timeout
+        self.command = list(command) if command else [sys.executable, os.path.abspath(sys.argv[0]), *sys.argv[1:]]
+
+        self.secret = secrets.token_urlsafe(32)
+        self.workers: List[WorkerProcess] = []
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        self.routed = 0
+        self.rejected = 0
+        self.delivery_retries = 0
+
+    async def start(self):
+        urls = [f"http://127.0.0.1:{self.base_port + index}" for index in range(self.count)]
+        metrics_port = int(os.getenv("METRICS_PORT", "0") or 0)
+
+        for index, url in enumerate(urls):
+            env = dict(os.environ)
+            env.update({
+                "WARDEN_WORKERS": "1",
+                "TELEGRAM_MODE": "worker",
+                "WARDEN_WORKER_PORT": str(self.base_port + index),
+                "WARDEN_SHARD_INDEX": str(index),
+                "WARDEN_SHARD_COUNT": str(self.count),
+                "WARDEN_SHARD_PEERS": ",".join(peer for peer in urls if peer != url),
+                "WARDEN_SHARD_SECRET": self.secret,
+                # Every worker serves its own metrics, on consecutive ports.
+                "METRICS_PORT": str(metrics_port + index if metrics_port else 0),
+            })
+            self.workers.append(WorkerProcess(index, url, self.command, env, drain_timeout=self.drain_timeout))
+
+        self._session = aiohttp.ClientSession(headers={SECRET_HEADER: self.secret})
+        for worker in self.workers:
+            queue = asyncio.Queue(maxsize=self.max_pending)
+            self._queues.append(queue)
+            await worker.start()
+            self._tasks.append(asyncio.create_task(self._send(worker, queue), name=f"worker-{worker.index}-sender"))
+
+        self._tasks.append(asyncio.create_task(self._check_health(), name="worker-health"))
+        logger.info("worker pool started", workers=self.count)
+
+    async def route(self, update: Dict[str, Any]):
+        """
+        Queues an update for its shard, waiting while the shard's queue is full.
+        """
+        await self._queues[self._shard(update)].put(update)
+        self.routed += 1
+
+    def try_route(self, update: Dict[str, Any]) -> bool:
+        try:
+            self._queues[self._shard(update)].put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+        self.routed += 1
+        return True
+
+    async def drain(self, timeout: float):
+        """
+        Waits until every queued update was handed to a worker.
+        """
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("updates left undelivered", count=sum(queue.qsize() for queue in self._queues))
+
+    async def stop(self):
+        await self.drain(self.drain_timeout)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        logger.info("worker pool stopped", **self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.count,
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "routed": self.routed,
+            "rejected": self.rejected,
+            "delivery_retries": self.delivery_retries,
+            "restarts": sum(worker.restarts for worker in self.workers),
+            "ready": sum(worker.ready for worker in self.workers),
+        }
+
+    def _shard(self, update: Dict[str, Any]) -> int:
+        chat_id = update_chat_id(update)
+        return shard_for(chat_id, self.count) if chat_id is not None else 0
+
+    async def _send(self, worker: WorkerProcess, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self._deliver(worker, update)
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, worker: WorkerProcess, update: Dict[str, Any]):
+        delay = 0.1
+        while True:
+            try:
+                async with self._session.post(f"{worker.url}/update", json=update,
+                                              timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    # 503 means the worker is at capacity, anything else but 200 is a bug.
+                    if response.status == 200:
+                        return
+                    if response.status != 503:
+                        logger.error("worker rejected update", shard=worker.index, status=response.status,
+                                     update_id=update.get("update_id"))
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # The worker is starting or restarting.
+                pass
+
+            self.delivery_retries += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    async def _check_health(self):
+        timeout = aiohttp.ClientTimeout(total=min(self.health_interval, 5))
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for worker in self.workers:
+                try:
+                    async with self._session.get(f"{worker.url}/health", timeout=timeout) as response:
+                        healthy = response.status == 200
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    healthy = False
+
+                if healthy:
+                    worker.ready = True
+                    worker.health_failures = 0
+                elif worker.ready:
+                    worker.health_failures += 1
+                    if worker.health_failures >= self.max_health_failures:
+                        worker.health_failures = 0
+                        await worker.restart()
+                elif time.monotonic() - worker.started_at > self.startup_timeout:
+                    await worker.restart()